@@ -65,6 +65,13 @@ class ALU:
         """
         return sign_extend(~(bin_to_int_signed(a, 32) | bin_to_int_signed(b, 32)), 32)
 
+    @staticmethod
+    def slt(a: str, b: str) -> str:
+        """
+        1 if a < b (signed) else 0
+        """
+        return sign_extend(int(bin_to_int_signed(a, 32) < bin_to_int_signed(b, 32)), 32)
+
     @staticmethod
     def sll(a: str, n: int) -> str:
         """
@@ -75,9 +82,9 @@ class ALU:
     @staticmethod
     def srl(a: str, n: int) -> str:
         """
-        a >> n
+        a >> n, logical: zeros are shifted in
         """
-        return sign_extend(bin_to_int_signed(a, 32) >> n, 32)
+        return sign_extend(int(a, 2) >> n, 32)
 
     @staticmethod
     def mult(m: str, q: str, bits_no=16) -> str:  # skipcq: PYL-W0621
@@ -0,0 +1,334 @@
+"""
+Benchmark suite for the simulator hot paths.
+
+Every benchmark is a setup function registered with @benchmark(name). It
+builds whatever state it needs and returns the callable to time together
+with the number of operations one call performs (1 for the micro
+benchmarks, simulated cycles for the end-to-end runs). Results are stored
+as json and can be compared with a saved baseline:
+
+    python Benchmark.py                          # run and print
+    python Benchmark.py --save baseline.json     # store the results
+    python Benchmark.py --compare baseline.json  # fail on slowdowns
+
+startup.first_cycle times `import main` up to the end of the first
+simulated cycle in a new process. it and the other benchmarks listed in
+BUDGETS fail when they take longer than their budget.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from typing import Any, Callable, Iterator
+
+from Alu import ALU
+from BinFuncs import sign_extend, bin_to_int_signed, bin_to_int_unsigned, bin_sign_extend
+from Cache import Cache
+from Isa import assemble_program
+from Memory import Memory
+from PipelineRegister import PipelineRegister, ExMem
+from Register import RegFile
+
+Setup = Callable[[], tuple[Callable[[], Any], int]]
+BENCHMARKS: dict[str, Setup] = {}
+# name -> seconds one call may take at most
+BUDGETS: dict[str, float] = {'startup.first_cycle': 0.050}
+
+# representative programs for the end-to-end runs
+PROGRAMS = {
+    'alu_chain': '\n'.join(['addi $8 $0 1'] + ['add $8 $8 $8'] * 32),
+    'alu_independent': '\n'.join(f'addi ${8 + i % 8} $0 {i}' for i in range(32)),
+    'mem_stream': '\n'.join(f'lw $8 {8 * i} $0\nsw $0 {8 * i + 1} $0'
+                            for i in range(16)),
+}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """
+    the simulator prints while it works, keep that out of the measurements
+    """
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        yield
+
+
+# ************************** BinFuncs **************************
+
+@benchmark('binfuncs.sign_extend')
+def _sign_extend() -> tuple[Callable[[], Any], int]:
+    return lambda: sign_extend(-12345, 32), 1
+
+
+@benchmark('binfuncs.bin_to_int_signed')
+def _bin_to_int_signed() -> tuple[Callable[[], Any], int]:
+    val = sign_extend(-12345, 32)
+    return lambda: bin_to_int_signed(val, 32), 1
+
+
+@benchmark('binfuncs.bin_to_int_unsigned')
+def _bin_to_int_unsigned() -> tuple[Callable[[], Any], int]:
+    val = sign_extend(12345, 32)
+    return lambda: bin_to_int_unsigned(val), 1
+
+
+@benchmark('binfuncs.bin_sign_extend')
+def _bin_sign_extend() -> tuple[Callable[[], Any], int]:
+    return lambda: bin_sign_extend('1000000000000001', 32), 1
+
+
+# ************************** ALU **************************
+
+@benchmark('alu.add')
+def _alu_add() -> tuple[Callable[[], Any], int]:
+    a, b = sign_extend(123456, 32), sign_extend(-654321, 32)
+    return lambda: ALU.add(a, b), 1
+
+
+@benchmark('alu.nor')
+def _alu_nor() -> tuple[Callable[[], Any], int]:
+    a, b = sign_extend(123456, 32), sign_extend(-654321, 32)
+    return lambda: ALU.nor(a, b), 1
+
+
+@benchmark('alu.sll')
+def _alu_sll() -> tuple[Callable[[], Any], int]:
+    a = sign_extend(123456, 32)
+    return lambda: ALU.sll(a, 7), 1
+
+
+@benchmark('alu.mult')
+def _alu_mult() -> tuple[Callable[[], Any], int]:
+    m, q = sign_extend(1234, 16), sign_extend(-321, 16)
+    return lambda: ALU.mult(m, q), 1
+
+
+# ************************** Cache **************************
+
+def _new_cache() -> Cache:
+    mem = Memory()
+    for index in range(4096):
+        mem[index] = sign_extend(index, 32)
+    return Cache(mem, 256, 32, 2)
+
+
+@benchmark('cache.hit')
+def _cache_hit() -> tuple[Callable[[], Any], int]:
+    cache = _new_cache()
+    address = sign_extend(5, 32)
+    cache[address]  # skipcq: PYL-W0104
+    return lambda: cache[address], 1
+
+
+@benchmark('cache.miss')
+def _cache_miss() -> tuple[Callable[[], Any], int]:
+    # the same set alternating between three tags never hits in a 2-way set
+    cache = _new_cache()
+    addresses = [sign_extend(i * cache.sets_no * cache.blocks_in_line, 32)
+                 for i in range(3)]
+    state = {'i': 0}
+
+    def run() -> None:
+        state['i'] = (state['i'] + 1) % 3
+        cache[addresses[state['i']]]  # skipcq: PYL-W0104
+    return run, 1
+
+
+@benchmark('cache.write_eviction')
+def _cache_eviction() -> tuple[Callable[[], Any], int]:
+    # dirty the victim way before every fill so each fill writes back a line
+    cache = _new_cache()
+    addresses = [sign_extend(i * cache.sets_no * cache.blocks_in_line, 32)
+                 for i in range(3)]
+    state = {'i': 0}
+    word = '1' * 32
+
+    def run() -> None:
+        state['i'] = (state['i'] + 1) % 3
+        address = addresses[state['i']]
+        cache[address] = word
+        cache.__setitem__(address, word, 'mem')
+    return run, 1
+
+
+# ************************** RegFile **************************
+
+@benchmark('regfile.read')
+def _regfile_read() -> tuple[Callable[[], Any], int]:
+    regs = RegFile()
+    return lambda: regs[17], 1
+
+
+@benchmark('regfile.write')
+def _regfile_write() -> tuple[Callable[[], Any], int]:
+    regs = RegFile()
+
+    def run() -> None:
+        regs[17] = 42
+    return run, 1
+
+
+# ************************** PipelineRegister **************************
+
+@benchmark('pipeline_register.commit')
+def _pipeline_register_commit() -> tuple[Callable[[], Any], int]:
+    # what every clock does to one latch: a stage fills nxt, commit swaps
+    reg = PipelineRegister('ex_mem', ExMem)
+
+    def run() -> None:
+        out = reg.nxt
+        out.valid = True
+        out.pc = 4
+        out.alu_out = '0' * 32
+        out.store_val = '0' * 32
+        reg.commit()
+    return run, 1
+
+
+# ************************** end to end **************************
+
+def _program_benchmark(text: str | None) -> Setup:
+    def setup() -> tuple[Callable[[], Any], int]:
+        import main  # pylint: disable=import-outside-toplevel
+        program = main.load_program() if text is None else assemble_program(text)
+        cycles = int(main.run_program(program)['cycles'])
+        return lambda: main.run_program(program), cycles
+    return setup
+
+
+BENCHMARKS['simulate.instructions_txt'] = _program_benchmark(None)
+for _name, _text in PROGRAMS.items():
+    BENCHMARKS[f'simulate.{_name}'] = _program_benchmark(_text)
+
+
+# ************************** startup **************************
+
+# timed in a new interpreter from `import main` to the end of the first
+# simulated cycle, what every short run started from a script pays on top
+# of starting python
+STARTUP_CODE = '''
+import time
+start = time.perf_counter()
+import contextlib, os
+with open(os.devnull, 'w', encoding='utf-8') as devnull, \\
+        contextlib.redirect_stdout(devnull):
+    import main
+    main.run_program(['0' * 32], max_cycles=1)
+print(time.perf_counter() - start)
+'''
+
+
+def measure_startup(repeat: int = 5) -> dict[str, float]:
+    """
+    best of `repeat` fresh processes, their own interpreter startup is not
+    counted
+    """
+    command = [sys.executable, '-c', STARTUP_CODE]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    best = min(float(subprocess.run(command, cwd=cwd, check=True,
+                                    capture_output=True, text=True).stdout)
+               for _ in range(repeat))
+    return {'sec_per_op': best, 'ops_per_sec': 1 / best, 'ops_per_call': 1}
+
+
+# ************************** runner **************************
+
+def measure(setup: Setup, repeat: int = 5) -> dict[str, float]:
+    """
+    time one benchmark, the best of `repeat` runs is kept because the
+    slower runs only measure noise from the rest of the machine
+    """
+    with quiet():
+        func, ops_per_call = setup()
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {'sec_per_op': best / ops_per_call,
+            'ops_per_sec': ops_per_call / best,
+            'ops_per_call': ops_per_call}
+
+
+def run_benchmarks(pattern: str = '', repeat: int = 5) -> dict[str, Any]:
+    results = {}
+    if pattern in 'startup.first_cycle':
+        results['startup.first_cycle'] = measure_startup(repeat)
+    for name, setup in BENCHMARKS.items():
+        if pattern in name:
+            results[name] = measure(setup, repeat)
+    return {'meta': {'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any],
+            threshold: float = 0.10) -> list[str]:
+    """
+    names of the benchmarks that got slower than the baseline by more
+    than `threshold` (0.10 -> 10%)
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['sec_per_op'] / base['sec_per_op']
+        if ratio > 1 + threshold:
+            regressions.append(name)
+        result['baseline_ratio'] = ratio
+    return regressions
+
+
+def print_results(results: dict[str, Any]) -> None:
+    for name, result in results['results'].items():
+        line = f'{name:36} {result["sec_per_op"] * 1e9:14.1f} ns/op' \
+               f' {result["ops_per_sec"]:14.1f} op/s'
+        if 'baseline_ratio' in result:
+            line += f'  x{result["baseline_ratio"]:.2f} vs baseline'
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--compare', help='baseline json file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed slowdown before failing (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.filter, args.repeat)
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    for name in regressions:
+        print(f'regression: {name}')
+    over_budget = [name for name, budget in BUDGETS.items()
+                   if name in results['results'] and
+                   results['results'][name]['sec_per_op'] > budget]
+    for name in over_budget:
+        print(f'over budget: {name} ({BUDGETS[name] * 1e3:.0f} ms)')
+    return 1 if regressions or over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,11 +7,8 @@ def sign_extend(val: int, bits_no: int) -> str:
     """
     turn integer to a 2's complement binary string
     """
-    if val >= 2**bits_no:
-        return bin(val)[-bits_no:]
-    if val < 0:
-        return bin(val & (2**bits_no-1))[2:]
-    return '0' * (bits_no - len(bin(val))) + 2*'0' + bin(val)[2:]
+    # values that do not fit keep their low `bits_no` bits
+    return f'{val & (2**bits_no - 1):0{bits_no}b}'
 
 
 def bin_to_int_signed(val: str, bits_no: int) -> int:
@@ -1,12 +1,36 @@
 """
-level one 2-way set-associative MSI cache with write-back policy and write-allocate policy
+level one 2-way set-associative MSI cache
 each block have one of the following states:
     invalid
     shared  -> valid, not modified
     modified
+
+write policies, chosen when the cache is built:
+    write_policy='write_back'    -> a store only marks its word modified, the
+                                    word goes to memory when its line is
+                                    evicted
+    write_policy='write_through' -> every store also goes to memory through
+                                    a coalescing store buffer, lines are
+                                    never dirty
+    write_allocate=True          -> a store miss fills the line first
+    write_allocate=False         -> a store miss goes around the cache, to
+                                    memory through the store buffer
+
+traffic to the next level is counted in bytes: a fill reads a whole line,
+a write-back writes the modified words of the victim and the store buffer
+writes every word it holds once, however often it was stored to while
+queued.
+
+the time a line takes to come from memory is `miss_latency`, unless the
+memory is a Dram: then fills, write-backs and store buffer drains are
+requests to the DRAM model and take what its banks and bus make of them.
 """
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from Dram import Dram
 from Memory import Memory
-from BinFuncs import sign_extend, bin_to_int_unsigned
+from BinFuncs import bin_to_int_unsigned
+from Prefetcher import Prefetcher
 
 
 class Block:
@@ -28,64 +52,352 @@ class Block:
         return self.__str__()
 
 
+WRITE_POLICIES = ('write_back', 'write_through')
+WORD_BYTES = 4
+
+
+class StoreBuffer:
+    """
+    words on their way to memory, one entry per line. a store to a line
+    that is still queued merges into its entry, entries drain one after
+    the other in `latency` cycles each
+    """
+
+    def __init__(self, entries: int = 4, latency: int = 0) -> None:
+        self.entries = entries
+        self.latency = latency
+        # (line, cycle) -> cycle the entry is written, `latency` cycles
+        # after it starts if None
+        self.drain: Optional[Callable[[int, int], int]] = None
+        self.reset()
+
+    def reset(self) -> None:
+        # line -> [cycle it has been written to memory, offsets of its words]
+        self.queue: OrderedDict[int, list] = OrderedDict()
+        self.port_free = 0
+        self.writes = self.coalesced = self.full_stalls = 0
+
+    def retire(self, cycle: int) -> None:
+        while self.queue and next(iter(self.queue.values()))[0] <= cycle:
+            self.queue.popitem(last=False)
+
+    def push(self, line: int, offset: int, cycle: int) -> tuple[int, bool]:
+        """
+        queue the word `offset` of `line`. returns the cycle the buffer took
+        it in and whether it is a word memory has to be sent
+        """
+        self.retire(cycle)
+        entry = self.queue.get(line)
+        if entry is not None:
+            if offset in entry[1]:
+                self.coalesced += 1
+                return cycle, False
+            entry[1].add(offset)
+            return cycle, True
+        if len(self.queue) >= self.entries:
+            self.full_stalls += 1
+            cycle = next(iter(self.queue.values()))[0]
+            self.retire(cycle)
+        start = max(self.port_free, cycle)
+        self.port_free = self.drain(line, start) if self.drain else start + self.latency
+        self.queue[line] = [self.port_free, {offset}]
+        self.writes += 1
+        return cycle, True
+
+    def stats(self) -> dict[str, float]:
+        return {'store_buffer_writes': self.writes,
+                'store_buffer_coalesced': self.coalesced,
+                'store_buffer_full_stalls': self.full_stalls}
+
+
 class Cache:
     """
-    n-way set-associative cache with write-allocation and write-back policy
+    n-way set-associative cache, write-back / write-through and
+    write-allocate / no-write-allocate
     """
 
     def __init__(self, mem: Memory, cache_size: int,
-                 line_of_data_size: int, associativity: int) -> None:
+                 line_of_data_size: int, associativity: int,
+                 miss_latency: int = 0, write_policy: str = 'write_back',
+                 write_allocate: bool = True, store_buffer_size: int = 4,
+                 store_latency: Optional[int] = None) -> None:
+        if write_policy not in WRITE_POLICIES:
+            raise ValueError(f'write_policy must be one of {WRITE_POLICIES}')
+        self.write_policy = write_policy
+        self.write_allocate = write_allocate
+        # a word written to memory costs about as much as a miss
+        self.store_buffer = StoreBuffer(
+            store_buffer_size, miss_latency if store_latency is None else store_latency)
         self.mem = mem
+        self.dram = mem if isinstance(mem, Dram) else None
+        if self.dram is not None:
+            self.store_buffer.drain = self._drain_store
         self.cache_size = cache_size
         self.line_of_data_size = line_of_data_size
         self.associativity = associativity
         self.blocks_no = cache_size // line_of_data_size
         self.sets_no = self.blocks_no // associativity
-        # 0 means we have to replace the way 0
-        self.lru = [0] * self.sets_no
         self.logic_set_bits_no = self.sets_no.bit_length()-1
         self.block_offset_bits_no = (line_of_data_size // 4).bit_length()-1
         self.tag_bits_no = 32 - self.logic_set_bits_no - self.block_offset_bits_no
         self.blocks_in_line = line_of_data_size // 4  # 4 bytes per word
+        self.miss_latency = miss_latency
+        self.prefetcher: Optional[Prefetcher] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        invalidate every block without writing anything back
+        """
+        self.hits = self.misses = 0
+        self.bytes_read = self.bytes_written = 0
+        self.accepted = 0
+        self.store_buffer.reset()
+        if self.dram is not None:
+            self.dram.reset()
+        # line -> cycle in which its prefetch completes, until first used
+        self.prefetched: dict[int, int] = {}
+        # (line, cycle) asked for by the prefetcher, issued once the demand
+        # access that triggered them has been filled
+        self.pending_prefetches: list[tuple[int, int]] = []
+        if self.prefetcher is not None:
+            self.prefetcher.reset()
+        # 0 means we have to replace the way 0
+        self.lru = [0] * self.sets_no
         self.blocks = [
             [[Block('0'*self.tag_bits_no, '0'*32)
               for _i in range(self.blocks_in_line)]
-             for _j in range(associativity)] for _ in range(self.sets_no)
+             for _j in range(self.associativity)] for _ in range(self.sets_no)
         ]
 
+    def line_address(self, tag: str, logic_set: int, offset: int) -> int:
+        """
+        memory address of word `offset` of a line
+        """
+        return bin_to_int_unsigned(tag + f'{logic_set:0{self.logic_set_bits_no}b}' +
+                                   f'{offset:0{self.block_offset_bits_no}b}')
+
+    def split(self, address: str) -> tuple[str, int, int]:
+        """
+        address -> (tag, logic_set, block_offset)
+        """
+        return (address[:self.tag_bits_no],
+                int(address[self.tag_bits_no:self.tag_bits_no +
+                            self.logic_set_bits_no] or '0', 2),
+                int(address[self.tag_bits_no+self.logic_set_bits_no:], 2))
+
+    def probe(self, address: str) -> bool:
+        """
+        True if a read of address would hit, without changing the cache
+        """
+        tag, logic_set, block_offset = self.split(address)
+        return any(way[block_offset].tag == tag and
+                   way[block_offset].state != 'invalid'
+                   for way in self.blocks[logic_set])
+
+    def find(self, tag: str, logic_set: int, block_offset: int) -> Optional[int]:
+        """
+        the way holding the word, None on a miss
+        """
+        for way, blocks in enumerate(self.blocks[logic_set]):
+            block = blocks[block_offset]
+            if block.tag == tag and block.state != 'invalid':
+                return way
+        return None
+
+    def touch(self, logic_set: int, way: int) -> None:
+        """
+        `way` was just filled or written, replace another one next
+        """
+        self.lru[logic_set] = (way + 1) % self.associativity
+
+    def is_dirty(self, logic_set: int, way: int) -> bool:
+        return any(block.state == 'modified'
+                   for block in self.blocks[logic_set][way])
+
+    def evict(self, logic_set: int, way: int) -> None:
+        """
+        write the modified words of a way back to memory before it is replaced
+        """
+        if self.prefetched and self.blocks[logic_set][way][0].state != 'invalid':
+            line = int(self.blocks[logic_set][way][0].tag +
+                       f'{logic_set:0{self.logic_set_bits_no}b}'[:self.logic_set_bits_no], 2)
+            if self.prefetched.pop(line, None) is not None and self.prefetcher:
+                self.prefetcher.useless += 1
+        for i, block in enumerate(self.blocks[logic_set][way]):
+            if block.state == 'modified':
+                self.mem[self.line_address(block.tag, logic_set, i)] = block.data
+                self.bytes_written += WORD_BYTES
+
+    def line_no(self, address: str) -> int:
+        return bin_to_int_unsigned(address) >> self.block_offset_bits_no
+
+    def attach_prefetcher(self, prefetcher: Prefetcher) -> None:
+        prefetcher.line_shift = self.block_offset_bits_no
+        self.prefetcher = prefetcher
+
+    def demand_prefetched(self, address: str, cycle: int) -> Optional[int]:
+        """
+        first demand access to a prefetched line: count it and return the
+        cycle its data is there, None if the line was not prefetched
+        """
+        if not self.prefetched or self.prefetcher is None:
+            return None
+        ready = self.prefetched.pop(self.line_no(address), None)
+        if ready is not None:
+            self.prefetcher.on_useful(late=ready > cycle)
+        return ready
+
+    def issue_prefetch(self, line: int, cycle: int) -> None:
+        """
+        the blocking cache fills the line right away, its data counts as
+        arriving when a fill issued in `cycle` would
+        """
+        address = f'{line << self.block_offset_bits_no:032b}'
+        if len(address) > 32 or line in self.prefetched or self.probe(address):
+            return
+        self.__setitem__(address, '', 'mem')
+        self.prefetched[line] = self.read_line(address, cycle)
+        if self.prefetcher is not None:
+            self.prefetcher.issued += 1
+
+    def train_prefetcher(self, address: str, pc: Optional[int], hit: bool,
+                         cycle: int) -> None:
+        if self.prefetcher is None:
+            return
+        if not hit:
+            self.prefetcher.demand_misses += 1
+        for line in self.prefetcher.candidates(bin_to_int_unsigned(address), pc, hit):
+            self.pending_prefetches.append((line, cycle))
+
+    def issue_pending_prefetches(self) -> None:
+        while self.pending_prefetches:
+            self.issue_prefetch(*self.pending_prefetches.pop(0))
+
+    def access(self, address: str, cycle: int, is_write: bool = False,
+               pc: Optional[int] = None) -> int:
+        """
+        timing of one cpu access issued in `cycle`, the data itself is still
+        read and written with cache[address]. this cache is blocking: a miss
+        keeps the cpu waiting until its line is filled, so `accepted`, the
+        cycle the cache took the access in, is the one it completes in.
+
+        Returns:
+            int: the cycle in which the access completes
+        """
+        self.accepted = self._blocking_access(address, cycle, is_write, pc)
+        return self.accepted
+
+    def _blocking_access(self, address: str, cycle: int, is_write: bool,
+                         pc: Optional[int]) -> int:
+        self.issue_pending_prefetches()
+        prefetched = self.demand_prefetched(address, cycle)
+        if prefetched is not None:
+            self.hits += 1
+            self.train_prefetcher(address, pc, True, cycle)
+            return max(cycle, prefetched)
+        if self.probe(address):
+            self.hits += 1
+            self.train_prefetcher(address, pc, True, cycle)
+            return self.store(address, cycle) if is_write else cycle
+        self.misses += 1
+        self.train_prefetcher(address, pc, False, cycle)
+        if is_write and not self.write_allocate:
+            return self.store(address, cycle, allocated=False)
+        self.post_victim(address, cycle)
+        ready = self.read_line(address, cycle)
+        return self.store(address, ready) if is_write else ready
+
+    def read_line(self, address: str, cycle: int) -> int:
+        """
+        the cycle the line of `address`, asked for in `cycle`, is filled in
+        """
+        if self.dram is None:
+            return cycle + self.miss_latency
+        return self.dram.access(self.line_no(address) << self.block_offset_bits_no,
+                                cycle, self.line_of_data_size)
+
+    def post_victim(self, address: str, cycle: int) -> None:
+        """
+        the fill of `address` evicts the lru way, its modified words are
+        posted to the DRAM. without one write-backs take no time
+        """
+        if self.dram is None:
+            return
+        _, logic_set, _ = self.split(address)
+        way = self.blocks[logic_set][self.lru[logic_set]]
+        dirty = sum(block.state == 'modified' for block in way)
+        if dirty:
+            self.dram.access(self.line_address(way[0].tag, logic_set, 0), cycle,
+                             dirty * WORD_BYTES, is_write=True)
+
+    def _drain_store(self, line: int, cycle: int) -> int:
+        assert self.dram is not None
+        return self.dram.access(line << self.block_offset_bits_no, cycle,
+                                WORD_BYTES, is_write=True)
+
+    def store(self, address: str, cycle: int, allocated: bool = True) -> int:
+        """
+        timing of the memory side of a store whose word is in the cache by
+        `cycle` (or that goes around it), the cycle it completes in
+        """
+        if allocated and self.write_policy == 'write_back':
+            return cycle
+        accepted, new_word = self.store_buffer.push(self.line_no(address),
+                                                    self.split(address)[2], cycle)
+        if new_word:
+            self.bytes_written += WORD_BYTES
+        return accepted
+
+    def stats(self) -> dict[str, float]:
+        stats = {'hits': self.hits, 'misses': self.misses,
+                 'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+        stats.update(self.store_buffer.stats())
+        if self.dram is not None:
+            stats.update(self.dram.stats())
+        if self.prefetcher is not None:
+            stats.update({f'prefetch_{key}': val
+                          for key, val in self.prefetcher.stats().items()})
+        return stats
+
     # skipcq: PYL-W0621
     def __setitem__(self, address: str, val: str, from_where: str = 'cpu') -> None:
-        tag = address[:self.tag_bits_no]
-        block_offset = int(
-            address[self.tag_bits_no+self.logic_set_bits_no:], 2)
-        logic_set = int(address[self.tag_bits_no:self.tag_bits_no +
-                                self.logic_set_bits_no], 2)
-        lru = self.lru[logic_set]
+        """
+        from_where='mem' fills the line of address into the lru way,
+        'cpu' stores val to the word following the write policies
+        """
+        tag, logic_set, block_offset = self.split(address)
         if from_where == 'mem':
-            # first based on lru, decide which way to replace:
-            if self.blocks[logic_set][lru][0].state == 'modified':
-                for i in range(self.blocks_in_line):
-                    self.mem[bin_to_int_unsigned
-                             (self.blocks[logic_set][lru][i].tag +
-                              f'{logic_set:0{self.logic_set_bits_no}b}' +
-                              f'{i:0{self.block_offset_bits_no}b}')] = \
-                        self.blocks[logic_set][lru][i].data
-            for i in range(self.blocks_in_line):
-                self.blocks[logic_set][lru][i].data = \
-                    self.mem[bin_to_int_unsigned(
-                        address[:self.tag_bits_no] +
-                        f'{logic_set:0{self.logic_set_bits_no}b}' +
-                        f'{i:0{self.block_offset_bits_no}b}')]
-                self.blocks[logic_set][lru][i].tag = tag
-                self.blocks[logic_set][lru][i].state = 'shared'
-            self.lru[logic_set] = 1 - self.lru[logic_set]
+            self.fill(tag, logic_set)
+            return
+        way = self.find(tag, logic_set, block_offset)
+        if way is None:
+            if not self.write_allocate:
+                self.mem[bin_to_int_unsigned(address)] = val
+                return
+            way = self.fill(tag, logic_set)
+        block = self.blocks[logic_set][way][block_offset]
+        block.data = val
+        if self.write_policy == 'write_through':
+            self.mem[bin_to_int_unsigned(address)] = val
         else:
-            self.blocks[logic_set][self.lru[logic_set]
-                                   ][block_offset].data = val
-            self.blocks[logic_set][self.lru[logic_set]][block_offset].tag = tag
-            self.blocks[logic_set][self.lru[logic_set]
-                                   ][block_offset].state = 'modified'
-            self.lru[logic_set] = 1 - self.lru[logic_set]
+            block.state = 'modified'
+        self.touch(logic_set, way)
+
+    def fill(self, tag: str, logic_set: int) -> int:
+        """
+        bring a line from memory into the lru way of its set, evicting what
+        is there. returns the way
+        """
+        way = self.lru[logic_set]
+        self.evict(logic_set, way)
+        for i, block in enumerate(self.blocks[logic_set][way]):
+            block.data = self.mem[self.line_address(tag, logic_set, i)]
+            block.tag = tag
+            block.state = 'shared'
+        self.bytes_read += self.line_of_data_size
+        self.touch(logic_set, way)
+        return way
 
     def __getitem__(self, address: str) -> str:  # skipcq: PYL-W0621
         """
@@ -143,16 +455,59 @@ def get_state_of_block(cache: Cache, address: str) -> str:  # skipcq: PYL-W0621
     return 'invalid'
 
 
-data_mem: Memory = Memory(4096)
-for index in range(4096):
-    data_mem[index] = sign_extend(index, 32)
-data_cache: Cache = Cache(data_mem, 256, 32, 2)
-inst_mem: Memory = Memory(4096)
+# words of data_mem that hold their own address at power-on
+DATA_MEM_INIT_WORDS = 4096
+
+
+def make_data_mem() -> Memory:
+    """
+    power-on data memory, word i holds i for the first DATA_MEM_INIT_WORDS
+    """
+    mem = Memory()
+    mem.write_block(0, [f'{index:032b}' for index in range(DATA_MEM_INIT_WORDS)])
+    return mem
+
+
+def make_data_cache(mem: Optional[Memory] = None) -> Cache:
+    """
+    the default L1 data cache (256 bytes, 32-byte lines, 2-way) over `mem`,
+    the shared data_mem if None
+    """
+    return Cache(shared('data_mem') if mem is None else mem, 256, 32, 2)
+
+
+# both memories span the whole 32-bit address space, pages are allocated on
+# first write so only the initialized region is resident. data_mem and
+# data_cache are built the first time they are used (see __getattr__), so
+# importing this module costs nothing
+_FACTORIES: dict[str, Callable[[], Any]] = {'data_mem': make_data_mem,
+                                            'data_cache': make_data_cache}
+inst_mem: Memory = Memory()
+
+
+def shared(name: str) -> Any:
+    """
+    the module wide data_mem / data_cache, built on the first call
+    """
+    if name not in globals():
+        globals()[name] = _FACTORIES[name]()
+    return globals()[name]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _FACTORIES:
+        return shared(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # * =========== test ===========
 if __name__ == '__main__':
+    import contextlib
+    import io
+
     LINE_SEPERATOR = '======================='
+    data_mem: Memory = shared('data_mem')
+    data_cache: Cache = shared('data_cache')
 
     print(data_mem[5])
     print(data_mem[128])
@@ -186,3 +541,23 @@ if __name__ == '__main__':
     data_cache['0'*25 + '1'*4 + '000'] = '1'*32
     print('value: ', data_cache['0'*25 + '1'*4 + '000'])
     print(get_state_of_block(data_cache, '0'*25 + '1'*4 + '000'))
+
+    print(LINE_SEPERATOR)
+
+    # the same stores and loads under every policy: 64 stores to 8 words,
+    # then a load of each. traffic to memory in bytes and total cycles
+    for policy in WRITE_POLICIES:
+        for allocate in (True, False):
+            cache = Cache(data_mem.fork(), 256, 32, 2, miss_latency=10,
+                          write_policy=policy, write_allocate=allocate)
+            cycle = 0
+            for i in [*range(8)] * 8:
+                cycle = cache.access(f'{i:032b}', cycle, is_write=True) + 1
+                cache.__setitem__(f'{i:032b}', f'{i + 1:032b}')
+            for i in range(8):
+                cycle = cache.access(f'{i:032b}', cycle) + 1
+                with contextlib.redirect_stdout(io.StringIO()):
+                    assert cache[f'{i:032b}'] == f'{i + 1:032b}'
+            stats = cache.stats()
+            print(f'{policy:13} allocate={allocate!s:5}', cycle, 'cycles',
+                  stats['bytes_read'], 'read', stats['bytes_written'], 'written')
@@ -0,0 +1,174 @@
+"""
+lockstep co-simulation of the pipeline against the golden model
+
+every time the pipeline retires an instruction in WB it reports what the
+instruction wrote. the golden model executes the same instruction and
+both sides fold the writes into a zobrist hash of their architectural
+state (see GoldenModel). comparing the pc and the two hashes is O(1) per
+instruction, no matter how big the state is, so the check can stay on for
+long runs. the first mismatch raises Divergence with a short report of the
+instruction and of the writes the two models made.
+
+syscalls run on the host once, in the pipeline: its emulator logs every
+call and the golden model gets the logged result and memory writes back
+(after checking it asked for the same service with the same arguments),
+so input is not read twice and output is not printed twice.
+
+    cosim = CoSim()
+    main.use_cosim(cosim)
+    main.run_program(program)   # raises Divergence on the first mismatch
+"""
+from collections import deque
+from typing import Optional
+
+from GoldenModel import GoldenModel, Effect, zobrist, REG_SPACE, MEM_SPACE
+from Isa import disassemble
+from Memory import Memory
+from Syscall import SyscallEmulator, WordMemory, LogEntry
+
+
+class Divergence(Exception):
+    """
+    the pipeline and the golden model disagree
+    """
+
+
+def _write_text(effect: Effect) -> str:
+    _, reg_write, mem_write = effect
+    writes = []
+    if reg_write is not None:
+        writes.append(f'${reg_write[0]} <- {reg_write[1]:#010x}')
+    if mem_write is not None:
+        writes.append(f'mem[{mem_write[0]}] <- {mem_write[1]:#010x}')
+    return ', '.join(writes) or 'no writes'
+
+
+class SyscallReplay:
+    """
+    syscalls of the golden model, answered from the pipeline's log
+    """
+
+    def __init__(self, cosim: 'CoSim', log: deque[LogEntry]) -> None:
+        self.cosim = cosim
+        self.log = log
+
+    def call(self, code: int, a0: int, a1: int, a2: int,
+             memory: WordMemory) -> Optional[int]:
+        if not self.log:
+            raise Divergence(f'golden model made syscall {code}, the pipeline did not')
+        logged = self.log.popleft()
+        if logged[:4] != (code, a0, a1, a2):
+            raise Divergence(f'golden syscall {(code, a0, a1, a2)}, '
+                             f'pipeline syscall {logged[:4]}')
+        for address, val in logged[5]:
+            memory.store(address, val)
+            self.cosim.fold_store(address, val)
+        return logged[4]
+
+
+class CoSim:
+    def __init__(self) -> None:
+        self.golden: Optional[GoldenModel] = None
+        self.program: list[str] = []
+        self.reset()
+
+    def reset(self) -> None:
+        self.checked = 0
+        self.state_hash = 0
+        self.regs = [0] * 32
+        self.mem: Optional[Memory] = None
+
+    def start(self, program: list[str], mem: Memory,
+              syscalls: Optional[SyscallEmulator] = None) -> None:
+        """
+        both models start from the program and the current content of `mem`,
+        the calls `syscalls` makes for the pipeline are replayed to the golden model
+        """
+        self.reset()
+        self.program = program
+        replay = None
+        if syscalls is not None:
+            syscalls.log = deque()
+            replay = SyscallReplay(self, syscalls.log)
+        self.golden = GoldenModel(program, mem.fork(), replay)
+        # what the pipeline's memory holds, as far as its stores tell
+        self.mem = mem.fork()
+
+    def _fold(self, effect: Effect) -> None:
+        """
+        update the pipeline side hash with the writes of `effect`
+        """
+        _, reg_write, mem_write = effect
+        if reg_write is not None:
+            reg, val = reg_write
+            self.state_hash ^= zobrist(REG_SPACE, reg, self.regs[reg]) ^ \
+                zobrist(REG_SPACE, reg, val)
+            self.regs[reg] = val
+        if mem_write is not None:
+            self.fold_store(*mem_write)
+
+    def fold_store(self, address: int, val: int) -> None:
+        if self.mem is None:
+            return
+        self.state_hash ^= zobrist(MEM_SPACE, address, int(self.mem[address], 2)) ^ \
+            zobrist(MEM_SPACE, address, val)
+        self.mem[address] = f'{val:032b}'
+
+    def retire(self, effect: Effect, cycle: int) -> None:
+        """
+        the pipeline retired an instruction, check it against the golden one
+        """
+        assert self.golden is not None, 'start() the co-simulation first'
+        pc = effect[0]
+        if self.golden.done:
+            self.diverge(f'pipeline retired pc {pc} after the program ended',
+                         effect, None, cycle)
+        expected = self.golden.step()
+        self._fold(effect)
+        self.checked += 1
+        if pc != expected[0]:
+            self.diverge(f'pipeline retired pc {pc}, golden pc {expected[0]}',
+                         effect, expected, cycle)
+        if self.state_hash != self.golden.state_hash:
+            self.diverge('architectural state differs', effect, expected, cycle)
+
+    def finish(self, cycle: int) -> None:
+        """
+        the pipeline is drained, the golden model must be done as well
+        """
+        if self.golden is not None and not self.golden.done:
+            pc = self.golden.pc
+            raise Divergence(
+                f'pipeline stopped at cycle {cycle} after {self.checked} '
+                f'instructions, golden continues at pc {pc}: '
+                f'{disassemble(self.program[pc])}')
+
+    def diverge(self, what: str, effect: Effect, expected: Optional[Effect],
+                cycle: int) -> None:
+        pc = effect[0]
+        inst = disassemble(self.program[pc]) if 0 <= pc < len(self.program) else '?'
+        lines = [f'{what} at retirement #{self.checked} (cycle {cycle})',
+                 f'  pc {pc}: {inst}',
+                 f'  pipeline: {_write_text(effect)}']
+        if expected is not None:
+            lines.append(f'  golden:   {_write_text(expected)}')
+        raise Divergence('\n'.join(lines))
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+
+    import main
+    from Isa import assemble_program
+
+    cosim = CoSim()
+    main.use_cosim(cosim)
+    program = assemble_program('\n'.join([
+        'addi $8 $0 -8', 'srl $9 $8 1', 'slt $10 $8 $0', 'andi $11 $8 0xfff0',
+        'lw $12 3 $0', 'sw $12 7 $0', 'beq $12 $12 1', 'addi $13 $0 1',
+        'add $14 $12 $9']))
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.run_program(program)
+    print('checked', cosim.checked, 'instructions, hash', hex(cosim.state_hash))
@@ -0,0 +1,250 @@
+"""
+DRAM timing model behind the data memory
+
+Dram is a Memory, the data is still read and written word by word as
+before, that also times the transfers of the last cache level (line
+fills, write-backs, store buffer drains). a word address is split, from
+the low bits up, into
+
+    | row | bank | channel | column (row_bytes) |
+
+so consecutive lines stay in the same row. every bank keeps the row it
+used last open in its row buffer and a request to it is a
+    row hit       -> tCAS
+    row empty     -> tRCD + tCAS           (nothing open yet)
+    row conflict  -> tRP + tRCD + tCAS     (another row is open)
+before its bytes go over the data bus of the channel, `bus_bytes` per
+cycle, one transfer at a time.
+
+reads are answered when they arrive, the cache needs their cycle. writes
+are posted to the write queue of the controller and are served while
+their bank is idle or compete with the next read of that bank. in which
+order a bank serves what is waiting at it is up to the scheduler:
+    fcfs      -> oldest first
+    fr_fcfs   -> requests to the open row first, then oldest
+a write that finds the write queue full waits for its oldest entry.
+
+timings are in cpu cycles.
+
+counters:
+    dram_reads / dram_writes       requests served (writes still queued
+                                   at the end are not counted)
+    dram_row_hits / dram_row_empty / dram_row_conflicts, dram_row_hit_rate
+    dram_bytes_read / dram_bytes_written
+    dram_bandwidth                 bytes per cycle from the first request
+                                   to the end of the last transfer
+    dram_avg_read_queue / dram_avg_write_queue
+                                   cycles from arrival to the first command
+"""
+from typing import Optional
+
+from Memory import Memory
+
+SCHEDULERS = ('fcfs', 'fr_fcfs')
+WORD_BYTES = 4
+
+
+class Request:
+    def __init__(self, arrival: int, row: int, size: int, is_write: bool) -> None:
+        self.arrival = arrival
+        self.row = row
+        self.size = size
+        self.is_write = is_write
+        self.done = 0
+
+
+class Bank:
+    def __init__(self) -> None:
+        self.open_row: Optional[int] = None
+        # cycle the bank takes its next command in
+        self.ready = 0
+        self.waiting: list[Request] = []
+
+    def decision(self) -> int:
+        """
+        cycle the scheduler picks the next request of this bank in
+        """
+        return max(self.ready, min(request.arrival for request in self.waiting))
+
+
+class Dram(Memory):
+    def __init__(self, mem: Optional[Memory] = None, channels: int = 1,
+                 banks: int = 8, row_bytes: int = 2048, t_rcd: int = 14,
+                 t_cas: int = 14, t_rp: int = 14, bus_bytes: int = 8,
+                 scheduler: str = 'fr_fcfs', write_queue: int = 16) -> None:
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f'scheduler must be one of {SCHEDULERS}')
+        if row_bytes % WORD_BYTES:
+            raise ValueError('row_bytes must be a multiple of the word size')
+        if mem is None:
+            super().__init__()
+        else:
+            # the data of `mem`, shared copy-on-write
+            super().__init__(mem.size, mem.page_size)
+            mem.share(self)
+        self.channels = channels
+        self.banks_no = banks
+        self.row_bytes = row_bytes
+        self.t_rcd = t_rcd
+        self.t_cas = t_cas
+        self.t_rp = t_rp
+        self.bus_bytes = bus_bytes
+        self.scheduler = scheduler
+        self.write_queue = write_queue
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        close every row and forget the queues, the data stays
+        """
+        self.banks = [[Bank() for _ in range(self.banks_no)]
+                      for _ in range(self.channels)]
+        self.bus_free = [0] * self.channels
+        self.pending_writes = 0
+        self.reads = self.writes = 0
+        self.row_hits = self.row_empty = self.row_conflicts = 0
+        self.bytes_read = self.bytes_written = 0
+        self.read_queue_cycles = self.write_queue_cycles = 0
+        self.first: Optional[int] = None
+        self.last = 0
+
+    def locate(self, address: int) -> tuple[int, int, int]:
+        """
+        word address -> (channel, bank, row)
+        """
+        rest = address * WORD_BYTES // self.row_bytes
+        channel = rest % self.channels
+        rest //= self.channels
+        return channel, rest % self.banks_no, rest // self.banks_no
+
+    def access(self, address: int, cycle: int, size: int,
+               is_write: bool = False) -> int:
+        """
+        `size` bytes from the word `address` on, asked for in `cycle`.
+
+        Returns:
+            int: the cycle a read has its data in, the cycle the write
+                 queue took a write in
+        """
+        if self.first is None:
+            self.first = cycle
+        channel, bank_no, row = self.locate(address)
+        self._catch_up(channel, cycle)
+        request = Request(cycle, row, size, is_write)
+        bank = self.banks[channel][bank_no]
+        if is_write:
+            if self.pending_writes >= self.write_queue:
+                cycle = max(cycle, self._serve_oldest_write())
+            bank.waiting.append(request)
+            self.pending_writes += 1
+            return cycle
+        bank.waiting.append(request)
+        while self._serve_next(channel, bank) is not request:
+            pass
+        return request.done
+
+    def _catch_up(self, channel: int, cycle: int) -> None:
+        """
+        serve the writes the banks of `channel` start on before `cycle`,
+        the controller does not keep a bank idle while work is waiting
+        """
+        while True:
+            banks = [bank for bank in self.banks[channel] if bank.waiting]
+            if not banks:
+                return
+            bank = min(banks, key=Bank.decision)
+            if bank.decision() >= cycle:
+                return
+            self._serve_next(channel, bank)
+
+    def _serve_next(self, channel: int, bank: Bank) -> Request:
+        start = bank.decision()
+        ready = [request for request in bank.waiting if request.arrival <= start]
+        if self.scheduler == 'fr_fcfs':
+            hits = [request for request in ready if request.row == bank.open_row]
+            ready = hits or ready
+        request = min(ready, key=lambda request: request.arrival)
+        self._serve(channel, bank, request, start)
+        return request
+
+    def _serve_oldest_write(self) -> int:
+        """
+        serve the oldest queued write, returns the cycle it left the queue
+        """
+        oldest = None
+        for channel, banks in enumerate(self.banks):
+            for bank in banks:
+                for request in bank.waiting:
+                    if request.is_write and (oldest is None or
+                                             request.arrival < oldest[2].arrival):
+                        oldest = (channel, bank, request)
+        assert oldest is not None
+        channel, bank, request = oldest
+        start = max(bank.ready, request.arrival)
+        self._serve(channel, bank, request, start)
+        return start
+
+    def _serve(self, channel: int, bank: Bank, request: Request, start: int) -> None:
+        bank.waiting.remove(request)
+        if bank.open_row == request.row:
+            self.row_hits += 1
+            command = start
+        elif bank.open_row is None:
+            self.row_empty += 1
+            command = start + self.t_rcd
+        else:
+            self.row_conflicts += 1
+            command = start + self.t_rp + self.t_rcd
+        transfer = -(-request.size // self.bus_bytes)
+        bus_start = max(command + self.t_cas, self.bus_free[channel])
+        request.done = self.bus_free[channel] = bus_start + transfer
+        bank.open_row = request.row
+        # the next column command to the open row can follow the burst
+        bank.ready = command + transfer
+        self.last = max(self.last, request.done)
+        if request.is_write:
+            self.pending_writes -= 1
+            self.writes += 1
+            self.bytes_written += request.size
+            self.write_queue_cycles += start - request.arrival
+        else:
+            self.reads += 1
+            self.bytes_read += request.size
+            self.read_queue_cycles += start - request.arrival
+
+    def stats(self) -> dict[str, float]:
+        served = self.reads + self.writes
+        busy = self.last - (self.first or 0)
+        return {
+            'dram_reads': self.reads, 'dram_writes': self.writes,
+            'dram_row_hits': self.row_hits, 'dram_row_empty': self.row_empty,
+            'dram_row_conflicts': self.row_conflicts,
+            'dram_row_hit_rate': self.row_hits / served if served else 0.0,
+            'dram_bytes_read': self.bytes_read,
+            'dram_bytes_written': self.bytes_written,
+            'dram_bandwidth': (self.bytes_read + self.bytes_written) / busy
+            if busy else 0.0,
+            'dram_avg_read_queue': self.read_queue_cycles / self.reads
+            if self.reads else 0.0,
+            'dram_avg_write_queue': self.write_queue_cycles / self.writes
+            if self.writes else 0.0,
+        }
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    # reads streaming through one row with writes to another row of the
+    # same bank posted in between, issued every 2 cycles without waiting.
+    # fcfs keeps switching rows, fr_fcfs serves the reads to the open row
+    # first and the writes after them
+    other_row = 2048 // WORD_BYTES * 8
+    for scheduler in SCHEDULERS:
+        dram = Dram(scheduler=scheduler)
+        done = 0
+        for i in range(16):
+            done = max(done, dram.access(i * 8, 4 * i, 32))
+            dram.access(other_row + i * 8, 4 * i + 2, 32, is_write=True)
+        stats = dram.stats()
+        print(f'{scheduler:8} last read {done:4}',
+              f"row hit rate {stats['dram_row_hit_rate']:.2f}",
+              f"read queue {stats['dram_avg_read_queue']:.1f}")
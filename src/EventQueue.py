@@ -0,0 +1,82 @@
+"""
+event queue of the simulation core
+
+units that take more than one cycle (a data cache miss, later a
+multi-cycle ALU or DRAM) schedule their completion instead of being
+polled every cycle. while a completion the pipeline waits for is pending
+no stage can advance, so the run loop jumps the clock straight to the
+cycle after it and counts the skipped cycles as stalls, exactly as if it
+had ticked through them one by one.
+"""
+import heapq
+from itertools import count
+
+
+class EventQueue:
+    def __init__(self) -> None:
+        # (cycle, order, what), order keeps events of one cycle fifo
+        self.events: list[tuple[int, int, str]] = []
+        self.order = count()
+        self.reset()
+
+    def reset(self) -> None:
+        self.events.clear()
+        # the pipeline is frozen until this cycle
+        self.resume_cycle = 0
+        self.scheduled = self.skips = self.skipped_cycles = 0
+
+    def schedule(self, ready: int, what: str, stall: bool = True) -> None:
+        """
+        `what` completes in cycle `ready`, with `stall` the pipeline waits
+        for it and continues in the cycle after
+        """
+        heapq.heappush(self.events, (ready, next(self.order), what))
+        self.scheduled += 1
+        if stall:
+            self.resume_cycle = max(self.resume_cycle, ready + 1)
+
+    def next_cycle(self) -> int:
+        """
+        cycle of the earliest pending event, -1 if there is none
+        """
+        return self.events[0][0] if self.events else -1
+
+    def pop_until(self, cycle: int) -> list[tuple[int, str]]:
+        """
+        the events completing before `cycle`, in the order they complete
+        """
+        done = []
+        while self.events and self.events[0][0] < cycle:
+            ready, _, what = heapq.heappop(self.events)
+            done.append((ready, what))
+        return done
+
+    def skip(self, cycle: int) -> int:
+        """
+        first cycle from `cycle` on in which some stage can make progress,
+        the events completed on the way are retired
+        """
+        if cycle >= self.resume_cycle:
+            self.pop_until(cycle)
+            return cycle
+        self.skips += 1
+        self.skipped_cycles += self.resume_cycle - cycle
+        self.pop_until(self.resume_cycle)
+        return self.resume_cycle
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def stats(self) -> dict[str, float]:
+        return {'events': self.scheduled, 'skips': self.skips,
+                'skipped_cycles': self.skipped_cycles}
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    queue = EventQueue()
+    queue.schedule(20, 'dcache miss')
+    queue.schedule(12, 'write buffer drain', stall=False)
+    print(queue.next_cycle())  # 12
+    print(queue.skip(3))       # 21, 18 cycles skipped
+    print(len(queue), queue.stats())
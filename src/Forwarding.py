@@ -0,0 +1,145 @@
+"""
+forwarding (bypass) network of the pipeline
+
+    ex_ex   -> EX/MEM result into the ALU inputs of the next instruction
+    mem_ex  -> MEM/WB result (ALU or load) into the ALU inputs
+    mem_mem -> MEM/WB result into the store data of a sw in MEM, so a
+               load followed by a store of the loaded value does not stall
+    wb_id   -> the register file is written in the first half of the cycle
+               and read in the second, ID sees the value WB is writing
+
+every path can be turned off. the hazard unit in ID stalls an instruction
+until each of its source registers can be delivered by a path that is on
+(or read from the register file), so turning a path off only costs cycles.
+
+counters:
+    forwarded_<path>  values delivered through the path
+    saved_<path>_est  estimated stall cycles the path saved: for every use,
+                      how long the consumer alone would have waited with
+                      only that path off (wait_without). not measured, the
+                      stalls move the instructions behind it too, run with
+                      the path off for the real cost
+    stall_<cause>     stall cycles, by the path whose absence caused them
+                      (load_use when no path could help, syscall while
+                      a syscall waits for the older instructions to
+                      leave EX, load_miss while the value of a load that
+                      missed in a non-blocking cache is not there yet)
+"""
+from collections import Counter
+
+from Isa import is_rtype
+
+PATHS = ('ex_ex', 'mem_ex', 'mem_mem', 'wb_id')
+# every cause stall() is called with
+STALL_CAUSES = PATHS + ('load_use', 'syscall', 'load_miss')
+
+
+def operands(name: str, rs: int, rt: int) -> list[tuple[int, str]]:
+    """
+    source registers of an instruction and the stage that needs each of
+    them ('ex' or 'mem'), $0 left out
+    """
+    if name in ('sll', 'srl'):
+        regs = [(rt, 'ex')]
+    elif name == 'jr':
+        regs = [(rs, 'ex')]
+    elif name == 'syscall':
+        regs = [(2, 'ex'), (4, 'ex'), (5, 'ex'), (6, 'ex')]
+    elif name in ('j', 'jal', 'break'):
+        regs = []
+    elif name == 'sw':
+        regs = [(rs, 'ex'), (rt, 'mem')]
+    elif is_rtype(name) or name in ('beq', 'bne'):
+        regs = [(rs, 'ex'), (rt, 'ex')]
+    else:
+        regs = [(rs, 'ex')]
+    return [(reg, stage) for reg, stage in regs if reg]
+
+
+class ForwardingUnit:
+    def __init__(self, ex_ex: bool = True, mem_ex: bool = True,
+                 mem_mem: bool = True, wb_id: bool = True) -> None:
+        self.enabled = {'ex_ex': ex_ex, 'mem_ex': mem_ex,
+                        'mem_mem': mem_mem, 'wb_id': wb_id}
+        self.reset()
+
+    def reset(self) -> None:
+        self.forwarded: Counter[str] = Counter()
+        self.saved: Counter[str] = Counter()
+        self.stalls: Counter[str] = Counter()
+
+    def __getitem__(self, path: str) -> bool:
+        return self.enabled[path]
+
+    def wait_without(self, path: str) -> int:
+        """
+        stall cycles a consumer takes when `path` is off and the others
+        stay as they are, an estimate that ignores the instructions around
+        it
+        """
+        # cycles until the value is in the register file after WB
+        from_reg_file = 1 if self['wb_id'] else 2
+        if path == 'wb_id':
+            return 1
+        if path == 'mem_ex':
+            return from_reg_file
+        # ex_ex, and mem_mem which otherwise falls back to the EX paths
+        return 1 if self['mem_ex'] else from_reg_file + 1
+
+    def stall_cause(self, producer_stage: str, is_load: bool,
+                    consumer_stage: str) -> str:
+        """
+        why an instruction in ID can not go on yet, '' if it can
+
+        Args:
+            producer_stage (str): stage of the youngest older writer of the
+                register, 'ex', 'mem' or 'wb'
+            is_load (bool): the writer is a load
+            consumer_stage (str): stage that needs the value, 'ex' or 'mem'
+        """
+        store_data = consumer_stage == 'mem' and self['mem_mem']
+        if producer_stage == 'ex':
+            if store_data:
+                return ''
+            if is_load:
+                # the store of a loaded value waits for mem_mem only
+                return 'mem_mem' if consumer_stage == 'mem' else 'load_use'
+            return '' if self['ex_ex'] else 'ex_ex'
+        if producer_stage == 'mem':
+            return '' if self['mem_ex'] else 'mem_ex'
+        return '' if self['wb_id'] else 'wb_id'
+
+    def use(self, path: str) -> None:
+        self.forwarded[path] += 1
+        self.saved[path] += self.wait_without(path)
+
+    def stall(self, cause: str) -> None:
+        self.stalls[cause] += 1
+
+    def stats(self) -> dict[str, float]:
+        stats: dict[str, float] = {}
+        for path in PATHS:
+            stats[f'forwarded_{path}'] = self.forwarded[path]
+            stats[f'saved_{path}_est'] = self.saved[path]
+        stats.update({f'stall_{cause}': count
+                      for cause, count in sorted(self.stalls.items())})
+        return stats
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+
+    import main
+    from Isa import assemble_program
+
+    program = assemble_program('\n'.join([
+        'addi $8 $0 1', 'add $9 $8 $8', 'lw $10 0 $9', 'sw $10 4 $0',
+        'add $11 $10 $9', 'beq $11 $11 1', 'addi $12 $0 7', 'add $13 $11 $8']))
+    for off in ('',) + PATHS:
+        unit = ForwardingUnit(**{path: path != off for path in PATHS})
+        main.use_forwarding(unit)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = main.run_program(program)
+        print(off or 'all on', int(stats['cycles']), unit.stats())
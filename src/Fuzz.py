@@ -0,0 +1,379 @@
+"""
+constrained-random programs and a parallel fuzzing harness
+
+ProgramGenerator writes random programs from the opcodes of
+bin_to_inst_dict. `mix` weighs the instruction classes, `hazard` is the
+chance that a source register is the destination of one of the last
+three instructions (a raw hazard at distance 1-3) and `footprint` is the
+number of data words lw / sw touch. branches only go forward, so every
+program ends.
+
+known gaps, weight 0 unless asked for (--mix jump=5 ...):
+    jump      the pipeline does not execute j / jal / jr, the golden
+              model does, so nearly every case with one diverges
+    hilo      mult / div and mfhi / mflo, hi/lo are modelled by neither
+              side, so they cannot disagree and nothing is checked
+    unsigned  addu / addiu, written back by neither side, same
+
+every case is a seed: it picks a program and a machine (forwarding path
+turned off, issue width, data cache, address translation) and checks it
+    divergence -> co-simulation against the golden model failed
+    crash      -> the simulator raised
+    cpi        -> ipc above the issue width, or turning the forwarding
+                  path back on made the program slower
+the cases run in a process pool and every failure is shrunk (chunks of
+instructions removed, then immediates cleared) to a minimal program
+that still fails the same way (j / jal targets follow the removed
+chunks). the reproducers of failures fixed since are kept in
+REGRESSIONS and checked before the random cases.
+
+    python Fuzz.py --cases 5000 --workers 8 --out failures/
+"""
+import argparse
+import ast
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Optional
+
+import main
+from Cache import Cache, WRITE_POLICIES, data_mem
+from CoSim import CoSim, Divergence
+from Dram import Dram
+from Forwarding import ForwardingUnit, PATHS
+from Isa import assemble, assemble_program, bin_to_inst_dict, disassemble
+from NonBlockingCache import NonBlockingCache
+from Syscall import SyscallEmulator
+from VirtualMemory import VirtualMemory, TLB
+
+# instruction class -> opcodes, every opcode of bin_to_inst_dict is in one
+CLASSES = {
+    'alu': ('add', 'sub', 'and', 'or', 'xor', 'nor', 'slt'),
+    'shift': ('sll', 'srl'),
+    'imm': ('addi', 'andi', 'ori', 'xori'),
+    'load': ('lw',),
+    'store': ('sw',),
+    'branch': ('beq', 'bne'),
+    'syscall': ('syscall',),
+    'break': ('break',),
+    'nop': ('nop',),
+    'jump': ('j', 'jal', 'jr'),
+    'hilo': ('mult', 'multu', 'div', 'divu', 'mfhi', 'mflo'),
+    'unsigned': ('addu', 'addiu'),
+}
+assert set(bin_to_inst_dict.values()) <= {name for names in CLASSES.values()
+                                          for name in names}
+MIX = {'alu': 30, 'shift': 8, 'imm': 20, 'load': 15, 'store': 12,
+       'branch': 8, 'syscall': 2, 'break': 1, 'nop': 5,
+       # the known gaps of the module docstring, off
+       'jump': 0, 'hilo': 0, 'unsigned': 0}
+REGS = (8, 9, 10, 11, 12, 13, 14, 15)
+# reproducers (as reproducer() writes them) of fixed failures
+REGRESSIONS = (
+    # a store of a missed load's value held every stage through mem_mem
+    '''// cpi: 13 cycles with mem_mem on, 12 with it off
+// machine: {'off': 'mem_mem', 'issue_width': 1, 'cache': 'nonblocking', 'miss_latency': 5, 'write_policy': 'write_back', 'write_allocate': False, 'dram': None, 'vm': False}
+lw $11 0 $0
+lw $9 0 $0
+sw $9 0 $0
+sub $14 $13 $11
+''',
+)
+# (kind, message) of a failing case
+Failure = tuple[str, str]
+
+
+class ProgramGenerator:
+    def __init__(self, seed: int = 0, length: int = 40,
+                 mix: Optional[dict[str, int]] = None, hazard: float = 0.4,
+                 footprint: int = 256) -> None:
+        self.rng = random.Random(seed)
+        self.length = length
+        self.mix = MIX | (mix or {})
+        self.hazard = hazard
+        self.footprint = footprint
+        self.recent: list[int] = []
+        # address of the instruction being generated
+        self.pc = 0
+
+    def src(self) -> int:
+        if self.recent and self.rng.random() < self.hazard:
+            return self.rng.choice(self.recent[-3:])
+        return self.rng.choice(REGS)
+
+    def dest(self) -> int:
+        reg = self.rng.choice(REGS)
+        self.recent.append(reg)
+        return reg
+
+    def imm(self) -> int:
+        return self.rng.randrange(-64, 64)
+
+    def instruction(self, name: str, left: int) -> list[str]:
+        """
+        `name` with random operands, `left` instructions follow it
+        """
+        rng = self.rng
+        if name == 'nop':
+            return ['0' * 32]
+        if name == 'break':
+            return [assemble('break')]
+        # addiu is encoded as an r-type in this isa
+        if name in CLASSES['alu'] or name in CLASSES['unsigned']:
+            src1, src2 = self.src(), self.src()
+            return [assemble(name, self.dest(), src1, src2)]
+        if name in CLASSES['shift']:
+            src = self.src()
+            return [assemble(name, self.dest(), src, rng.randrange(32))]
+        if name in CLASSES['imm']:
+            src = self.src()
+            return [assemble(name, self.dest(), src, self.imm())]
+        if name == 'lw':
+            return [assemble('lw', self.dest(), rng.randrange(self.footprint), 0)]
+        if name == 'sw':
+            return [assemble('sw', self.src(), rng.randrange(self.footprint), 0)]
+        if name in CLASSES['branch']:
+            return [assemble(name, self.src(), self.src(), rng.randrange(min(left, 4) + 1))]
+        if name == 'syscall':
+            # print_int of a register, $v0 is set once at the start
+            return [assemble('add', 4, 0, self.src()), assemble('syscall')]
+        if name in ('j', 'jal'):
+            return [assemble(name, self.pc + 1 + rng.randrange(min(left, 4) + 1))]
+        if name == 'jr':
+            return [assemble('jr', self.src())]
+        if name in ('mfhi', 'mflo'):
+            return [assemble(name, self.dest())]
+        return [assemble(name, self.src(), self.src())]
+
+    def program(self) -> list[str]:
+        classes = [name for name, weight in self.mix.items() if weight]
+        weights = [self.mix[name] for name in classes]
+        # $v0 = 1 (print_int) for the syscalls, nothing else writes it
+        program = [assemble('addi', 2, 0, 1)]
+        self.recent.clear()
+        while len(program) < self.length:
+            self.pc = len(program)
+            kind = self.rng.choices(classes, weights)[0]
+            name = self.rng.choice(CLASSES[kind])
+            program += self.instruction(name, self.length - len(program) - 1)
+        return program[:self.length]
+
+
+# ------- one case -------
+def machine(seed: int) -> dict[str, Any]:
+    """
+    the configuration a case runs on
+    """
+    rng = random.Random(seed ^ 0x5EED)
+    return {'off': rng.choice(('',) + PATHS),
+            'issue_width': rng.choice((1, 1, 2, 4)),
+            'cache': rng.choice(('blocking', 'nonblocking')),
+            'miss_latency': rng.choice((0, 5, 20)),
+            'write_policy': rng.choice(WRITE_POLICIES),
+            'write_allocate': rng.random() < 0.7,
+            'dram': rng.choice((None, 'fcfs', 'fr_fcfs')),
+            'vm': rng.random() < 0.3}
+
+
+def _cycles(program: list[str], config: dict[str, Any], off: str) -> dict[str, float]:
+    mem = data_mem.fork()
+    if config['dram'] is not None:
+        mem = Dram(mem, t_rcd=5, t_cas=5, t_rp=5, scheduler=config['dram'])
+    if config['cache'] == 'blocking':
+        cache = Cache(mem, 256, 32, 2, config['miss_latency'],
+                      config['write_policy'], config['write_allocate'])
+    else:
+        cache = NonBlockingCache(mem, 256, 32, 2, miss_latency=config['miss_latency'],
+                                 write_policy=config['write_policy'],
+                                 write_allocate=config['write_allocate'])
+    main.use_data_cache(cache)
+    main.use_forwarding(ForwardingUnit(**{path: path != off for path in PATHS}))
+    main.use_virtual_memory(VirtualMemory(dtlb=TLB('dtlb', 4, 2), page_bits=6)
+                            if config['vm'] else None)
+    main.use_syscalls(SyscallEmulator(stdout=io.StringIO()))
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        return main.run_program(program, issue_width=config['issue_width'],
+                                max_cycles=100 * len(program) + 1000)
+
+
+def check(program: list[str], config: dict[str, Any]) -> Optional[Failure]:
+    """
+    run a program on a machine, the failure it shows if any
+    """
+    cosim = CoSim()
+    main.use_cosim(cosim)
+    try:
+        stats = _cycles(program, config, config['off'])
+    except Divergence as error:
+        return 'divergence', str(error)
+    except Exception as error:  # skipcq: PYL-W0703
+        return 'crash', f'{type(error).__name__}: {error}'
+    finally:
+        main.use_cosim(None)
+    if stats['truncated']:
+        return 'cpi', f'still running after {stats["cycles"]} cycles'
+    if stats['ipc'] > config['issue_width']:
+        return 'cpi', f'ipc {stats["ipc"]:.2f} above issue width {config["issue_width"]}'
+    if config['off']:
+        full = _cycles(program, config, '')
+        if full['cycles'] > stats['cycles']:
+            return 'cpi', (f'{full["cycles"]} cycles with {config["off"]} on, '
+                           f'{stats["cycles"]} with it off')
+    return None
+
+
+def run_case(seed: int, length: int = 40, hazard: float = 0.4,
+             footprint: int = 256, mix: Optional[dict[str, int]] = None
+             ) -> tuple[int, Optional[Failure]]:
+    program = ProgramGenerator(seed, length, mix, hazard, footprint).program()
+    return seed, check(program, machine(seed))
+
+
+# ------- shrinking -------
+def remove(program: list[str], start: int, chunk: int) -> list[str]:
+    """
+    `program` without its instructions start to start + chunk - 1, a j / jal
+    into them goes to the instruction after them, one behind them moves
+    down with its target
+    """
+    kept = program[:start] + program[start + chunk:]
+    for pc, inst in enumerate(kept):
+        # opcodes of j and jal
+        if inst[:6] in ('000010', '000011'):
+            target = int(inst[6:], 2)
+            if target >= start:
+                target = max(target - chunk, start)
+            kept[pc] = inst[:6] + f'{target:026b}'
+    return kept
+
+
+def shrink(program: list[str], config: dict[str, Any], kind: Failure) -> list[str]:
+    """
+    smallest program found that still fails like `kind`: drop chunks of
+    instructions, halving the chunk size, then clear immediates
+    """
+    def fails(candidate: list[str]) -> bool:
+        failure = check(candidate, config)
+        if failure is None or failure[0] != kind[0]:
+            return False
+        # a crash has to stay the same crash
+        return kind[0] != 'crash' or failure[1] == kind[1]
+
+    chunk = len(program) // 2
+    while chunk >= 1:
+        start = 0
+        while start < len(program):
+            candidate = remove(program, start, chunk)
+            if candidate and fails(candidate):
+                program = candidate
+            else:
+                start += chunk
+        chunk //= 2
+    for i, inst in enumerate(program):
+        # immediates and shift amounts to 0, keeping the registers
+        if inst[:6] != '000000':
+            simpler = inst[:16] + '0' * 16
+        else:
+            simpler = inst[:21] + '00000' + inst[26:]
+        if simpler != inst and fails(program[:i] + [simpler] + program[i + 1:]):
+            program = program[:i] + [simpler] + program[i + 1:]
+    return program
+
+
+def reproducer(program: list[str], config: dict[str, Any], failure: Failure) -> str:
+    lines = [f'// {failure[0]}: {failure[1].splitlines()[0]}',
+             f'// machine: {config}']
+    return '\n'.join(lines + [disassemble(inst) for inst in program]) + '\n'
+
+
+def load_reproducer(text: str) -> tuple[list[str], dict[str, Any]]:
+    """
+    program and machine of a reproducer
+    """
+    config = ast.literal_eval(text.splitlines()[1].split('machine: ', 1)[1])
+    return assemble_program(text), config
+
+
+# ------- harness -------
+def fuzz(cases: int = 1000, workers: int = 0, seed: int = 0, length: int = 40,
+         hazard: float = 0.4, footprint: int = 256,
+         mix: Optional[dict[str, int]] = None, out: Optional[str] = None
+         ) -> dict[str, Any]:
+    """
+    run `cases` random cases in parallel, shrink the failures and write
+    their reproducers to `out`
+    """
+    start = time.perf_counter()
+    reports = []
+    regressions = 0
+    for text in REGRESSIONS:
+        program, config = load_reproducer(text)
+        failure = check(program, config)
+        if failure is not None:
+            regressions += 1
+            reports.append(reproducer(program, config, failure))
+    seeds = range(seed, seed + cases)
+    failures: list[tuple[int, Failure]] = []
+    with ProcessPoolExecutor(workers or None) as pool:
+        case = partial(run_case, length=length, hazard=hazard,
+                       footprint=footprint, mix=mix)
+        chunk = max(cases // (4 * (workers or os.cpu_count() or 1)), 1)
+        for case_seed, failure in pool.map(case, seeds, chunksize=chunk):
+            if failure is not None:
+                failures.append((case_seed, failure))
+    elapsed = time.perf_counter() - start
+    for case_seed, failure in failures:
+        program = ProgramGenerator(case_seed, length, mix, hazard, footprint).program()
+        config = machine(case_seed)
+        small = shrink(program, config, failure)
+        report = reproducer(small, config, check(small, config) or failure)
+        reports.append(report)
+        if out is not None:
+            os.makedirs(out, exist_ok=True)
+            with open(os.path.join(out, f'{failure[0]}_{case_seed}.txt'), 'w',
+                      encoding='utf-8') as f:
+                f.write(report)
+    kinds: dict[str, int] = {}
+    for _, (kind, _) in failures:
+        kinds[kind] = kinds.get(kind, 0) + 1
+    return {'cases': cases, 'failures': len(failures), 'by_kind': kinds,
+            'regressions': regressions, 'cases_per_sec': cases / elapsed,
+            'reproducers': reports}
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cases', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='processes, default one per cpu')
+    parser.add_argument('--seed', type=int, default=0, help='first case seed')
+    parser.add_argument('--length', type=int, default=40,
+                        help='instructions per program')
+    parser.add_argument('--hazard', type=float, default=0.4,
+                        help='chance of a source being a recent destination')
+    parser.add_argument('--footprint', type=int, default=256,
+                        help='data words touched by lw / sw')
+    parser.add_argument('--mix', nargs='*', default=[], metavar='CLASS=WEIGHT',
+                        help=f'instruction class weights, classes: {", ".join(MIX)}')
+    parser.add_argument('--out', help='directory for the reproducers')
+    args = parser.parse_args()
+    mix = {name: int(weight) for name, weight in
+           (item.split('=') for item in args.mix)}
+    result = fuzz(args.cases, args.workers, args.seed, args.length, args.hazard,
+                  args.footprint, mix, args.out)
+    for report in result['reproducers']:
+        print(report)
+    print(f'{result["cases"]} cases, {result["failures"]} failures '
+          f'{result["by_kind"]}, {result["regressions"]} of {len(REGRESSIONS)} '
+          f'regressions failing, {result["cases_per_sec"]:.1f} cases/s')
+    return 1 if result['failures'] or result['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
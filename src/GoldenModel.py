@@ -0,0 +1,178 @@
+"""
+golden (reference) model of the ISA
+
+a plain instruction-at-a-time interpreter with none of the pipeline's
+machinery: registers and memory words are ints, every instruction is
+decoded once up front and executes completely before the next one.
+it is the specification the pipeline is checked against (see CoSim).
+
+step() returns what the instruction changed, and the model keeps a
+zobrist-style hash of its architectural state: every register and memory
+word contributes zobrist(location, value), xor-ed together, so a write
+updates the hash in O(1) by xor-ing the old value out and the new one in.
+"""
+from typing import Optional, Protocol
+
+from BinFuncs import bin_to_int_signed
+from Isa import inst_name
+from Memory import Memory
+from Syscall import EXITS, WordMemory
+
+WORD_MASK = 2**32 - 1
+MASK64 = 2**64 - 1
+REG_SPACE, MEM_SPACE = 1, 2
+
+# (pc, register write (reg, value), memory write (address, value))
+Effect = tuple[int, Optional[tuple[int, int]], Optional[tuple[int, int]]]
+
+
+class Syscalls(Protocol):
+    def call(self, code: int, a0: int, a1: int, a2: int,
+             memory: WordMemory) -> Optional[int]:
+        ...
+
+
+def _mix(x: int) -> int:
+    """
+    splitmix64 finalizer
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def zobrist(space: int, location: int, value: int) -> int:
+    """
+    hash of one register or memory word holding `value`
+    """
+    return _mix(_mix(space << 32 | location) ^ value)
+
+
+def _signed(val: int) -> int:
+    return val - 2**32 if val >> 31 else val
+
+
+def _decode(inst: str) -> tuple[str, int, int, int, int, int, int]:
+    """
+    name, rs, rt, rd, shamt, signed immediate, unsigned immediate / target
+    """
+    name = 'nop' if inst == '0' * 32 else inst_name(inst)
+    low = int(inst[6:], 2) if name in ('j', 'jal') else int(inst[16:], 2)
+    return (name, int(inst[6:11], 2), int(inst[11:16], 2),
+            int(inst[16:21], 2), int(inst[21:26], 2),
+            bin_to_int_signed(inst[16:], 16), low)
+
+
+class GoldenModel:
+    def __init__(self, program: list[str], mem: Memory,
+                 syscalls: Optional[Syscalls] = None) -> None:
+        self.program = [_decode(inst) for inst in program]
+        # memory words are 32-bit binary strings, like in data_mem
+        self.mem = mem
+        # a SyscallEmulator, or CoSim's replay of the pipeline's calls
+        self.syscalls = syscalls
+        self.regs = [0] * 32
+        self.pc = self.retired = self.state_hash = 0
+
+    @property
+    def done(self) -> bool:
+        return not 0 <= self.pc < len(self.program)
+
+    def write_reg(self, reg: int, val: int) -> Optional[tuple[int, int]]:
+        if not reg:
+            return None
+        val &= WORD_MASK
+        self.state_hash ^= zobrist(REG_SPACE, reg, self.regs[reg]) ^ \
+            zobrist(REG_SPACE, reg, val)
+        self.regs[reg] = val
+        return reg, val
+
+    def load(self, address: int) -> int:
+        return int(self.mem[address], 2)
+
+    def store(self, address: int, val: int) -> tuple[int, int]:
+        self.state_hash ^= zobrist(MEM_SPACE, address, self.load(address)) ^ \
+            zobrist(MEM_SPACE, address, val)
+        self.mem[address] = f'{val:032b}'
+        return address, val
+
+    def step(self) -> Effect:
+        """
+        execute the instruction at pc
+        """
+        pc = self.pc
+        name, rs, rt, rd, shamt, imm, low = self.program[pc]
+        a, b = self.regs[rs], self.regs[rt]
+        reg_write = mem_write = None
+        self.pc = pc + 1
+
+        if name == 'add':
+            reg_write = self.write_reg(rd, a + b)
+        elif name == 'sub':
+            reg_write = self.write_reg(rd, a - b)
+        elif name == 'and':
+            reg_write = self.write_reg(rd, a & b)
+        elif name == 'or':
+            reg_write = self.write_reg(rd, a | b)
+        elif name == 'xor':
+            reg_write = self.write_reg(rd, a ^ b)
+        elif name == 'nor':
+            reg_write = self.write_reg(rd, ~(a | b))
+        elif name == 'slt':
+            reg_write = self.write_reg(rd, int(_signed(a) < _signed(b)))
+        elif name == 'sll':
+            reg_write = self.write_reg(rd, b << shamt)
+        elif name == 'srl':
+            reg_write = self.write_reg(rd, b >> shamt)
+        elif name == 'jr':
+            self.pc = a
+        elif name == 'addi':
+            reg_write = self.write_reg(rt, a + imm)
+        elif name == 'andi':
+            reg_write = self.write_reg(rt, a & low)
+        elif name == 'ori':
+            reg_write = self.write_reg(rt, a | low)
+        elif name == 'xori':
+            reg_write = self.write_reg(rt, a ^ low)
+        elif name == 'lw':
+            reg_write = self.write_reg(rt, self.load((a + imm) & WORD_MASK))
+        elif name == 'sw':
+            mem_write = self.store((a + imm) & WORD_MASK, b)
+        elif name in ('beq', 'bne'):
+            if (a == b) == (name == 'beq'):
+                self.pc = pc + 1 + imm
+        elif name == 'j':
+            self.pc = low
+        elif name == 'jal':
+            reg_write = self.write_reg(31, pc + 1)
+            self.pc = low
+        elif name == 'syscall' and self.syscalls is not None:
+            code = self.regs[2]
+            result = self.syscalls.call(code, self.regs[4], self.regs[5],
+                                        self.regs[6], self)
+            reg_write = self.write_reg(2, code if result is None else result)
+            if code in EXITS:
+                self.pc = len(self.program)
+        elif name == 'break':
+            self.pc = len(self.program)
+        # nop and the hi/lo instructions (hi/lo are not modelled) change
+        # nothing
+        self.retired += 1
+        return pc, reg_write, mem_write
+
+    def run(self, max_steps: int = 10**7) -> None:
+        while not self.done and self.retired < max_steps:
+            self.step()
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    from Cache import data_mem
+    with open('instructions.txt', 'r', encoding='utf-8') as f:
+        golden = GoldenModel([line.strip() for line in f if line.strip()],
+                             data_mem.fork())
+    while not golden.done:
+        print(golden.step())
+    print({reg: _signed(val) for reg, val in enumerate(golden.regs) if val},
+          hex(golden.state_hash))
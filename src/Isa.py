@@ -0,0 +1,257 @@
+"""
+Instruction set tables for the MIPS simulator and a small assembler.
+The tables are shared by the pipeline (main.py) and the tools that have to
+build or inspect programs without running the pipeline (benchmarks, ...).
+"""
+from typing import Optional
+from BinFuncs import sign_extend, bin_to_int_signed
+
+# tuple(opcode, funct): instruction
+bin_to_inst_dict = {
+    ('000000', '100000'): 'add',
+    ('000000', '100010'): 'sub',
+    ('000000', '100100'): 'and',
+    ('000000', '100101'): 'or',
+    ('000000', '100110'): 'xor',
+    ('000000', '100111'): 'nor',
+    ('000000', '101010'): 'slt',
+    ('000000', '000000'): 'sll',
+    ('000000', '000010'): 'srl',
+    ('000000', '001000'): 'jr',
+    ('000000', '001100'): 'syscall',
+    ('000000', '001101'): 'break',
+    ('000000', '010000'): 'mfhi',
+    ('000000', '010010'): 'mflo',
+    ('000000', '011000'): 'mult',
+    ('000000', '011001'): 'multu',
+    ('000000', '011010'): 'div',
+    ('000000', '011011'): 'divu',
+    ('000000', '101000'): 'addu',
+    ('000000', '101001'): 'addiu',
+    ('000000', '001111'): 'jal',
+    ('000100', 'xxxxxx'): 'beq',
+    ('000101', 'xxxxxx'): 'bne',
+    ('100011', 'xxxxxx'): 'lw',
+    ('101011', 'xxxxxx'): 'sw',
+    ('001000', 'xxxxxx'): 'addi',
+    ('001100', 'xxxxxx'): 'andi',
+    ('001101', 'xxxxxx'): 'ori',
+    ('001110', 'xxxxxx'): 'xori',
+    ('000010', 'xxxxxx'): 'j',
+    ('000011', 'xxxxxx'): 'jal'
+}
+
+bin_to_regname = {
+    '00000': '$0',   # zero
+    '00001': '$1',   # at
+    '00010': '$2',   # v0
+    '00011': '$3',   # v1
+    '00100': '$4',   # a0
+    '00101': '$5',   # a1
+    '00110': '$6',   # a2
+    '00111': '$7',   # a3
+    '01000': '$8',   # t0
+    '01001': '$9',   # t1
+    '01010': '$10',  # t2
+    '01011': '$11',  # t3
+    '01100': '$12',  # t4
+    '01101': '$13',  # t5
+    '01110': '$14',  # t6
+    '01111': '$15',  # t7
+    '10000': '$16',  # s0
+    '10001': '$17',  # s1
+    '10010': '$18',  # s2
+    '10011': '$19',  # s3
+    '10100': '$20',  # s4
+    '10101': '$21',  # s5
+    '10110': '$22',  # s6
+    '10111': '$23',  # s7
+    '11000': '$24',  # t8
+    '11001': '$25',  # t9
+    '11010': '$26',  # k0
+    '11011': '$27',  # k1
+    '11100': '$28',  # gp
+    '11101': '$29',  # sp
+    '11110': '$30',  # fp
+    '11111': '$31'   # ra
+}
+
+
+def is_rtype(name: str) -> bool:
+    return name in ['add', 'sub', 'and', 'or', 'xor', 'nor', 'slt', 'sll',
+                    'srl', 'jr', 'syscall', 'break', 'mult']
+
+
+def is_itype(name: str) -> bool:
+    return name in ['addi', 'andi', 'ori', 'xori', 'beq', 'bne', 'lw', 'sw']
+
+
+def is_branch(name: str) -> bool:
+    return name in ['beq', 'bne']
+
+
+def inst_name(inst: str) -> str:
+    """
+    name of a 32-bit binary instruction, looked up by (opcode, funct)
+    and then by opcode alone for the non r-type formats
+    """
+    try:
+        return bin_to_inst_dict[(inst[:6], inst[26:32])]
+    except KeyError:
+        return bin_to_inst_dict[(inst[:6], 'xxxxxx')]
+
+
+def dest_reg(inst: str) -> Optional[int]:
+    """
+    register written by an instruction, None for none or $0
+    """
+    name = inst_name(inst)
+    if name == 'jal':
+        return 31
+    if name == 'syscall':
+        return 2  # result in $v0
+    if is_rtype(name) and name not in ('jr', 'syscall', 'break', 'mult'):
+        reg = int(inst[16:21], 2)
+    elif name in ('addi', 'andi', 'ori', 'xori', 'lw'):
+        reg = int(inst[11:16], 2)
+    else:
+        return None
+    return reg or None
+
+
+def src_regs(inst: str) -> list[int]:
+    """
+    registers read by an instruction, $0 left out
+    """
+    name = inst_name(inst)
+    rs, rt = int(inst[6:11], 2), int(inst[11:16], 2)
+    if name in ('sll', 'srl'):
+        regs = [rt]
+    elif name == 'jr':
+        regs = [rs]
+    elif name == 'syscall':
+        regs = [2, 4, 5, 6]  # $v0 and $a0-$a2
+    elif name in ('j', 'jal', 'break'):
+        regs = []
+    elif is_rtype(name) or name in ('sw', 'beq', 'bne'):
+        regs = [rs, rt]
+    else:
+        regs = [rs]
+    return [reg for reg in regs if reg]
+
+
+# instruction: (opcode, funct), 'jal' keeps its j-type encoding
+inst_to_bin_dict = {name: key for key, name in bin_to_inst_dict.items()}
+
+abi_regnames = {
+    'zero': 0, 'at': 1, 'v0': 2, 'v1': 3, 'a0': 4, 'a1': 5, 'a2': 6, 'a3': 7,
+    't0': 8, 't1': 9, 't2': 10, 't3': 11, 't4': 12, 't5': 13, 't6': 14,
+    't7': 15, 's0': 16, 's1': 17, 's2': 18, 's3': 19, 's4': 20, 's5': 21,
+    's6': 22, 's7': 23, 't8': 24, 't9': 25, 'k0': 26, 'k1': 27, 'gp': 28,
+    'sp': 29, 'fp': 30, 'ra': 31
+}
+
+
+def reg_no(name: str) -> int:
+    """
+    '$9', '$t1' or 't1' -> 9
+    """
+    name = name.lstrip('$')
+    if name.isdigit():
+        return int(name)
+    return abi_regnames[name]
+
+
+def assemble(name: str, *operands: int) -> str:
+    """
+    encode one instruction, operands are in the order used by
+    instructions_readable.txt:
+        add rd rs rt, sll rd rt shamt, jr rs, mult rs rt, syscall
+        addi rt rs imm, lw/sw rt imm rs, beq/bne rs rt offset, j target
+    """
+    opcode, funct = inst_to_bin_dict[name]
+    if funct != 'xxxxxx':
+        rd = rs = rt = shamt = 0
+        if name in ('sll', 'srl'):
+            rd, rt, shamt = operands
+        elif name == 'jr':
+            rs, = operands
+        elif name in ('mult', 'multu', 'div', 'divu'):
+            rs, rt = operands
+        elif name in ('mfhi', 'mflo'):
+            rd, = operands
+        elif operands:
+            rd, rs, rt = operands
+        return (opcode + f'{rs:05b}' + f'{rt:05b}' + f'{rd:05b}' +
+                f'{shamt:05b}' + funct)
+    if name in ('j', 'jal'):
+        target, = operands
+        return opcode + f'{target & (2**26 - 1):026b}'
+    if name in ('lw', 'sw'):
+        rt, imm, rs = operands
+    elif is_branch(name):
+        rs, rt, imm = operands
+    else:
+        rt, rs, imm = operands
+    return opcode + f'{rs:05b}' + f'{rt:05b}' + sign_extend(imm, 16)
+
+
+def assemble_line(line: str) -> str:
+    """
+    assemble one line of text like 'addi $9 $0 0x1  // comment'
+    """
+    line = line.split('//')[0].split('#')[0]
+    name, *args = line.replace(',', ' ').replace('(', ' ').replace(')', ' ').split()
+    operands = [reg_no(arg) if arg.startswith('$') else int(arg, 0)
+                for arg in args]
+    return assemble(name, *operands)
+
+
+def assemble_program(text: str) -> list[str]:
+    """
+    assemble every non-empty line of a program
+    """
+    return [assemble_line(line) for line in text.splitlines()
+            if line.split('//')[0].split('#')[0].strip()]
+
+
+def disassemble(inst: str) -> str:
+    """
+    text of one instruction in the operand order of assemble()
+    """
+    if inst == '0' * 32:
+        return 'nop'
+    name = inst_name(inst)
+    rs, rt, rd = int(inst[6:11], 2), int(inst[11:16], 2), int(inst[16:21], 2)
+    imm = bin_to_int_signed(inst[16:], 16)
+    if name in ('sll', 'srl'):
+        return f'{name} ${rd} ${rt} {int(inst[21:26], 2)}'
+    if name == 'jr':
+        return f'jr ${rs}'
+    if name in ('mult', 'multu', 'div', 'divu'):
+        return f'{name} ${rs} ${rt}'
+    if name in ('mfhi', 'mflo'):
+        return f'{name} ${rd}'
+    if name in ('syscall', 'break'):
+        return name
+    if is_rtype(name):
+        return f'{name} ${rd} ${rs} ${rt}'
+    if name in ('j', 'jal'):
+        return f'{name} {int(inst[6:], 2)}'
+    if name in ('lw', 'sw'):
+        return f'{name} ${rt} {imm} ${rs}'
+    if is_branch(name):
+        return f'{name} ${rs} ${rt} {imm}'
+    return f'{name} ${rt} ${rs} {imm}'
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    with open('instructions_readable.txt', 'r', encoding='utf-8') as f:
+        readable = f.read()
+    with open('instructions.txt', 'r', encoding='utf-8') as f:
+        binary = [line.strip() for line in f if line.strip()]
+    print(assemble_program(readable) == binary)
+    print(all(assemble_line(disassemble(inst)) == inst for inst in binary))
+    print(inst_name(assemble('sll', 1, 2, 3)), inst_name(assemble('lw', 1, 4, 0)))
+    print(dest_reg(assemble('add', 8, 9, 10)), src_regs(assemble('sw', 8, 4, 9)))
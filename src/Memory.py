@@ -1,37 +1,136 @@
 """
-design memory for the MIPS simulator. Because memory 
+design memory for the MIPS simulator. Because memory
 is a large array, we use a class to represent it.
+
+The memory is sparse and page granular: the 32-bit word address space is
+split into pages of `page_size` words and a page is only allocated the
+first time one of its words is written. Reading an untouched word returns
+zero without allocating anything, so the footprint of a run is
+proportional to what the program actually touches.
+
+Pages can be shared between simulator instances with `fork()`. Shared
+pages are copied on the first write (copy-on-write), so both memories
+start from the same image but never see each other's later stores.
 """
 
 
 from typing import Iterator
 
+ZERO_WORD = '0' * 32
+ADDRESS_SPACE = 2 ** 32  # words addressable with a 32-bit address
+PAGE_SIZE = 1024  # words per page
+
 
 class Memory:
-    def __init__(self, size: int) -> None:
+    def __init__(self, size: int = ADDRESS_SPACE,
+                 page_size: int = PAGE_SIZE) -> None:
+        if page_size <= 0 or page_size & (page_size - 1):
+            raise ValueError('page_size must be a power of two')
         self.size = size
-        self.mem = ['0'*32 for _ in range(size)]
+        self.page_size = page_size
+        self.page_bits = page_size.bit_length() - 1
+        self.offset_mask = page_size - 1
+        # page number -> list of words
+        self.pages: dict[int, list[str]] = {}
+        # page numbers that are still shared with another Memory
+        self.shared: set[int] = set()
+
+    def _check(self, key: int) -> None:
+        if not 0 <= key < self.size:
+            raise IndexError(f'memory address {key} out of range')
 
     def __getitem__(self, key: int) -> str:
-        return self.mem[key]
+        self._check(key)
+        page = self.pages.get(key >> self.page_bits)
+        if page is None:
+            return ZERO_WORD
+        return page[key & self.offset_mask]
 
     def __setitem__(self, key: int, val: str) -> None:
-        self.mem[key] = val
+        self._check(key)
+        page_no = key >> self.page_bits
+        page = self.pages.get(page_no)
+        if page is None:
+            page = self.pages[page_no] = [ZERO_WORD] * self.page_size
+        elif page_no in self.shared:
+            # copy-on-write: take a private copy before the first store
+            page = self.pages[page_no] = page.copy()
+            self.shared.discard(page_no)
+        page[key & self.offset_mask] = val
+
+    def write_block(self, start: int, words: list[str]) -> None:
+        """
+        write consecutive words from `start` on, a page slice at a time
+        """
+        self._check(start)
+        if words:
+            self._check(start + len(words) - 1)
+        done = 0
+        while done < len(words):
+            address = start + done
+            offset = address & self.offset_mask
+            chunk = min(self.page_size - offset, len(words) - done)
+            # a store makes the page resident and private
+            self[address] = words[done]
+            self.pages[address >> self.page_bits][offset:offset + chunk] = \
+                words[done:done + chunk]
+            done += chunk
+
+    def clear(self) -> None:
+        self.pages.clear()
+        self.shared.clear()
+
+    def fork(self) -> 'Memory':
+        """
+        return a new Memory sharing every resident page with this one.
+        pages are copied lazily by whichever side writes to them first.
+        """
+        return self.share(Memory(self.size, self.page_size))
+
+    def share(self, child: 'Memory') -> 'Memory':
+        """
+        hand every resident page to `child` as a copy-on-write page
+        """
+        child.pages = dict(self.pages)
+        child.shared = set(self.pages)
+        self.shared.update(self.pages)
+        return child
+
+    @property
+    def resident_pages(self) -> int:
+        return len(self.pages)
+
+    @property
+    def resident_words(self) -> int:
+        return len(self.pages) * self.page_size
+
+    def touched_addresses(self) -> Iterator[int]:
+        """
+        addresses of every word in the resident pages, in ascending order
+        """
+        for page_no in sorted(self.pages):
+            base = page_no << self.page_bits
+            yield from range(base, min(base + self.page_size, self.size))
 
     def __str__(self) -> str:
-        return '\n'.join([f'{i}: {self.mem[i]}' for i in range(self.size)])
+        # untouched pages are all zero, so only the resident ones are printed
+        return '\n'.join([f'{i}: {self[i]}' for i in self.touched_addresses()])
 
     def __len__(self) -> int:
-        return self.size
+        """
+        words iter() yields, the address space is `size`
+        """
+        return sum(min(self.page_size, self.size - (page_no << self.page_bits))
+                   for page_no in self.pages)
 
     def __iter__(self) -> Iterator[str]:
-        return iter(self.mem)
-
-    def __next__(self) -> str:
-        try:
-            return next(iter(self.mem))
-        except StopIteration as e:
-            raise StopIteration from e
+        """
+        words of the resident pages in address order, like __str__ the
+        untouched (all zero) pages are left out
+        """
+        for page_no in sorted(self.pages):
+            page = self.pages[page_no]
+            yield from page[:min(self.page_size, self.size - (page_no << self.page_bits))]
 
 
 # * =========== test ===========
@@ -42,3 +141,13 @@ if __name__ == '__main__':
     mem[2] = '10'*16
 
     print(mem)
+
+    # full 32-bit space: a stack near the top costs a single page
+    big: Memory = Memory()
+    big[0x7fffffff] = '1'*32
+    print(big[0x7fffffff], big[0x7ffffffe], big.resident_pages)
+
+    # copy-on-write sharing between two simulator instances
+    child = big.fork()
+    child[0x7fffffff] = '0'*31 + '1'
+    print(big[0x7fffffff], child[0x7fffffff])
@@ -0,0 +1,158 @@
+"""
+interval metrics: ipc, data cache, stalls and branches every N cycles
+
+    with MetricsSampler('metrics.csv', every=10000) as sampler:
+        main.use_metrics(sampler)
+        main.run_program(program)
+
+the run hands the sampler its cumulative counters every `every` cycles
+(later when a memory stall jumps the clock past the boundary) and once at
+the end. the sampler turns the difference to the last snapshot into one
+row and sends it on right away: to a .csv or .jsonl file, picked by the
+extension, and / or to `callback`. only the last snapshot and the newest
+`keep` rows stay in memory, however long the run.
+
+row fields:
+    cycle_start, cycle_end      the interval, cycle_end not included
+    instructions, ipc           retired in the interval
+    dcache_hits, dcache_misses, dcache_miss_rate
+    stall_<cause>               decode stall cycles by cause (Forwarding)
+    stall_memory                cycles the pipeline waited for memory
+    branches, branches_taken, taken_rate
+"""
+import csv
+import json
+from collections import deque
+from types import TracebackType
+from typing import Any, Callable, Optional, TextIO
+
+from Forwarding import STALL_CAUSES
+
+# cumulative counters of main.counters(), the interval takes their deltas
+COUNTERS = ('cycle', 'instructions', 'dcache_hits', 'dcache_misses') + \
+    tuple(f'stall_{cause}' for cause in STALL_CAUSES) + \
+    ('stall_memory', 'branches', 'branches_taken')
+FIELDS = ('cycle_start', 'cycle_end', 'instructions', 'ipc', 'dcache_hits',
+          'dcache_misses', 'dcache_miss_rate') + \
+    tuple(f'stall_{cause}' for cause in STALL_CAUSES) + \
+    ('stall_memory', 'branches', 'branches_taken', 'taken_rate')
+
+Row = dict[str, float]
+
+
+class MetricsSampler:
+    def __init__(self, path: Optional[str] = None, every: int = 10000,
+                 callback: Optional[Callable[[Row], None]] = None,
+                 keep: int = 0) -> None:
+        if every <= 0:
+            raise ValueError('every must be positive')
+        self.path = path
+        self.every = every
+        self.callback = callback
+        self.recent: deque[Row] = deque(maxlen=keep)
+        self.file: Optional[TextIO] = None
+        self.writer: Any = None
+        if path is not None:
+            self.file = open(path, 'w', encoding='utf-8', newline='')  # skipcq: PTC-W6004
+            if not path.endswith('.jsonl'):
+                self.writer = csv.DictWriter(self.file, FIELDS)
+                self.writer.writeheader()
+        self.rows = 0
+        self.last: Optional[dict[str, int]] = None
+        self.next_cycle = 0
+
+    def start(self, counters: dict[str, int]) -> None:
+        """
+        a run begins, `counters` are its values before the first cycle
+        """
+        self.last = counters
+        self.next_cycle = counters['cycle'] + self.every
+
+    def sample(self, counters: dict[str, int]) -> None:
+        """
+        close the interval since the last snapshot
+        """
+        last = self.last
+        if last is None or counters['cycle'] <= last['cycle']:
+            return
+        delta = {key: counters[key] - last[key] for key in COUNTERS}
+        accesses = delta['dcache_hits'] + delta['dcache_misses']
+        row: Row = {'cycle_start': last['cycle'], 'cycle_end': counters['cycle']}
+        row.update({key: delta[key] for key in FIELDS if key in delta})
+        row['ipc'] = delta['instructions'] / delta['cycle']
+        row['dcache_miss_rate'] = delta['dcache_misses'] / accesses if accesses else 0.0
+        row['taken_rate'] = delta['branches_taken'] / delta['branches'] \
+            if delta['branches'] else 0.0
+        self.last = counters
+        self.next_cycle = counters['cycle'] + self.every
+        self._emit(row)
+
+    def _emit(self, row: Row) -> None:
+        self.rows += 1
+        self.recent.append(row)
+        if self.callback is not None:
+            self.callback(row)
+        if self.file is None:
+            return
+        if self.writer is not None:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> 'MetricsSampler':
+        return self
+
+    def __exit__(self, exc_type: Optional[type[BaseException]],
+                 exc: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.close()
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+    import os
+    import tempfile
+
+    import main
+    from Cache import data_mem
+    from Isa import assemble_program
+    from NonBlockingCache import NonBlockingCache
+
+    # an alu loop, then a loop missing in the cache on every load: the
+    # ipc drops and the stalls waiting for the loads (load_miss with a
+    # non-blocking cache) show up in the second half
+    program = assemble_program('''
+        addi $8 $0 40
+        addi $9 $9 1
+        add $10 $10 $9
+        addi $8 $8 -1
+        bne $8 $0 -4
+        addi $8 $0 40
+        lw $11 0 $12
+        add $10 $10 $11
+        addi $12 $12 8
+        addi $8 $8 -1
+        bne $8 $0 -5''')
+    main.use_data_cache(NonBlockingCache(data_mem.fork(), 256, 32, 2, miss_latency=20))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metrics.csv')
+        with MetricsSampler(path, every=100, keep=3) as sampler:
+            main.use_metrics(sampler)
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.run_program(program)
+        main.use_metrics(None)
+        with open(path, 'r', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                print(record['cycle_start'], record['cycle_end'], 'ipc',
+                      f"{float(record['ipc']):.2f}", 'misses', record['dcache_misses'],
+                      'memory stalls', record['stall_memory'],
+                      'load_miss stalls', record['stall_load_miss'],
+                      'branches', record['branches_taken'], '/', record['branches'])
+    print(sampler.rows, 'rows,', len(sampler.recent), 'kept')
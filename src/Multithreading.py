@@ -0,0 +1,255 @@
+"""
+hardware multithreading: several thread contexts sharing one pipeline
+
+every context has its own pc, register file, scoreboard and syscall
+emulator. the pipeline registers, the data cache and the memory are
+shared (like the threads of one process: programs that must not see each
+other's stores use different addresses). an instruction in flight carries
+the id of its thread, hazards and forwarding only look at older
+instructions of the same thread and a taken branch squashes only the
+younger instructions of its own thread.
+
+the policy picks the thread that fetches:
+    fine            -> round-robin, another thread every cycle
+    switch_on_miss  -> the same thread until it misses in the data cache,
+                       then the next one
+    smt             -> simultaneous: up to issue_width instructions per
+                       cycle, one of every ready thread, at most
+                       `mem_ports` of them loads / stores
+with fine and switch_on_miss an issue_width > 1 issues packets of the
+picked thread as in the single-thread run (Superscalar). the smt
+instructions of a cycle go down the lanes of the pipeline as one packet
+too: a stall in ID of any of them holds the others of its packet.
+
+a load that misses does not stay in the pipeline as it does with a
+single thread: it leaves the pipeline with the younger instructions of its
+thread, the thread is parked until the line is there and then fetches
+the load again (a hit, counted once more by the cache). the other threads
+use the pipeline meanwhile. a load that misses again when it comes back
+(the others evicted its line) stays, as in a single-thread run: with a
+non-blocking cache only its users wait, with a blocking one every thread
+does, so threads sharing a set cannot starve each other.
+
+    stats = run_threads([program_a, program_b], 'fine')
+
+counters:
+    thread<t>_instructions, thread<t>_ipc     retired by thread t
+    thread<t>_cycles                          cycle its last instruction
+                                              retired in
+    thread<t>_replays                         loads squashed by a miss
+    thread_switches                           cycles the fetching thread
+                                              changed in
+"""
+from typing import Any, Callable, Optional
+
+from Register import RegFile, Scoreboard
+from Superscalar import MEMORY
+from Syscall import SyscallEmulator
+from Isa import inst_name
+
+POLICIES = ('fine', 'switch_on_miss', 'smt')
+
+
+class ThreadContext:
+    """
+    architectural state of one hardware thread, its program is in inst_mem
+    from `base` to `program_end`
+    """
+
+    def __init__(self, tid: int, base: int, end: int, reg_file: RegFile,
+                 scoreboard: Scoreboard, syscalls: SyscallEmulator) -> None:
+        self.tid = tid
+        self.base = base
+        self.pc = self.next_pc = base
+        self.program_end = end
+        self.reg_file = reg_file
+        self.scoreboard = scoreboard
+        self.syscalls = syscalls
+        # no fetch before this cycle, set by a load that missed, and the pc
+        # of that load until it is done
+        self.blocked_until = 0
+        self.replayed: Optional[int] = None
+        self.retired = self.replays = self.last_retire = 0
+
+    def ready(self, cycle: int) -> bool:
+        return self.pc < self.program_end and self.blocked_until <= cycle
+
+
+class ThreadScheduler:
+    def __init__(self, lengths: list[int], policy: str = 'fine',
+                 mem_ports: int = 1) -> None:
+        """
+        `lengths`: instructions of the program of every thread, the
+        programs lie one after the other in inst_mem
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}')
+        if not lengths:
+            raise ValueError('at least one thread is needed')
+        self.policy = policy
+        self.mem_ports = mem_ports
+        self.bounds: list[tuple[int, int]] = []
+        base = 0
+        for length in lengths:
+            self.bounds.append((base, base + length))
+            base += length
+        self.threads: list[ThreadContext] = []
+        self.current = self.switches = 0
+
+    def start(self, reg_file: RegFile, scoreboard: Scoreboard,
+              syscalls: SyscallEmulator) -> list[ThreadContext]:
+        """
+        fresh contexts for a run, thread 0 gets the given register file,
+        scoreboard and syscall emulator, the others new ones writing to the
+        same host streams
+        """
+        self.threads = [
+            ThreadContext(0, *self.bounds[0], reg_file, scoreboard, syscalls)]
+        for tid, (base, end) in enumerate(self.bounds[1:], 1):
+            self.threads.append(ThreadContext(
+                tid, base, end, RegFile(), Scoreboard(),
+                SyscallEmulator(syscalls.stdin, syscalls.stdout, syscalls.stderr,
+                                syscalls.heap_base, syscalls.buffer_size,
+                                syscalls.root)))
+        self.current = self.switches = 0
+        return self.threads
+
+    def select(self, cycle: int, width: int, inst_mem: Any) -> list[Optional[int]]:
+        """
+        threads fetching this cycle, one per lane. [None] when none of
+        them can: all are parked or done
+        """
+        count = len(self.threads)
+        order = [(self.current + i) % count for i in range(1, count + 1)]
+        if self.policy == 'switch_on_miss':
+            # stay on the current thread as long as it is ready
+            order.insert(0, order.pop())
+        ready = [tid for tid in order if self.threads[tid].ready(cycle)]
+        if not ready:
+            return [None]
+        picked = ready[:1]
+        if self.policy == 'smt':
+            memory_ops = 0
+            picked = []
+            for tid in ready:
+                if len(picked) == width:
+                    break
+                if inst_name(inst_mem[self.threads[tid].pc]) in MEMORY:
+                    if memory_ops == self.mem_ports:
+                        continue
+                    memory_ops += 1
+                picked.append(tid)
+        if picked[0] != self.current:
+            self.switches += 1
+        self.current = picked[0]
+        return list(picked)
+
+    def park(self, tid: int, pc: int, ready: int) -> None:
+        """
+        the load at `pc` of thread `tid` missed, it fetches again in cycle
+        `ready`
+        """
+        thread = self.threads[tid]
+        thread.blocked_until = ready
+        thread.replayed = pc
+        thread.replays += 1
+
+    def stats(self, cycles: int) -> dict[str, float]:
+        stats: dict[str, float] = {'threads': len(self.threads),
+                                   'thread_switches': self.switches}
+        for thread in self.threads:
+            stats[f'thread{thread.tid}_instructions'] = thread.retired
+            stats[f'thread{thread.tid}_ipc'] = thread.retired / max(cycles, 1)
+            stats[f'thread{thread.tid}_cycles'] = thread.last_retire
+            stats[f'thread{thread.tid}_replays'] = thread.replays
+        return stats
+
+
+def run_threads(programs: list[list[str]], policy: str = 'fine',
+                issue_width: int = 1, mem_ports: int = 1,
+                **kwargs: Any) -> dict[str, float]:
+    """
+    run one program per hardware thread, `kwargs` go to main.run_program
+    """
+    import main  # pylint: disable=import-outside-toplevel
+    main.use_threads(ThreadScheduler([len(program) for program in programs],
+                                     policy, mem_ports))
+    try:
+        return main.run_program([inst for program in programs for inst in program],
+                                issue_width=issue_width, **kwargs)
+    finally:
+        main.use_threads(None)
+
+
+def throughput_gain(programs: list[list[str]], policy: str = 'fine',
+                    issue_width: int = 1,
+                    before_run: Optional[Callable[[], None]] = None
+                    ) -> dict[str, float]:
+    """
+    cycles of the programs run one after the other on a single thread
+    against all of them at once on the threads. `before_run` is called
+    before every run, e.g. to give it a fresh data cache
+
+    Returns:
+        dict[str, float]: the multithreaded stats plus sequential_cycles
+            and throughput_gain (sequential / multithreaded cycles)
+    """
+    import main  # pylint: disable=import-outside-toplevel
+    sequential = 0
+    for program in programs:
+        if before_run is not None:
+            before_run()
+        sequential += main.run_program(program, issue_width=issue_width)['cycles']
+    if before_run is not None:
+        before_run()
+    stats = run_threads(programs, policy, issue_width)
+    stats['sequential_cycles'] = sequential
+    stats['throughput_gain'] = sequential / max(stats['cycles'], 1)
+    return stats
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+
+    import main
+    from Cache import data_mem
+    from Isa import assemble_program
+    from NonBlockingCache import NonBlockingCache
+
+    # a loop missing in the cache on every load and an alu loop with a
+    # dependency chain: alone they wait for memory and for each other,
+    # together one fills the other's stalls
+    loads = assemble_program('''
+        addi $8 $0 30
+        lw $11 0 $12
+        add $10 $10 $11
+        addi $12 $12 8
+        addi $8 $8 -1
+        bne $8 $0 -5''')
+    alu = assemble_program('''
+        addi $8 $0 60
+        addi $9 $9 3
+        add $10 $10 $9
+        sll $11 $10 1
+        addi $8 $8 -1
+        bne $8 $0 -5''')
+    stream = assemble_program('\n'.join(f'lw $9 {4096 + 8 * i} $0' for i in range(30)))
+
+    def fresh_cache() -> None:
+        main.use_data_cache(NonBlockingCache(data_mem.fork(), 256, 32, 2,
+                                             miss_latency=20))
+
+    for workload, threads in (('loads + alu', [loads, alu]),
+                              ('loads + stream', [loads, stream])):
+        for policy in POLICIES:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = throughput_gain(threads, policy, 2 if policy == 'smt' else 1,
+                                         fresh_cache)
+            print(f'{workload:15} {policy:15}', result['cycles'], 'cycles, alone',
+                  result['sequential_cycles'],
+                  f"gain {result['throughput_gain']:.2f}",
+                  'ipc', ' '.join(f"{result[f'thread{tid}_ipc']:.2f}"
+                                  for tid in range(len(threads))),
+                  'switches', result['thread_switches'])
@@ -0,0 +1,265 @@
+"""
+non-blocking data cache built on top of the 2-way MSI `Cache`
+
+the data is still moved by the functional Cache (cache[address] reads,
+writes and fills exactly as before). this class adds the timing of the
+structures that let a cache keep working while misses are outstanding:
+    MSHRs        -> one entry per line being filled, a second miss on the
+                    same line merges into the entry instead of going to
+                    memory again. when every MSHR is busy the access waits
+                    for the first one to free up.
+    write buffer -> dirty victims are queued and drained to memory in the
+                    background, a second eviction of a queued line is
+                    coalesced into the existing entry.
+    victim cache -> small fully-associative store of recently evicted
+                    lines, a miss that finds its line there is served in
+                    `victim_latency` cycles instead of `miss_latency`.
+                    a dirty line keeps its dirty bit when it comes back,
+                    it is written back when it is evicted again.
+
+`accepted` is the cycle the cache took the last access in, once an MSHR
+(and write buffer entry) was free. a load can leave the MEM stage then,
+only the instructions using its value wait for the fill.
+
+the write policies and the Dram backing are the ones of Cache, with a
+Dram the write buffer drains into its write queue. a store miss that does not
+allocate takes no MSHR, it only waits for the store buffer.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+from Cache import Cache
+from Memory import Memory
+
+
+class Occupancy:
+    """
+    occupancy of a buffer sampled on every access
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.samples = self.total = self.peak = 0
+
+    def sample(self, used: int) -> None:
+        self.samples += 1
+        self.total += used
+        self.peak = max(self.peak, used)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+    def __str__(self) -> str:
+        return f'avg {self.average:.2f}/{self.capacity}, peak {self.peak}'
+
+
+class NonBlockingCache(Cache):
+    """
+    n-way set-associative cache with MSHRs, a coalescing write buffer and
+    an optional victim cache
+    """
+
+    def __init__(self, mem: Memory, cache_size: int,
+                 line_of_data_size: int, associativity: int,
+                 miss_latency: int = 20, mshr_no: int = 4,
+                 write_buffer_size: int = 4, write_latency: int = 10,
+                 victim_entries: int = 0, victim_latency: int = 1,
+                 write_policy: str = 'write_back', write_allocate: bool = True,
+                 store_buffer_size: int = 4,
+                 store_latency: Optional[int] = None) -> None:
+        self.mshr_no = mshr_no
+        self.write_buffer_size = write_buffer_size
+        self.write_latency = write_latency
+        self.victim_entries = victim_entries
+        self.victim_latency = victim_latency
+        # line -> cycle its fill completes
+        self.mshrs: dict[str, int] = {}
+        # line -> cycle it has been written to memory
+        self.write_buffer: dict[str, int] = {}
+        # line -> dirty, least recently evicted first
+        self.victims: OrderedDict[str, bool] = OrderedDict()
+        # lines swapped back in from the victim cache while dirty
+        self.dirty_victims: set[str] = set()
+        super().__init__(mem, cache_size, line_of_data_size, associativity,
+                         miss_latency, write_policy, write_allocate,
+                         store_buffer_size, store_latency)
+
+    def line_of(self, address: str) -> str:
+        return address[:self.tag_bits_no + self.logic_set_bits_no]
+
+    def _retire(self, cycle: int) -> None:
+        """
+        free the MSHRs and write buffer entries that are done by `cycle`
+        """
+        for line in [line for line, ready in self.mshrs.items() if ready <= cycle]:
+            del self.mshrs[line]
+        for line in [line for line, done in self.write_buffer.items() if done <= cycle]:
+            del self.write_buffer[line]
+
+    def _write_back(self, line: str, cycle: int) -> int:
+        """
+        queue a dirty line, returns the cycle the queue accepted it
+        """
+        if line in self.write_buffer:
+            self.write_buffer_coalesced += 1
+            return cycle
+        if len(self.write_buffer) >= self.write_buffer_size:
+            self.write_buffer_full_stalls += 1
+            cycle = min(self.write_buffer.values())
+            self._retire(cycle)
+        start = max(self.write_port_free, cycle)
+        if self.dram is None:
+            self.write_port_free = start + self.write_latency
+        else:
+            self.write_port_free = self.dram.access(
+                int(line, 2) << self.block_offset_bits_no, start,
+                self.line_of_data_size, is_write=True)
+        self.write_buffer[line] = self.write_port_free
+        self.write_buffer_writes += 1
+        return cycle
+
+    def _victim(self, address: str, cycle: int) -> int:
+        """
+        move the line the fill of `address` replaces out of the cache
+        """
+        _, logic_set, _ = self.split(address)
+        way = self.lru[logic_set]
+        if self.blocks[logic_set][way][0].state == 'invalid':
+            return cycle
+        line = self.blocks[logic_set][way][0].tag + \
+            f'{logic_set:0{self.logic_set_bits_no}b}'[:self.logic_set_bits_no]
+        dirty = self.is_dirty(logic_set, way) or line in self.dirty_victims
+        self.dirty_victims.discard(line)
+        if self.victim_entries:
+            self.victims[line] = dirty
+            self.victims.move_to_end(line)
+            if len(self.victims) <= self.victim_entries:
+                return cycle
+            line, dirty = self.victims.popitem(last=False)
+        if dirty:
+            cycle = self._write_back(line, cycle)
+        return cycle
+
+    def issue_prefetch(self, line: int, cycle: int) -> None:
+        """
+        a prefetch takes a free MSHR like a miss, it is dropped when none
+        is free so it never delays a demand access
+        """
+        address = f'{line << self.block_offset_bits_no:032b}'
+        line_bits = self.line_of(address)
+        if len(address) > 32 or line in self.prefetched or line_bits in self.mshrs or \
+                self.probe(address):
+            return
+        if len(self.mshrs) >= self.mshr_no:
+            self.prefetches_dropped += 1
+            return
+        self._victim(address, cycle)
+        self.__setitem__(address, '', 'mem')
+        self.mshrs[line_bits] = self.prefetched[line] = self.read_line(address, cycle)
+        if self.prefetcher is not None:
+            self.prefetcher.issued += 1
+
+    def access(self, address: str, cycle: int, is_write: bool = False,
+               pc: Optional[int] = None) -> int:
+        """
+        timing of one access issued in `cycle`. loads complete when their
+        line is there, stores are absorbed as soon as they got an MSHR (and
+        a store buffer entry if they go to memory).
+
+        Returns:
+            int: the cycle in which the access completes
+        """
+        self._retire(cycle)
+        self.issue_pending_prefetches()
+        self.mshr_occupancy.sample(len(self.mshrs))
+        self.write_buffer_occupancy.sample(len(self.write_buffer))
+        ready, hit = self._lookup(address, cycle, is_write)
+        if is_write:
+            self.accepted = ready
+        self.train_prefetcher(address, pc, hit, cycle)
+        return ready
+
+    def _lookup(self, address: str, cycle: int, is_write: bool) -> tuple[int, bool]:
+        line = self.line_of(address)
+        self.accepted = cycle
+
+        prefetched = self.demand_prefetched(address, cycle)
+        if prefetched is not None:
+            self.hits += 1
+            return (self.store(address, cycle) if is_write else max(cycle, prefetched)), True
+        # the line is already on its way, merge with the outstanding miss
+        if line in self.mshrs:
+            self.mshr_merges += 1
+            return (self.store(address, cycle) if is_write else self.mshrs[line]), False
+        if self.probe(address):
+            self.hits += 1
+            return (self.store(address, cycle) if is_write else cycle), True
+        self.misses += 1
+        if is_write and not self.write_allocate:
+            return self.store(address, cycle, allocated=False), False
+
+        if line in self.victims:
+            self.victim_hits += 1
+            if self.victims.pop(line):
+                self.dirty_victims.add(line)
+            cycle = self.accepted = self._victim(address, cycle)
+            return (self.store(address, cycle) if is_write
+                    else cycle + self.victim_latency), False
+        if self.victim_entries:
+            self.victim_misses += 1
+
+        if len(self.mshrs) >= self.mshr_no:
+            self.mshr_full_stalls += 1
+            cycle = min(self.mshrs.values())
+            self._retire(cycle)
+        cycle = self.accepted = self._victim(address, cycle)
+        self.mshrs[line] = self.read_line(address, cycle)
+        return (self.store(address, cycle) if is_write else self.mshrs[line]), False
+
+    def reset(self) -> None:
+        super().reset()
+        self.mshrs.clear()
+        self.write_buffer.clear()
+        self.victims.clear()
+        self.dirty_victims.clear()
+        self.write_port_free = 0
+        self.mshr_merges = self.mshr_full_stalls = 0
+        self.write_buffer_writes = self.write_buffer_coalesced = 0
+        self.write_buffer_full_stalls = 0
+        self.victim_hits = self.victim_misses = 0
+        self.prefetches_dropped = 0
+        self.mshr_occupancy = Occupancy(self.mshr_no)
+        self.write_buffer_occupancy = Occupancy(self.write_buffer_size)
+
+    def stats(self) -> dict[str, float]:
+        return super().stats() | {
+            'mshr_merges': self.mshr_merges,
+            'mshr_full_stalls': self.mshr_full_stalls,
+            'mshr_avg_occupancy': self.mshr_occupancy.average,
+            'mshr_peak_occupancy': self.mshr_occupancy.peak,
+            'write_buffer_writes': self.write_buffer_writes,
+            'write_buffer_coalesced': self.write_buffer_coalesced,
+            'write_buffer_full_stalls': self.write_buffer_full_stalls,
+            'write_buffer_avg_occupancy': self.write_buffer_occupancy.average,
+            'write_buffer_peak_occupancy': self.write_buffer_occupancy.peak,
+            'victim_hits': self.victim_hits,
+            'victim_misses': self.victim_misses,
+            'prefetches_dropped': self.prefetches_dropped,
+        }
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    from BinFuncs import sign_extend
+
+    memory = Memory()
+    cache = NonBlockingCache(memory, 256, 32, 2, miss_latency=20, mshr_no=2,
+                             victim_entries=2)
+    stride = cache.sets_no * cache.blocks_in_line
+    # two misses to different lines overlap, the third waits for an MSHR
+    print(cache.access(sign_extend(0, 32), 0))           # 20
+    print(cache.access(sign_extend(1, 32), 1))           # 20, merged
+    print(cache.access(sign_extend(stride, 32), 2))      # 22
+    print(cache.access(sign_extend(2 * stride, 32), 3))  # 40, waited
+    print(cache.stats())
@@ -5,38 +5,118 @@ data includes:
     - control signals
     - data from the previous stage
     - data from the current stage
+
+every pipeline register is double buffered: the stage in front of it
+reads `cur` and the stage behind it writes `nxt`. commit() swaps the two
+once per clock, so the stages can be evaluated in any order (or in
+parallel) within a cycle. the records use __slots__ and the instruction
+fields are decoded once in ID and then carried along.
 """
 
 from typing import Any
 
 
+class Latch:
+    """
+    base class of the latch records, `valid` is False for a bubble
+    """
+    __slots__ = ()
+    # seq numbers the fetched instructions, for the timeline, tid is the
+    # hardware thread an instruction belongs to (Multithreading)
+    FIELDS: tuple[str, ...] = ('valid', 'pc', 'seq', 'ir', 'tid')
+
+    def __init__(self) -> None:
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+        self.valid = False
+        self.ir = '0' * 32
+
+    def copy_from(self, other: 'Latch') -> None:
+        for field in self.FIELDS:
+            setattr(self, field, getattr(other, field))
+
+    def __str__(self) -> str:
+        return ', '.join(f'{field}: {getattr(self, field)}'
+                         for field in self.FIELDS)
+
+
+class IfId(Latch):
+    __slots__ = FIELDS = Latch.FIELDS
+
+
+class IdEx(Latch):
+    __slots__ = FIELDS = Latch.FIELDS + (
+        'name', 'rs', 'rt', 'rd', 'shamt', 'imm', 'dest',
+        # control signals
+        'reg_dst', 'alu_src', 'mem_to_reg', 'alu_op', 'mem_read',
+        'mem_write', 'branch', 'reg_write',
+        # register values read in ID
+        'rs_val', 'rt_val')
+
+
+class ExMem(Latch):
+    __slots__ = FIELDS = Latch.FIELDS + (
+        'name', 'rs', 'rt', 'rd', 'imm', 'dest',
+        'mem_to_reg', 'mem_read', 'mem_write', 'reg_write',
+        'alu_out', 'store_val')
+
+
+class MemWb(Latch):
+    __slots__ = FIELDS = Latch.FIELDS + (
+        'name', 'rs', 'rt', 'rd', 'imm', 'dest',
+        'mem_to_reg', 'mem_read', 'mem_write', 'reg_write',
+        'alu_out', 'mem_out')
+
+
 class PipelineRegister:
-    def __init__(self, name: str, data: dict[str, Any]) -> None:
+    def __init__(self, name: str, latch_type: type[Latch]) -> None:
         self.name = name
-        self.data = data
+        self.latch_type = latch_type
+        self.cur = latch_type()
+        self.nxt = latch_type()
 
-    def __getitem__(self, key: str) -> str:
-        return self.data[key]
+    def reset(self) -> None:
+        self.cur = self.latch_type()
+        self.nxt = self.latch_type()
 
-    def __setitem__(self, key: str, val: str) -> None:
-        self.data[key] = val
+    def commit(self) -> None:
+        """
+        clock edge: what the stage behind wrote becomes visible
+        """
+        self.cur, self.nxt = self.nxt, self.cur
+
+    def hold(self) -> None:
+        """
+        keep the current content for one more cycle (stall)
+        """
+        self.nxt.copy_from(self.cur)
+
+    def bubble(self) -> None:
+        """
+        insert a nop in the next cycle
+        """
+        self.nxt.valid = False
+        self.nxt.ir = '0' * 32
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self.cur, key)
 
     def __str__(self) -> str:
-        return f'{self.name}: {self.data}'
+        return f'{self.name}: {self.cur}'
 
     def __repr__(self) -> str:
         return str(self)
 
     def __len__(self) -> int:
-        return len(self.data)
+        return len(self.latch_type.FIELDS)
 
 
 # * =========== test ===========
 if __name__ == '__main__':
-    if_id = PipelineRegister(
-        'IF/ID',
-        {'PC': '0'*32,
-         'IR': '0'*32,
-         'PCWRITE': 1,
-         'IFIDWRITE': 1})
+    if_id = PipelineRegister('IF/ID', IfId)
+    if_id.nxt.valid = True
+    if_id.nxt.pc = 4
+    if_id.nxt.ir = '1' * 32
+    print(if_id)
+    if_id.commit()
     print(if_id)
@@ -0,0 +1,178 @@
+"""
+hardware prefetchers that can be attached to any cache level with
+cache.attach_prefetcher(prefetcher)
+
+the cache tells the prefetcher about every demand access, the prefetcher
+answers with the lines it wants brought in. the cache issues them (a fill
+for the blocking Cache, an MSHR for the NonBlockingCache) and reports back
+which of them turned out useful, late or useless.
+
+    NextLinePrefetcher -> the `degree` lines after the missing one
+    StridePrefetcher   -> per-pc stride table, prefetches `distance`
+                          strides ahead once a stride repeats
+    StreamPrefetcher   -> stream buffers that follow ascending misses
+
+counters:
+    accuracy   = useful / issued
+    coverage   = useful / (useful + demand misses left)
+    timeliness = on-time useful / useful
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+
+class Prefetcher(ABC):
+    """
+    base class, subclasses implement candidates()
+    """
+
+    def __init__(self, degree: int = 1, distance: int = 1) -> None:
+        self.degree = degree
+        self.distance = distance
+        # words per line as a shift, set by the cache it is attached to
+        self.line_shift = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.issued = self.useful = self.late = self.useless = 0
+        self.demand_misses = 0
+
+    @abstractmethod
+    def candidates(self, address: int, pc: Optional[int], hit: bool) -> list[int]:
+        """
+        lines to prefetch after a demand access to word `address`
+        """
+
+    def on_useful(self, late: bool) -> None:
+        self.useful += 1
+        if late:
+            self.late += 1
+
+    @property
+    def accuracy(self) -> float:
+        return self.useful / self.issued if self.issued else 0.0
+
+    @property
+    def coverage(self) -> float:
+        covered = self.useful + self.demand_misses
+        return self.useful / covered if covered else 0.0
+
+    @property
+    def timeliness(self) -> float:
+        return (self.useful - self.late) / self.useful if self.useful else 0.0
+
+    def stats(self) -> dict[str, float]:
+        return {'issued': self.issued, 'useful': self.useful,
+                'late': self.late, 'useless': self.useless,
+                'accuracy': self.accuracy, 'coverage': self.coverage,
+                'timeliness': self.timeliness}
+
+
+class NextLinePrefetcher(Prefetcher):
+    """
+    on a miss to line L prefetch L+distance ... L+distance+degree-1
+    """
+
+    def __init__(self, degree: int = 1, distance: int = 1,
+                 on_hit: bool = False) -> None:
+        super().__init__(degree, distance)
+        self.on_hit = on_hit
+
+    def candidates(self, address: int, pc: Optional[int], hit: bool) -> list[int]:
+        if hit and not self.on_hit:
+            return []
+        line = address >> self.line_shift
+        return [line + self.distance + i for i in range(self.degree)]
+
+
+class StridePrefetcher(Prefetcher):
+    """
+    reference prediction table indexed by the pc of the memory instruction.
+    each entry keeps the last address, the last stride and a 2-bit
+    confidence, prefetching starts once the stride has repeated twice.
+    """
+
+    def __init__(self, degree: int = 1, distance: int = 1,
+                 table_size: int = 64) -> None:
+        self.table_size = table_size
+        # pc -> [last address, stride, confidence]
+        self.table: OrderedDict[int, list[int]] = OrderedDict()
+        super().__init__(degree, distance)
+
+    def reset(self) -> None:
+        super().reset()
+        self.table.clear()
+
+    def candidates(self, address: int, pc: Optional[int], hit: bool) -> list[int]:
+        if pc is None:
+            return []
+        entry = self.table.get(pc)
+        if entry is None:
+            self.table[pc] = [address, 0, 0]
+            if len(self.table) > self.table_size:
+                self.table.popitem(last=False)
+            return []
+        self.table.move_to_end(pc)
+        last, stride, confidence = entry
+        new_stride = address - last
+        if new_stride == stride and stride != 0:
+            confidence = min(confidence + 1, 3)
+        else:
+            confidence = max(confidence - 1, 0)
+            if confidence == 0:
+                stride = new_stride
+        self.table[pc] = [address, stride, confidence]
+        if confidence < 2:
+            return []
+        line = address >> self.line_shift
+        lines = []
+        for i in range(self.degree):
+            target = (address + stride * (self.distance + i)) >> self.line_shift
+            if target != line and target not in lines and target >= 0:
+                lines.append(target)
+        return lines
+
+
+class StreamPrefetcher(Prefetcher):
+    """
+    `buffers_no` stream buffers. a miss that no buffer expects allocates
+    the least recently used buffer and prefetches the next `degree` lines,
+    an access to the line a buffer expects next advances that buffer and
+    keeps it `degree` lines ahead (starting `distance` lines away).
+    """
+
+    def __init__(self, degree: int = 4, distance: int = 1,
+                 buffers_no: int = 4) -> None:
+        self.buffers_no = buffers_no
+        # next expected line -> last line prefetched by that buffer
+        self.buffers: OrderedDict[int, int] = OrderedDict()
+        super().__init__(degree, distance)
+
+    def reset(self) -> None:
+        super().reset()
+        self.buffers.clear()
+
+    def candidates(self, address: int, pc: Optional[int], hit: bool) -> list[int]:
+        line = address >> self.line_shift
+        if line in self.buffers:
+            tail = self.buffers.pop(line)
+            self.buffers[line + 1] = tail + 1
+            return [tail + 1]
+        if hit:
+            return []
+        first = line + self.distance
+        self.buffers[line + 1] = first + self.degree - 1
+        if len(self.buffers) > self.buffers_no:
+            self.buffers.popitem(last=False)
+        return [first + i for i in range(self.degree)]
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    stride = StridePrefetcher(degree=2, distance=4)
+    stride.line_shift = 3
+    for i in range(5):
+        print(stride.candidates(100 + 24 * i, pc=4, hit=False))
+    stream = StreamPrefetcher(degree=2)
+    print(stream.candidates(0, None, False), stream.candidates(1, None, True))
@@ -0,0 +1,174 @@
+"""
+Opt-in profiling hooks for the simulator.
+
+StageProfiler records cumulative host time and call counts for every
+pipeline stage function of main.py and for the cache reads/writes/fills.
+The stage functions are only wrapped while the profiler is installed, so
+a normal run executes exactly the same code as before and pays nothing.
+
+The timings are also kept per call stack (self time, without children) and
+can be written in the collapsed-stack format read by flamegraph.pl,
+speedscope and inferno:
+
+    run_program;execute 1234
+    run_program;working_with_cache;cache.read;cache.fill 567
+
+usage:
+    python Profiler.py [program.txt] [--collapsed out.folded] [--cprofile out.prof]
+"""
+import argparse
+import cProfile
+import pstats
+import time
+from collections import defaultdict
+from types import ModuleType
+from typing import Any, Callable, Optional
+
+from Cache import Cache
+
+STAGES = ('fetch', 'decode', 'execute', 'working_with_cache', 'write_back',
+          'commit_latches')
+
+
+def _named(frame: str) -> Callable[..., str]:
+    return lambda *_args, **_kwargs: frame
+
+
+class StageProfiler:
+    """
+    wall-time profiler for the pipeline stages and cache operations
+
+    use it as a context manager around a run:
+        with StageProfiler() as prof:
+            main.run_program(program)
+        print(prof.report())
+    """
+
+    def __init__(self, module: Optional[ModuleType] = None,
+                 root: str = 'run_program') -> None:
+        self.module = module
+        self.root = root
+        self.total_time: dict[str, float] = defaultdict(float)
+        self.calls: dict[str, int] = defaultdict(int)
+        # 'a;b;c' -> self time spent in c when called from a -> b
+        self.stacks: dict[str, float] = defaultdict(float)
+        self._stack: list[str] = [root]
+        # time spent in the children of every frame on the stack
+        self._child_time: list[float] = [0.0]
+        self._saved: list[tuple[Any, str, Any]] = []
+
+    def _wrap(self, func: Callable[..., Any],
+              name: Callable[..., str]) -> Callable[..., Any]:
+        perf_counter = time.perf_counter
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            frame = name(*args, **kwargs)
+            self._stack.append(frame)
+            self._child_time.append(0.0)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                children = self._child_time.pop()
+                self.stacks[';'.join(self._stack)] += elapsed - children
+                self._stack.pop()
+                self._child_time[-1] += elapsed
+                self.total_time[frame] += elapsed
+                self.calls[frame] += 1
+        wrapper.__wrapped__ = func  # type: ignore[attr-defined]
+        return wrapper
+
+    def _patch(self, owner: Any, attr: str, name: Callable[..., str]) -> None:
+        func = getattr(owner, attr)
+        self._saved.append((owner, attr, func))
+        setattr(owner, attr, self._wrap(func, name))
+
+    def install(self) -> None:
+        if self._saved:
+            return
+        if self.module is None:
+            import main  # pylint: disable=import-outside-toplevel
+            self.module = main
+        for stage in STAGES:
+            self._patch(self.module, stage, _named(stage))
+        self._patch(Cache, '__getitem__', _named('cache.read'))
+        self._patch(Cache, '__setitem__',
+                    lambda _self, _addr, _val, from_where='cpu':
+                    'cache.fill' if from_where == 'mem' else 'cache.write')
+
+    def uninstall(self) -> None:
+        while self._saved:
+            owner, attr, func = self._saved.pop()
+            setattr(owner, attr, func)
+
+    def __enter__(self) -> 'StageProfiler':
+        self.install()
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        self.uninstall()
+
+    def collapsed(self) -> str:
+        """
+        collapsed stacks with self time in integer microseconds
+        """
+        return '\n'.join(f'{stack} {round(seconds * 1e6)}'
+                         for stack, seconds in sorted(self.stacks.items())
+                         if round(seconds * 1e6) > 0) + '\n'
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+    def report(self) -> str:
+        lines = [f'{"name":22}{"calls":>10}{"total ms":>12}{"per call us":>14}']
+        for frame, seconds in sorted(self.total_time.items(),
+                                     key=lambda item: -item[1]):
+            calls = self.calls[frame]
+            lines.append(f'{frame:22}{calls:>10}{seconds * 1e3:>12.3f}'
+                         f'{seconds / calls * 1e6:>14.2f}')
+        return '\n'.join(lines)
+
+
+def profile_call(func: Callable[..., Any], *args: Any,
+                 path: Optional[str] = None) -> tuple[Any, pstats.Stats]:
+    """
+    run func(*args) under cProfile, optionally dumping the raw profile to
+    `path` (readable by snakeviz, gprof2dot, flameprof, ...)
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args)
+    if path is not None:
+        profiler.dump_stats(path)
+    return result, pstats.Stats(profiler)
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import os
+    import sys
+    import main as simulator
+
+    parser = argparse.ArgumentParser(description='profile one simulation')
+    parser.add_argument('program', nargs='?', default='instructions.txt')
+    parser.add_argument('--collapsed', help='write collapsed stacks here')
+    parser.add_argument('--cprofile', help='also run under cProfile and '
+                        'dump the profile here')
+    args = parser.parse_args()
+
+    program = simulator.load_program(args.program)
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        with StageProfiler(simulator) as prof:
+            simulator.run_program(program)
+        if args.cprofile:
+            _, stats = profile_call(simulator.run_program, program,
+                                    path=args.cprofile)
+    print(prof.report())
+    if args.collapsed:
+        prof.write_collapsed(args.collapsed)
+    if args.cprofile:
+        stats.stream = sys.stdout  # created while stdout was silenced
+        stats.sort_stats('cumulative').print_stats(15)
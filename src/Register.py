@@ -1,51 +1,156 @@
 """
-Implement Register and Register File for MIPS
+Implement Register File and the register Scoreboard for MIPS
+
+the register file is an array of 32 unsigned 32-bit words indexed by the
+register number, $0 is hardwired to zero (writes to it are dropped).
+values are stored as ints, bits() / set_bits() convert at the boundary
+with the binary strings the ALU works on.
 """
+from array import array
+from typing import Optional
 
+REG_NO = 32
+WORD_MASK = 2**32 - 1
+# no instruction is going to write the register
+NO_WRITER = -1
 
-class Reg:
-    def __init__(self, name: str, val: int = 0) -> None:
-        self.name = name
-        self.val = val
 
-    def str_val(self) -> str:
-        if self.val < 0:
-            # why [3:]? because bin() returns '-0bxxxx'
-            return '1' * (32 - len(bin(self.val))) + 3*'1' + bin(self.val)[3:]
-        # why [2:]? because bin() returns '0bxxxx'
-        return '0' * (32 - len(bin(self.val))) + 2*'0' + bin(self.val)[2:]
+class RegFile:
+    def __init__(self) -> None:
+        # 'L' is at least 32 bits wide on every platform
+        self.regs = array('L', bytes(array('L').itemsize * REG_NO))
 
+    def reset(self) -> None:
+        for reg in range(REG_NO):
+            self.regs[reg] = 0
+
+    def __getitem__(self, reg: int) -> int:
+        """
+        signed value of a register
+        """
+        val = self.regs[reg]
+        return val - 2**32 if val >> 31 else val
+
+    def __setitem__(self, reg: int, val: int) -> None:
+        if reg:
+            self.regs[reg] = val & WORD_MASK
+
+    def bits(self, reg: int) -> str:
+        return f'{self.regs[reg]:032b}'
+
+    def set_bits(self, reg: int, val: str) -> None:
+        if reg:
+            self.regs[reg] = int(val, 2)
+
+    def __str__(self) -> str:
+        return '\n'.join([f'${reg}: {self[reg]}' for reg in range(REG_NO)])
+
+
+class Scoreboard:
+    """
+    for every register the instructions (their pc) in flight that are going
+    to write it, oldest first. an instruction reserves its destination in
+    ID and releases it when it is written back, a squashed one cancels it,
+    so `pending` tells the hazard unit in O(1) whether a source register
+    has to be looked for in the later stages at all. a result that comes
+    later than the stage it is in tells (a load that missed in a
+    non-blocking cache) gets the cycle it can be forwarded in, 0 while it
+    is on time: the hazard unit stalls its users until then.
+    """
 
-class RegFile:
     def __init__(self) -> None:
-        self.regs = [Reg(f'${i}') for i in range(32)]
+        # register -> [pc, ready] of every reservation
+        self.reservations: list[list[list[int]]] = [[] for _ in range(REG_NO)]
+
+    def reset(self) -> None:
+        for reservations in self.reservations:
+            reservations.clear()
+
+    def reserve(self, reg: int, pc: int) -> None:
+        if reg:
+            self.reservations[reg].append([pc, 0])
+
+    def _find(self, reg: int, pc: int, youngest: bool) -> int:
+        """
+        index of the oldest / youngest reservation of `reg` by `pc`, -1 if none
+        """
+        reservations = self.reservations[reg]
+        indices = range(len(reservations))
+        for i in (reversed(indices) if youngest else indices):
+            if reservations[i][0] == pc:
+                return i
+        return -1
+
+    def delay(self, reg: int, pc: int, ready: int) -> None:
+        """
+        the result of the writer at `pc` can not be forwarded before `ready`
+        """
+        i = self._find(reg, pc, youngest=True)
+        if i >= 0:
+            self.reservations[reg][i][1] = max(self.reservations[reg][i][1], ready)
+
+    def release(self, reg: int, pc: int) -> None:
+        """
+        the oldest writer at `pc` is written back, a younger writer keeps
+        its reservation
+        """
+        i = self._find(reg, pc, youngest=False)
+        if i >= 0:
+            del self.reservations[reg][i]
+
+    def cancel(self, reg: int, pc: int) -> None:
+        """
+        the youngest writer at `pc` was squashed before writing back
+        """
+        i = self._find(reg, pc, youngest=True)
+        if i >= 0:
+            del self.reservations[reg][i]
 
-    def __getitem__(self, key: str) -> Reg:
-        if key.startswith('$'):
-            return self.regs[int(key[1:])]
+    def pending(self, reg: int) -> bool:
+        return bool(self.reservations[reg])
 
-        return self.regs[int(key)]
+    def writer(self, reg: int) -> int:
+        """
+        pc of the youngest writer of `reg`
+        """
+        return self.reservations[reg][-1][0] if self.reservations[reg] else NO_WRITER
 
-    def __setitem__(self, key: str, val: int) -> None:
-        if key.startswith('$'):
-            self.regs[int(key[1:])].val = val
-        else:
-            self.regs[int(key)].val = val
+    def ready_cycle(self, reg: int, pc: Optional[int] = None) -> int:
+        """
+        ready cycle of the youngest writer of `reg`, or of the oldest one at
+        `pc`
+        """
+        if pc is not None:
+            i = self._find(reg, pc, youngest=False)
+            return self.reservations[reg][i][1] if i >= 0 else 0
+        return self.reservations[reg][-1][1] if self.reservations[reg] else 0
 
     def __str__(self) -> str:
-        return '\n'.join([f'{reg.name}: {reg.val}' for reg in self.regs])
+        return '\n'.join([f'${reg}: ' + ', '.join(f'pc {pc} ready {ready}'
+                                                  for pc, ready in reservations)
+                          for reg, reservations in enumerate(self.reservations)
+                          if reservations])
 
 
 # * =========== test ===========
 if __name__ == '__main__':
     regs: RegFile = RegFile()
-    regs['$1'] = -1
-    regs['$2'] = 2
-    regs['$3'] = 3
+    regs[0] = 5
+    regs[1] = -1
+    regs[2] = 2
+    regs[3] = 3
 
-    print(regs['$1'].str_val())
-    print(regs['$2'].str_val())
-    print(regs['$3'].str_val())
-    print(regs['$4'].str_val())
+    print(regs.bits(0))
+    print(regs.bits(1))
+    print(regs.bits(2))
+    print(regs[1], regs[3])
 
-    print(regs)
+    scoreboard = Scoreboard()
+    scoreboard.reserve(8, pc=0)
+    scoreboard.reserve(8, pc=1)
+    scoreboard.reserve(9, pc=2)
+    scoreboard.delay(8, pc=1, ready=12)
+    scoreboard.release(8, pc=0)
+    # pc 2 was squashed by a taken branch
+    scoreboard.cancel(9, pc=2)
+    print(scoreboard)
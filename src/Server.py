@@ -0,0 +1,332 @@
+"""
+local simulation server
+
+starting python, importing the simulator and building data_mem and the
+caches costs more than a short simulation. the server pays it once: it
+keeps a pool of warm worker processes that run job after job, each job
+on a copy-on-write fork of the initial data memory so jobs never see each
+other's stores. jobs come in over a unix socket (or localhost tcp) as one
+json object per line and asyncio schedules them onto the pool. the reply
+is a stream of json lines, several jobs of one connection interleaved:
+
+    {"id": 1, "event": "queued", "position": 0}
+    {"id": 1, "event": "started", "worker": 4242}
+    {"id": 1, "event": "progress", "cycle": 10000, "instructions": 8123}
+    {"id": 1, "event": "done", "stats": {...}, "registers": {...}, "output": ""}
+    {"id": 1, "event": "error", "error": "..."}
+
+job fields, `program` or `source` is required:
+    id           echoed in every reply
+    program      list of 32-bit binary instructions
+    source       assembly text (see Isa.assemble_program)
+    cache        {"kind": "blocking" | "nonblocking", "size": 256,
+                  "line": 32, "ways": 2, ...}, other keys are passed to
+                  the cache constructor (miss_latency, mshr_no,
+                  write_policy, write_allocate, ...). "dram": {...}
+                  puts a Dram with these settings behind the cache
+    forwarding   {"ex_ex": true, "mem_ex": true, ...}
+    issue_width  instructions fetched per cycle
+    max_cycles   stop after this many cycles, at most (and by default)
+                 the server's --max-cycles
+    stdin        what the program reads through syscalls
+
+jobs cannot open host files (the open syscall fails), and a job still
+running after --timeout seconds fails with a TimeoutError.
+
+    python Server.py --socket /tmp/mips.sock --workers 4 --timeout 60
+    python Server.py --socket /tmp/mips.sock --submit job.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import count
+from typing import Any, AsyncIterator, Optional
+
+import main
+from Cache import Cache, data_mem
+from Dram import Dram
+from Forwarding import ForwardingUnit
+from Isa import assemble_program
+from NonBlockingCache import NonBlockingCache
+from Syscall import SyscallEmulator
+
+CACHE_KINDS = {'blocking': Cache, 'nonblocking': NonBlockingCache}
+PROGRESS_CYCLES = 10000
+MAX_CYCLES = 10**7
+TIMEOUT = 60.0
+
+# ------- worker side -------
+# (job key, event) messages for the server, set by _warm_up. the event
+# None is the last one of a job, and the cycle and wall clock limits of
+# every job
+_events: Optional[Any] = None
+_limits = (MAX_CYCLES, TIMEOUT)
+
+
+def _warm_up(events: Any, max_cycles: int, timeout: float) -> None:
+    """
+    runs once in every worker, the imports above already built the
+    simulator state
+    """
+    global _events, _limits  # skipcq: PYL-W0603
+    _events = events
+    _limits = (max_cycles, timeout)
+
+
+def _send(key: int, event: Optional[dict]) -> None:
+    if _events is not None:
+        _events.put((key, event))
+
+
+def make_cache(config: dict) -> Cache:
+    """
+    data cache of a job over a fresh fork of the initial data memory
+    """
+    config = dict(config)
+    kind = CACHE_KINDS[config.pop('kind', 'blocking')]
+    mem = data_mem.fork()
+    if 'dram' in config:
+        mem = Dram(mem, **config.pop('dram'))
+    return kind(mem, config.pop('size', 256),
+                config.pop('line', 32), config.pop('ways', 2), **config)
+
+
+def run_job(key: int, job: dict) -> dict:
+    """
+    run one job in this process and return the body of its 'done' reply
+    """
+    try:
+        return _run_job(key, job)
+    finally:
+        _send(key, None)
+
+
+def _run_job(key: int, job: dict) -> dict:
+    _send(key, {'event': 'started', 'worker': os.getpid()})
+    program = job.get('program') or assemble_program(job['source'])
+    main.use_data_cache(make_cache(job.get('cache', {})))
+    main.use_forwarding(ForwardingUnit(**job.get('forwarding', {})))
+    output = io.StringIO()
+    # no root: the open syscall fails
+    main.use_syscalls(SyscallEmulator(stdin=io.StringIO(job.get('stdin', '')),
+                                      stdout=output, stderr=output))
+    max_cycles, timeout = _limits
+    deadline = time.monotonic() + timeout
+
+    def progress(cycle: int, retired: int) -> None:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'still running after {timeout:g} s, cycle {cycle}')
+        _send(key, {'event': 'progress', 'cycle': cycle, 'instructions': retired})
+
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        stats = main.run_program(
+            program, issue_width=job.get('issue_width', 1),
+            max_cycles=min(job.get('max_cycles') or max_cycles, max_cycles),
+            progress=progress, progress_cycles=PROGRESS_CYCLES)
+    registers = {reg: main.reg_file[reg] for reg in range(32) if main.reg_file[reg]}
+    return {'event': 'done', 'stats': stats, 'registers': registers,
+            'output': output.getvalue()}
+
+
+# ------- server side -------
+class SimulationServer:
+    def __init__(self, workers: int = 0, max_cycles: int = MAX_CYCLES,
+                 timeout: float = TIMEOUT) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.max_cycles = max_cycles
+        self.timeout = timeout
+        context = multiprocessing.get_context()
+        self.events = context.Queue()
+        self.pool = self._new_pool()
+        # job key -> (job id, writer of its connection)
+        self.jobs: dict[int, tuple[Any, asyncio.StreamWriter]] = {}
+        # job key -> set once every event the worker sent has been replied
+        self.drained: dict[int, asyncio.Event] = {}
+        self.keys = count()
+        self.running = self.done = self.failed = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(self.workers, initializer=_warm_up,
+                                   initargs=(self.events, self.max_cycles,
+                                             self.timeout))
+        # start every worker now rather than on the first job
+        for _ in range(self.workers):
+            pool.submit(os.getpid)
+        return pool
+
+    def _reply(self, key: int, event: dict) -> None:
+        entry = self.jobs.get(key)
+        if entry is None:
+            return
+        job_id, writer = entry
+        if not writer.is_closing():
+            writer.write(json.dumps({'id': job_id, **event}).encode() + b'\n')
+
+    def _pump_events(self) -> None:
+        """
+        thread moving the workers' events onto the event loop
+        """
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            assert self.loop is not None
+            key, event = message
+            if event is None:
+                self.loop.call_soon_threadsafe(self.drained[key].set)
+            else:
+                self.loop.call_soon_threadsafe(self._reply, key, event)
+
+    async def _run(self, key: int, job: dict) -> None:
+        assert self.loop is not None
+        drained = self.drained[key] = asyncio.Event()
+        pool = self.pool
+        try:
+            result = await self.loop.run_in_executor(pool, run_job, key, job)
+            self.done += 1
+        except BrokenProcessPool:
+            # a worker died, the jobs still queued in its pool fail with it
+            if pool is self.pool:
+                self.pool = self._new_pool()
+            self.failed += 1
+            result = {'event': 'error', 'error': 'worker process died'}
+            drained.set()
+        except Exception as error:  # skipcq: PYL-W0703
+            self.failed += 1
+            result = {'event': 'error', 'error': f'{type(error).__name__}: {error}'}
+        # 'started' and 'progress' go out before the result
+        await drained.wait()
+        del self.drained[key]
+        self.running -= 1
+        self._reply(key, result)
+        _, writer = self.jobs.pop(key)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """
+        one client connection, every line is a job
+        """
+        tasks = []
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            key = next(self.keys)
+            try:
+                job = json.loads(line)
+            except ValueError as error:
+                job = {'error': f'bad json: {error}'}
+            if not isinstance(job, dict):
+                job = {'error': 'a job is a json object'}
+            self.jobs[key] = (job.get('id'), writer)
+            if 'program' not in job and 'source' not in job:
+                self._reply(key, {'event': 'error', 'error': job.get(
+                    'error', 'a job needs a program or a source')})
+                del self.jobs[key]
+                continue
+            self._reply(key, {'event': 'queued',
+                              'position': max(self.running - self.workers, 0)})
+            self.running += 1
+            tasks.append(asyncio.create_task(self._run(key, job)))
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def serve(self, path: Optional[str] = None, port: int = 0) -> None:
+        """
+        serve on the unix socket `path`, or on localhost:`port`
+        """
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self._pump_events, daemon=True).start()
+        if path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.events.put(None)
+        self.pool.shutdown(cancel_futures=True)
+
+    def stats(self) -> dict[str, float]:
+        return {'workers': self.workers, 'running': self.running,
+                'done': self.done, 'failed': self.failed}
+
+
+# ------- client side -------
+async def submit(jobs: list[dict], path: Optional[str] = None,
+                 port: int = 0) -> AsyncIterator[dict]:
+    """
+    send `jobs` to a running server and yield every reply line until all
+    of them are done or failed
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.writelines(json.dumps(job).encode() + b'\n' for job in jobs)
+    await writer.drain()
+    writer.write_eof()
+    while line := await reader.readline():
+        yield json.loads(line)
+    writer.close()
+
+
+def _print_replies(jobs: list[dict], path: Optional[str], port: int) -> None:
+    async def run() -> None:
+        async for reply in submit(jobs, path, port):
+            print(json.dumps(reply))
+    asyncio.run(run())
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--socket', help='unix socket to serve or submit on')
+    parser.add_argument('--port', type=int, default=0,
+                        help='localhost tcp port, if no socket is given')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='worker processes, default one per cpu')
+    parser.add_argument('--max-cycles', type=int, default=MAX_CYCLES,
+                        help='cycle limit of every job')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='seconds a job may run')
+    parser.add_argument('--submit', nargs='+', metavar='JOB',
+                        help='json files with a job or a list of jobs to '
+                             'send to a running server')
+    args = parser.parse_args()
+    if args.socket is None and not args.port:
+        parser.error('give --socket or --port')
+    if args.submit:
+        jobs = []
+        for job_path in args.submit:
+            with open(job_path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            jobs.extend(loaded if isinstance(loaded, list) else [loaded])
+        _print_replies(jobs, args.socket, args.port)
+        return 0
+    server = SimulationServer(args.workers, args.max_cycles, args.timeout)
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
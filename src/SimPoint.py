@@ -0,0 +1,481 @@
+"""
+basic-block vectors and SimPoint-style sampled simulation
+
+a long program is cut into intervals of `interval` retired instructions.
+a functional pass with the golden model records the basic-block vector
+(BBV) of every interval: how many instructions ran in every basic block,
+a block being the straight-line code entered at one pc after a branch,
+jump or syscall. intervals with alike vectors behave alike in the
+pipeline, so the vectors are normalised, randomly projected down to
+`dims` dimensions and clustered with k-means. k is the smallest one whose
+clustering error is within 10% of the best of 1..max_k (of the way from
+the error with k=1 down to it).
+
+only `per_cluster` intervals of every cluster run through the detailed
+pipeline, the one closest to the centroid first, and their results are
+weighted by the share of the instructions their cluster retired:
+
+    cpi        = sum of weight * mean cpi of the samples
+    miss rate  = sum of weight * misses per instruction
+                 / sum of weight * accesses per instruction
+
+the error bounds are the 95% intervals of these stratified estimates,
+from the spread of the samples inside every cluster, so they need
+per_cluster >= 2 (a cluster with a single sample takes the pooled spread
+of the others, with no spread at all there is no bound).
+
+a sample starts from a checkpoint (pc, registers and a copy-on-write fork
+of memory) taken by a second functional pass `warmup` instructions before
+its interval. the caches start cold: the warm-up instructions run in
+detail first, and the cycles and cache counters they took, read in the
+same run once they retired, are taken off.
+
+the functional passes run the golden model, which executes j / jal / jr
+while the pipeline does not, so programs with jumps are refused.
+
+numpy does the k-means when it is installed, a plain python version of
+the same steps when it is not.
+
+    python SimPoint.py [program.txt] --interval 1000 --max-k 6 --full
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import random
+import sys
+from typing import Any, Callable, Iterator, Optional
+
+import main
+from Cache import Cache, data_mem, make_data_cache, shared
+from GoldenModel import GoldenModel
+from Isa import assemble_program, inst_name
+from Memory import Memory
+from Syscall import SyscallEmulator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# instructions that end a basic block
+CONTROL = ('beq', 'bne', 'j', 'jal', 'jr', 'syscall', 'break')
+# executed by the golden model but not by the pipeline
+JUMPS = ('j', 'jal', 'jr')
+# k is the smallest within this share of the way from k=1 to the best
+KNEE = 0.1
+Z95 = 1.96
+COUNTERS = ('cycles', 'instructions', 'dcache_hits', 'dcache_misses')
+
+# (pc, registers, memory) the golden model had at an instruction count
+Checkpoint = tuple[int, list[int], Memory]
+# one clustering point per interval
+Points = list[list[float]]
+
+
+def _golden(program: list[str], mem: Memory, stdin: str) -> GoldenModel:
+    for pc, inst in enumerate(program):
+        if inst_name(inst) in JUMPS:
+            raise ValueError(f'{inst_name(inst)} at pc {pc}: the pipeline does '
+                             'not execute jumps, the profile would not match it')
+    return GoldenModel(program, mem.fork(), SyscallEmulator(
+        stdin=io.StringIO(stdin), stdout=io.StringIO(), stderr=io.StringIO()))
+
+
+# ------- profiling -------
+def collect_bbvs(program: list[str], mem: Memory, interval: int = 10000,
+                 stdin: str = '', max_instructions: int = 10**8) -> list[dict[int, int]]:
+    """
+    basic-block vector of every interval, first pc of a block -> the
+    instructions retired in it. the last interval may be shorter
+    """
+    golden = _golden(program, mem, stdin)
+    vectors: list[dict[int, int]] = []
+    current: dict[int, int] = {}
+    block = golden.pc
+    while not golden.done and golden.retired < max_instructions:
+        pc = golden.pc
+        name = golden.program[pc][0]
+        golden.step()
+        current[block] = current.get(block, 0) + 1
+        if name in CONTROL or golden.pc != pc + 1:
+            block = golden.pc
+        if golden.retired % interval == 0:
+            vectors.append(current)
+            current = {}
+    if current:
+        vectors.append(current)
+    return vectors
+
+
+def take_checkpoints(program: list[str], mem: Memory, starts: list[int],
+                     stdin: str = '') -> dict[int, Checkpoint]:
+    """
+    architectural state before instruction `start` for every start
+    """
+    golden = _golden(program, mem, stdin)
+    checkpoints = {}
+    for start in sorted(set(starts)):
+        while golden.retired < start and not golden.done:
+            golden.step()
+        checkpoints[start] = (golden.pc, list(golden.regs), golden.mem.fork())
+    return checkpoints
+
+
+def project(vectors: list[dict[int, int]], dims: int = 15, seed: int = 0) -> Points:
+    """
+    normalise every vector to shares of its interval and project it onto
+    `dims` random directions, one uniform(-1, 1) row per block
+    """
+    rng = random.Random(seed)
+    rows: dict[int, list[float]] = {}
+    points = []
+    for vector in vectors:
+        total = sum(vector.values())
+        point = [0.0] * dims
+        for block, count in vector.items():
+            row = rows.get(block)
+            if row is None:
+                row = rows[block] = [rng.uniform(-1, 1) for _ in range(dims)]
+            share = count / total
+            for dim in range(dims):
+                point[dim] += share * row[dim]
+        points.append(point)
+    return points
+
+
+# ------- clustering -------
+def _distance(a: list[float], b: list[float]) -> float:
+    return sum((x - y) ** 2 for x, y in zip(a, b))
+
+
+def _seeds(points: Points, k: int, rng: random.Random) -> list[int]:
+    """
+    k-means++: every next seed is drawn with a chance proportional to its
+    squared distance from the closest seed so far. fewer than k if there
+    are fewer distinct points
+    """
+    seeds = [rng.randrange(len(points))]
+    distances = [_distance(point, points[seeds[0]]) for point in points]
+    while len(seeds) < k:
+        total = sum(distances)
+        if not total:
+            break
+        pick = rng.uniform(0, total)
+        index = 0
+        for index, distance in enumerate(distances):
+            pick -= distance
+            if pick <= 0 and distance:
+                break
+        seeds.append(index)
+        distances = [min(distance, _distance(point, points[index]))
+                     for distance, point in zip(distances, points)]
+    return seeds
+
+
+def _kmeans_numpy(points: Points, seeds: list[int],
+                  iterations: int) -> tuple[list[int], Points, float]:
+    data = np.asarray(points, dtype=float)
+    centroids = data[seeds].copy()
+    labels = None
+    for _ in range(iterations):
+        distances = ((data[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for cluster_no in range(len(centroids)):
+            members = data[labels == cluster_no]
+            if len(members):
+                centroids[cluster_no] = members.mean(axis=0)
+    distances = ((data[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    error = float(distances[np.arange(len(data)), labels].sum())
+    return labels.tolist(), centroids.tolist(), error
+
+
+def _kmeans_python(points: Points, seeds: list[int],
+                   iterations: int) -> tuple[list[int], Points, float]:
+    centroids = [list(points[seed]) for seed in seeds]
+    labels: list[int] = []
+    for _ in range(iterations):
+        new_labels = [min(range(len(centroids)),
+                          key=lambda cluster_no, point=point: _distance(
+                              point, centroids[cluster_no]))
+                      for point in points]
+        if new_labels == labels:
+            break
+        labels = new_labels
+        for cluster_no in range(len(centroids)):
+            members = [point for point, label in zip(points, labels)
+                       if label == cluster_no]
+            if members:
+                centroids[cluster_no] = [sum(column) / len(members)
+                                         for column in zip(*members)]
+    error = sum(_distance(point, centroids[label])
+                for point, label in zip(points, labels))
+    return labels, centroids, error
+
+
+def kmeans(points: Points, k: int, seed: int = 0,
+           iterations: int = 100) -> tuple[list[int], Points, float]:
+    """
+    label of every point, the centroids and the sum of squared distances
+    of the points to their centroid
+    """
+    seeds = _seeds(points, k, random.Random(seed))
+    if np is not None:
+        return _kmeans_numpy(points, seeds, iterations)
+    return _kmeans_python(points, seeds, iterations)
+
+
+def cluster(points: Points, max_k: int = 8, seed: int = 0) -> tuple[list[int], Points]:
+    """
+    k-means for k = 1..max_k, keep the smallest k that is good enough
+    """
+    runs = [kmeans(points, k, seed + k) for k in range(1, min(max_k, len(points)) + 1)]
+    first, best = runs[0][2], min(run[2] for run in runs)
+    for labels, centroids, error in runs:
+        if error - best <= KNEE * (first - best):
+            return labels, centroids
+    return runs[-1][0], runs[-1][1]
+
+
+def pick_samples(points: Points, labels: list[int], centroids: Points,
+                 per_cluster: int, seed: int = 0) -> dict[int, list[int]]:
+    """
+    intervals to simulate of every cluster: the one closest to its
+    centroid and random other members
+    """
+    rng = random.Random(seed)
+    members: dict[int, list[int]] = {}
+    for index, label in enumerate(labels):
+        members.setdefault(label, []).append(index)
+    samples = {}
+    for label, indices in sorted(members.items()):
+        closest = min(indices, key=lambda index: _distance(points[index],
+                                                            centroids[label]))
+        others = [index for index in indices if index != closest]
+        samples[label] = [closest] + rng.sample(others, min(per_cluster - 1,
+                                                            len(others)))
+    return samples
+
+
+# ------- detailed samples -------
+@contextlib.contextmanager
+def _detailed() -> Iterator[None]:
+    """
+    samples run without the checker and timeline of main, with a quiet
+    syscall emulator, and leave its data cache and syscalls as they were
+    """
+    # main binds the shared data cache on its first run
+    saved = (getattr(main, 'data_cache', None) or shared('data_cache'),
+             main.syscalls, main.cosim, main.timeline)
+    main.use_cosim(None)
+    main.use_timeline(None)
+    try:
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        main.use_data_cache(saved[0])
+        main.use_syscalls(saved[1])
+        main.use_cosim(saved[2])
+        main.use_timeline(saved[3])
+
+
+def simulate_sample(program: list[str], checkpoint: Checkpoint, warmup: int,
+                    length: int, make_cache: Callable[[Memory], Cache],
+                    issue_width: int = 1) -> dict[str, float]:
+    """
+    cycles, instructions and data cache hits / misses of the `length`
+    instructions that follow `warmup` instructions from `checkpoint`
+    """
+    pc, registers, mem = checkpoint
+    # the counters once the warm-up retired, read every cycle of the run
+    begin = dict.fromkeys(COUNTERS, 0)
+    warm = not warmup
+
+    def progress(cycle: int, retired: int) -> None:
+        nonlocal warm
+        if not warm and retired >= warmup:
+            warm = True
+            cache = main.data_cache.stats()
+            begin.update(cycles=cycle, instructions=retired,
+                         dcache_hits=cache['hits'], dcache_misses=cache['misses'])
+
+    main.use_data_cache(make_cache(mem.fork()))
+    main.use_syscalls(SyscallEmulator(stdin=io.StringIO(), stdout=io.StringIO(),
+                                      stderr=io.StringIO()))
+    end = main.run_program(program, issue_width=issue_width,
+                           progress=progress, progress_cycles=1,
+                           max_instructions=warmup + length, start_pc=pc,
+                           registers=registers)
+    if not warm:
+        # the warm-up and the sample retired in the same cycle
+        begin = end
+    return {key: end[key] - begin[key] for key in COUNTERS}
+
+
+def _stratified(values: dict[int, list[float]], weights: dict[int, float],
+                population: dict[int, int]) -> tuple[float, Optional[float]]:
+    """
+    weighted mean of the cluster means and its 95% bound, None if no
+    cluster has two samples to tell the spread
+    """
+    mean = sum(weights[label] * sum(vals) / len(vals) for label, vals in values.items())
+    spreads = {}
+    for label, vals in values.items():
+        if len(vals) > 1:
+            average = sum(vals) / len(vals)
+            spreads[label] = sum((val - average) ** 2 for val in vals) / (len(vals) - 1)
+    pooled = sum(spreads.values()) / len(spreads) if spreads else None
+    variance = 0.0
+    for label, vals in values.items():
+        sampled, size = len(vals), population[label]
+        if sampled >= size:
+            continue
+        spread = spreads.get(label, pooled)
+        if spread is None:
+            return mean, None
+        variance += weights[label] ** 2 * (1 - sampled / size) * spread / sampled
+    return mean, Z95 * math.sqrt(variance)
+
+
+def estimate(results: dict[int, list[dict[str, float]]], weights: dict[int, float],
+             population: dict[int, int]) -> dict[str, Optional[float]]:
+    """
+    whole-program cpi and data cache miss rate from the sample results
+    of every cluster
+    """
+    cpi = {label: [run['cycles'] / max(run['instructions'], 1) for run in runs]
+           for label, runs in results.items()}
+    misses = {label: [run['dcache_misses'] / max(run['instructions'], 1) for run in runs]
+              for label, runs in results.items()}
+    accesses = {label: [(run['dcache_hits'] + run['dcache_misses']) /
+                        max(run['instructions'], 1) for run in runs]
+                for label, runs in results.items()}
+    cpi_mean, cpi_error = _stratified(cpi, weights, population)
+    miss_mean, _ = _stratified(misses, weights, population)
+    access_mean, _ = _stratified(accesses, weights, population)
+    miss_rate = miss_mean / access_mean if access_mean else 0.0
+    # bound of the ratio from the spread of misses - miss_rate * accesses
+    residuals = {label: [miss - miss_rate * access
+                         for miss, access in zip(misses[label], accesses[label])]
+                 for label in results}
+    _, residual_error = _stratified(residuals, weights, population)
+    miss_error = residual_error / access_mean \
+        if residual_error is not None and access_mean else residual_error
+    return {'cpi': cpi_mean, 'cpi_error': cpi_error,
+            'miss_rate': miss_rate, 'miss_rate_error': miss_error}
+
+
+def sampled_simulation(program: list[str], mem: Optional[Memory] = None,
+                       interval: int = 10000, max_k: int = 8,
+                       per_cluster: int = 2, warmup: int = 1000, dims: int = 15,
+                       seed: int = 0,
+                       make_cache: Callable[[Memory], Cache] = make_data_cache,
+                       issue_width: int = 1, stdin: str = '') -> dict[str, Any]:
+    """
+    estimate the cpi and data cache miss rate of a whole run of `program`
+    on `mem` (the initial data memory if None) from a few intervals
+
+    Returns:
+        dict[str, Any]: the estimates and their bounds, how many intervals,
+            clusters and detailed instructions it took
+    """
+    mem = data_mem if mem is None else mem
+    vectors = collect_bbvs(program, mem, interval, stdin)
+    sizes = [sum(vector.values()) for vector in vectors]
+    points = project(vectors, dims, seed)
+    labels, centroids = cluster(points, max_k, seed)
+    samples = pick_samples(points, labels, centroids, per_cluster, seed)
+
+    total = sum(sizes)
+    population: dict[int, int] = {}
+    weights: dict[int, float] = {}
+    for index, label in enumerate(labels):
+        population[label] = population.get(label, 0) + 1
+        weights[label] = weights.get(label, 0.0) + sizes[index] / total
+
+    starts = {index: max(index * interval - warmup, 0)
+              for indices in samples.values() for index in indices}
+    checkpoints = take_checkpoints(program, mem, list(starts.values()), stdin)
+    results: dict[int, list[dict[str, float]]] = {}
+    with _detailed():
+        for label, indices in samples.items():
+            results[label] = [
+                simulate_sample(program, checkpoints[starts[index]],
+                                index * interval - starts[index], sizes[index],
+                                make_cache, issue_width)
+                for index in indices]
+    simulated = sum(run['instructions'] for runs in results.values() for run in runs)
+    return estimate(results, weights, population) | {
+        'instructions': total, 'intervals': len(vectors),
+        'clusters': len(samples), 'samples': len(starts),
+        'simulated_instructions': simulated, 'weights': weights}
+
+
+# a program with two alternating phases, an alu loop and a loop streaming
+# through memory, 600 iterations of 6 instructions each
+PHASES = '''
+addi $8 $0 600
+addi $9 $9 3
+xor $10 $9 $8
+add $11 $10 $9
+sll $12 $11 2
+addi $8 $8 -1
+bne $8 $0 -6
+addi $8 $0 600
+lw $14 0 $13
+add $15 $15 $14
+sw $15 1 $13
+addi $13 $13 8
+addi $8 $8 -1
+bne $8 $0 -6
+'''
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('program', nargs='?',
+                        help='one binary instruction per line, a built-in '
+                             'two-phase program if not given')
+    parser.add_argument('--interval', type=int, default=1000,
+                        help='instructions per interval')
+    parser.add_argument('--max-k', type=int, default=6)
+    parser.add_argument('--per-cluster', type=int, default=2,
+                        help='intervals simulated in detail per cluster')
+    parser.add_argument('--warmup', type=int, default=200,
+                        help='instructions run in detail before a sample')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full', action='store_true',
+                        help='also run the whole program in detail to compare')
+    args = parser.parse_args()
+    program = main.load_program(args.program) if args.program \
+        else assemble_program(PHASES * 4)
+    result = sampled_simulation(program, interval=args.interval, max_k=args.max_k,
+                                per_cluster=args.per_cluster, warmup=args.warmup,
+                                seed=args.seed)
+
+    def bound(error: Optional[float]) -> str:
+        return 'no bound' if error is None else f'+- {error:.4f}'
+
+    print(f"{result['instructions']} instructions, {result['intervals']} intervals, "
+          f"{result['clusters']} clusters, {result['samples']} samples, "
+          f"{result['simulated_instructions']} instructions in detail")
+    print(f"cpi       {result['cpi']:.4f} {bound(result['cpi_error'])}")
+    print(f"miss rate {result['miss_rate']:.4f} {bound(result['miss_rate_error'])}")
+    if args.full:
+        with _detailed():
+            main.use_data_cache(make_data_cache(data_mem.fork()))
+            main.use_syscalls(SyscallEmulator(stdin=io.StringIO(), stdout=io.StringIO()))
+            stats = main.run_program(program)
+        accesses = stats['dcache_hits'] + stats['dcache_misses']
+        print(f"full run: cpi {stats['cycles'] / stats['instructions']:.4f}, "
+              f"miss rate {stats['dcache_misses'] / max(accesses, 1):.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
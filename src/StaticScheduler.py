@@ -0,0 +1,301 @@
+"""
+static hazard analysis and a stall-reducing scheduler for program images
+
+the data hazards of a program are known before it runs. analyze() cuts
+the image into basic blocks, builds the dependency graph of every block
+and predicts the stall cycles the hazard unit of the pipeline inserts
+with a given ForwardingUnit, by the rules main.py uses: a source register
+waits until a path that is on can bring it from the stage its producer is
+in, a load in EX makes a load_use stall and a syscall waits for EX to be
+empty. schedule() reorders the independent instructions of each block so
+that consumers move away from their producers. every block keeps its
+place and its length, so branch offsets and jump targets stay valid, and
+a block is only rewritten if that predicts fewer stalls.
+
+only data hazards are predicted: cache misses and taken branches (two
+flushed instructions each) need a run. a block is analyzed as entered
+from the block above it, the hazards of that block's last instructions
+carry into it. branches are resolved in EX without delay slots, so there
+are no delay slots to fill, only independent instructions to move.
+
+dependency edges, the producer stays in front of the consumer:
+    raw, war, waw   registers
+    mem             a store and any other load / store, unless both use
+                    the same base register (not written in between) with
+                    different offsets
+the instruction that ends a block (branch, jump, syscall, break) stays
+last.
+
+usage:
+    python StaticScheduler.py [program.txt] [-o scheduled.txt] [--off ex_ex ...] [--run]
+"""
+import argparse
+import contextlib
+import io
+import sys
+from typing import Optional
+
+from Forwarding import PATHS, ForwardingUnit, operands
+from Isa import inst_name, dest_reg, src_regs, is_branch, bin_to_int_signed, disassemble
+
+ENDS_BLOCK = ('beq', 'bne', 'j', 'jal', 'jr', 'syscall', 'break')
+# ID cycles between a producer and its consumer -> stage of the producer
+STAGE_AT = {1: 'ex', 2: 'mem', 3: 'wb'}
+
+Block = dict[str, int]
+
+
+class Instruction:
+    """
+    one instruction of a block with the fields the analysis needs
+    """
+
+    def __init__(self, inst: str) -> None:
+        self.inst = inst
+        self.name = inst_name(inst)
+        self.rs, self.rt = int(inst[6:11], 2), int(inst[11:16], 2)
+        self.imm = bin_to_int_signed(inst[16:], 16)
+        self.dest = dest_reg(inst)
+        self.srcs = src_regs(inst)
+        self.is_load = self.name == 'lw'
+        self.is_memory = self.name in ('lw', 'sw')
+
+
+def blocks(program: list[str]) -> list[tuple[int, int]]:
+    """
+    (start, end) of every basic block, end not included
+    """
+    leaders = {0, len(program)}
+    for pc, inst in enumerate(program):
+        name = inst_name(inst)
+        if name in ENDS_BLOCK:
+            leaders.add(pc + 1)
+        if is_branch(name):
+            leaders.add(pc + 1 + bin_to_int_signed(inst[16:], 16))
+        elif name in ('j', 'jal'):
+            leaders.add(int(inst[6:], 2))
+    starts = sorted(pc for pc in leaders if 0 <= pc <= len(program))
+    return list(zip(starts, starts[1:]))
+
+
+def dependencies(block: list[Instruction]) -> list[set[int]]:
+    """
+    indices of the instructions every instruction of `block` depends on
+    """
+    preds: list[set[int]] = [set() for _ in block]
+    # register -> number of writes to it so far, tells base registers apart
+    versions: dict[int, int] = {}
+    memory: list[tuple[int, int, tuple[int, int]]] = []
+    for i, inst in enumerate(block):
+        for j in range(i):
+            older = block[j]
+            if (older.dest is not None and
+                    (older.dest in inst.srcs or older.dest == inst.dest)) or \
+                    (inst.dest is not None and inst.dest in older.srcs):
+                preds[i].add(j)
+        if inst.is_memory:
+            base = (inst.rs, versions.get(inst.rs, 0))
+            for j, imm, other_base in memory:
+                if not (inst.is_load and block[j].is_load) and \
+                        (base != other_base or imm == inst.imm):
+                    preds[i].add(j)
+            memory.append((i, inst.imm, base))
+        if inst.dest is not None:
+            versions[inst.dest] = versions.get(inst.dest, 0) + 1
+        if inst.name in ENDS_BLOCK:
+            preds[i].update(range(i))
+    return preds
+
+
+def issue(inst: Instruction, history: list[tuple[int, Instruction]],
+          forwarding: ForwardingUnit) -> tuple[int, str]:
+    """
+    cycle `inst` leaves ID in after the instructions in `history` (ID cycle,
+    instruction), and the cause of its first stall
+    """
+    cycle = history[-1][0] + 1 if history else 0
+    first_cause = ''
+    while True:
+        cause = _hazard(inst, cycle, history, forwarding)
+        if inst.name == 'syscall' and history and history[-1][0] == cycle - 1:
+            cause = 'syscall'
+        if not cause:
+            return cycle, first_cause
+        first_cause = first_cause or cause
+        cycle += 1
+
+
+def _hazard(inst: Instruction, cycle: int, history: list[tuple[int, Instruction]],
+            forwarding: ForwardingUnit) -> str:
+    for reg, stage in operands(inst.name, inst.rs, inst.rt):
+        for produced, producer in reversed(history):
+            if cycle - produced > 3:
+                break
+            if producer.dest == reg:
+                cause = forwarding.stall_cause(STAGE_AT[cycle - produced],
+                                               producer.is_load, stage)
+                if cause:
+                    return cause
+                break
+    return ''
+
+
+def predict(block: list[Instruction], history: list[tuple[int, Instruction]],
+            forwarding: ForwardingUnit) -> int:
+    """
+    stall cycles of `block` entered after `history`, which is extended by
+    the block
+    """
+    stalls = 0
+    for inst in block:
+        cycle, _ = issue(inst, history, forwarding)
+        stalls += cycle - history[-1][0] - 1 if history else cycle
+        history.append((cycle, inst))
+    return stalls
+
+
+def _heights(block: list[Instruction], preds: list[set[int]]) -> list[int]:
+    """
+    longest chain of dependencies from every instruction to the block end,
+    a load counts twice since its value comes a stage later
+    """
+    heights = [0] * len(block)
+    for i in reversed(range(len(block))):
+        heights[i] += 2 if block[i].is_load else 1
+        for j in preds[i]:
+            heights[j] = max(heights[j], heights[i])
+    return heights
+
+
+def schedule_block(block: list[Instruction], history: list[tuple[int, Instruction]],
+                   forwarding: ForwardingUnit) -> list[int]:
+    """
+    list scheduling: of the instructions whose dependencies are placed,
+    take the one that stalls least, then the one with the longest chain
+    behind it, then the one first in the program
+    """
+    preds = dependencies(block)
+    heights = _heights(block, preds)
+    history = history[-3:]
+    order: list[int] = []
+    left = set(range(len(block)))
+    while left:
+        ready = [i for i in left if preds[i] <= set(order)]
+        best = min(ready, key=lambda i: (issue(block[i], history, forwarding)[0],
+                                         -heights[i], i))
+        history.append((issue(block[best], history, forwarding)[0], block[best]))
+        order.append(best)
+        left.remove(best)
+    return order
+
+
+def analyze(program: list[str], forwarding: Optional[ForwardingUnit] = None
+            ) -> list[Block]:
+    """
+    predicted stalls of every basic block, by their first cause
+    """
+    forwarding = forwarding or ForwardingUnit()
+    history: list[tuple[int, Instruction]] = []
+    report = []
+    for start, end in blocks(program):
+        row: Block = {'start': start, 'length': end - start, 'stalls': 0}
+        for inst in map(Instruction, program[start:end]):
+            cycle, cause = issue(inst, history, forwarding)
+            if history and cycle > history[-1][0] + 1:
+                row['stalls'] += cycle - history[-1][0] - 1
+                row[f'stall_{cause}'] = row.get(f'stall_{cause}', 0) + \
+                    cycle - history[-1][0] - 1
+            history.append((cycle, inst))
+        report.append(row)
+    return report
+
+
+def schedule(program: list[str], forwarding: Optional[ForwardingUnit] = None
+             ) -> tuple[list[str], list[Block]]:
+    """
+    rewrite `program` block by block
+
+    Returns:
+        tuple[list[str], list[Block]]: the new image, same length, and per
+            block its start, length, stalls_before, stalls_after and the
+            number of instructions that moved
+    """
+    forwarding = forwarding or ForwardingUnit()
+    scheduled: list[str] = []
+    before: list[tuple[int, Instruction]] = []
+    after: list[tuple[int, Instruction]] = []
+    report = []
+    for start, end in blocks(program):
+        block = [Instruction(inst) for inst in program[start:end]]
+        order = schedule_block(block, after, forwarding)
+        stalls_kept = predict(block, after[-3:], forwarding)
+        stalls_moved = predict([block[i] for i in order], after[-3:], forwarding)
+        if stalls_moved >= stalls_kept:
+            order = list(range(len(block)))
+        stalls_before = predict(block, before, forwarding)
+        stalls_after = predict([block[i] for i in order], after, forwarding)
+        scheduled.extend(block[i].inst for i in order)
+        report.append({'start': start, 'length': end - start,
+                       'stalls_before': stalls_before, 'stalls_after': stalls_after,
+                       'moved': sum(i != at for at, i in enumerate(order))})
+    return scheduled, report
+
+
+def format_report(report: list[Block]) -> str:
+    lines = [f"{'block':>11} {'insts':>5} {'stalls':>6} {'after':>5} {'moved':>5}"]
+    for row in report:
+        if row['stalls_before'] or row['moved']:
+            lines.append(f"{row['start']:5}-{row['start'] + row['length'] - 1:<5} "
+                         f"{row['length']:5} {row['stalls_before']:6} "
+                         f"{row['stalls_after']:5} {row['moved']:5}")
+    before = sum(row['stalls_before'] for row in report)
+    after = sum(row['stalls_after'] for row in report)
+    lines.append(f"{len(report)} blocks, predicted stalls {before} -> {after}, "
+                 f"{sum(row['moved'] for row in report)} instructions moved")
+    return '\n'.join(lines)
+
+
+def _run(program: list[str]) -> dict[str, float]:
+    import main  # pylint: disable=import-outside-toplevel
+    from Cache import data_mem, make_data_cache  # pylint: disable=import-outside-toplevel
+    main.use_data_cache(make_data_cache(data_mem.fork()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = main.run_program(program)
+    stats['registers'] = [main.reg_file[reg] for reg in range(32)]
+    return stats
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('program', nargs='?', default='instructions.txt',
+                        help='one binary instruction per line')
+    parser.add_argument('-o', '--output', help='write the scheduled image here')
+    parser.add_argument('--off', nargs='*', choices=PATHS, default=[],
+                        help='forwarding paths turned off')
+    parser.add_argument('--run', action='store_true',
+                        help='also run both images through the pipeline')
+    args = parser.parse_args()
+    with open(args.program, 'r', encoding='utf-8') as f:
+        program = [line.strip() for line in f if line.strip()]
+    forwarding = ForwardingUnit(**{path: path not in args.off for path in PATHS})
+    scheduled, report = schedule(program, forwarding)
+    print(format_report(report))
+    for pc, (old, new) in enumerate(zip(program, scheduled)):
+        if old != new:
+            print(f'{pc:5}: {disassemble(old):24} -> {disassemble(new)}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(scheduled) + '\n')
+    if args.run:
+        import main  # pylint: disable=import-outside-toplevel
+        main.use_forwarding(forwarding)
+        original, rewritten = _run(program), _run(scheduled)
+        print(f"run: {original['cycles']} -> {rewritten['cycles']} cycles, "
+              f"stalls {original['stall_count']} -> {rewritten['stall_count']}, "
+              'same registers' if original['registers'] == rewritten['registers']
+              else 'REGISTERS DIFFER')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
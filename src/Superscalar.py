@@ -0,0 +1,135 @@
+"""
+issue unit for the superscalar (multi-issue) in-order mode of the pipeline
+
+every cycle the issue unit looks at the next `width` instructions and
+decides how many of them leave fetch together as one packet. every slot
+has its own lane of pipeline registers and the packet moves through the
+stages in lockstep, one stage per cycle: when one of its instructions
+stalls in ID the whole packet does. so the rules a packet was formed with
+hold in every stage, e.g. there are never more loads / stores in MEM than
+memory ports.
+
+pairing rules, a packet ends before an instruction that
+    - reads or writes a register written earlier in the packet (raw / waw),
+      there is no bypass between the slots of the same packet
+    - needs an ALU port when all `alu_ports` are taken
+    - needs the memory port when the `mem_ports` are taken (lw, sw)
+    - is a syscall, it works on memory in EX and has to wait for the older
+      stores, which would still be in EX beside it
+and right after a branch, jump, syscall or break, since the instructions
+behind them may not be the ones fetched.
+"""
+from collections import Counter
+
+from Isa import inst_name, dest_reg, src_regs
+
+CONTROL = ('beq', 'bne', 'j', 'jal', 'jr', 'syscall', 'break')
+MEMORY = ('lw', 'sw')
+
+
+class IssueUnit:
+    def __init__(self, width: int = 2, alu_ports: int = 0,
+                 mem_ports: int = 1) -> None:
+        if width not in (1, 2, 4):
+            raise ValueError('issue width must be 1, 2 or 4')
+        self.width = width
+        self.alu_ports = alu_ports or width
+        self.mem_ports = mem_ports
+        self.reset()
+
+    def reset(self) -> None:
+        self.packets = self.issued = 0
+        # packet size -> number of packets
+        self.sizes: Counter[int] = Counter()
+        # why a packet was cut before reaching `width`
+        self.splits: Counter[str] = Counter()
+
+    def _conflict(self, inst: str, written: set[int], alu_used: int,
+                  mem_used: int) -> str:
+        """
+        the pairing rule that keeps `inst` out of the packet, '' if none
+        """
+        dest = dest_reg(inst)
+        if inst_name(inst) == 'syscall':
+            return 'syscall'
+        if any(reg in written for reg in src_regs(inst)):
+            return 'raw'
+        if dest is not None and dest in written:
+            return 'waw'
+        if inst_name(inst) in MEMORY:
+            if mem_used >= self.mem_ports:
+                return 'mem_port'
+        elif alu_used >= self.alu_ports:
+            return 'alu_port'
+        return ''
+
+    def form(self, insts: list[str]) -> tuple[int, str]:
+        """
+        number of instructions from the front of `insts` that go together
+        and why the packet ends there, '' if it is `width` long
+        """
+        written: set[int] = set()
+        alu_used = mem_used = 0
+        size = 0
+        for inst in insts[:self.width]:
+            if size:
+                reason = self._conflict(inst, written, alu_used, mem_used)
+                if reason:
+                    return size, reason
+            size += 1
+            name = inst_name(inst)
+            if name in MEMORY:
+                mem_used += 1
+            else:
+                alu_used += 1
+            dest = dest_reg(inst)
+            if dest is not None:
+                written.add(dest)
+            if name in CONTROL:
+                return size, 'control' if size < self.width else ''
+        return size, 'program_end' if size < self.width else ''
+
+    def packet(self, insts: list[str]) -> int:
+        """
+        number of instructions from the front of `insts` fetched this
+        cycle. nothing is counted, a packet stalled in ID is fetched again
+        """
+        return self.form(insts)[0]
+
+    def issue(self, insts: list[str]) -> None:
+        """
+        count the packet formed from `insts` once it left ID
+        """
+        size, reason = self.form(insts)
+        if reason:
+            self.splits[reason] += 1
+        self.packets += 1
+        self.issued += size
+        self.sizes[size] += 1
+
+    def stats(self) -> dict[str, float]:
+        stats: dict[str, float] = {
+            'issue_width': self.width,
+            'issue_packets': self.packets,
+            'avg_packet_size': self.issued / self.packets if self.packets else 0.0,
+        }
+        stats.update({f'packets_of_{size}': count
+                      for size, count in sorted(self.sizes.items())})
+        stats.update({f'split_{reason}': count
+                      for reason, count in sorted(self.splits.items())})
+        return stats
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    from Isa import assemble_program
+    unit = IssueUnit(width=2)
+    with open('instructions_readable.txt', 'r', encoding='utf-8') as f:
+        program = assemble_program(f.read())
+    pc = 0
+    while pc < len(program):
+        size = unit.packet(program[pc:pc + unit.width])
+        unit.issue(program[pc:pc + unit.width])
+        print(program[pc:pc + size])
+        pc += size
+    print(unit.stats())
@@ -0,0 +1,298 @@
+"""
+SPIM / MARS compatible syscall emulation
+
+$v0 ($2) selects the service, $a0-$a2 ($4-$6) are the arguments and the
+services that return something put it in $v0:
+
+    1  print_int     $a0 = integer
+    4  print_string  $a0 = address of a NUL-terminated string
+    5  read_int      -> $v0
+    8  read_string   $a0 = buffer, $a1 = length (NUL included)
+    9  sbrk          $a0 = bytes -> $v0 = address of the new block
+    10 exit
+    11 print_char    $a0 = character
+    12 read_char     -> $v0
+    13 open          $a0 = file name, $a1 = flags (0 read, 1 write,
+                     9 append) -> $v0 = file descriptor or -1
+    14 read          $a0 = fd, $a1 = buffer, $a2 = length -> $v0 = bytes
+    15 write         $a0 = fd, $a1 = buffer, $a2 = length -> $v0 = bytes
+    16 close         $a0 = fd
+    17 exit2         $a0 = exit code
+
+memory is word addressed, so strings and buffers start at a word address
+and are packed 4 bytes per word, the first byte in the high bits of the
+word. a write of n bytes that does not fill its last word clears the rest
+of that word.
+
+the program sees no host files unless `root` is given: open then takes
+names relative to that directory and fails (-1) for absolute names and
+names with a '..' part. without `stdin` the reads see an empty input.
+
+output for stdout / stderr is collected in a list and handed to the host
+in one write once `buffer_size` characters are pending, before every read
+(so prompts show up) and on exit, flush() or close().
+"""
+import os
+import sys
+from collections import deque
+from typing import Optional, Protocol, TextIO, BinaryIO, Union
+
+from Cache import Cache
+
+WORD_MASK = 2**32 - 1
+EXITS = (10, 17)
+
+LogEntry = tuple[int, int, int, int, Optional[int], list[tuple[int, int]]]
+
+
+class WordMemory(Protocol):
+    def load(self, address: int) -> int:
+        ...
+
+    def store(self, address: int, val: int) -> object:
+        ...
+
+
+class CacheMemory:
+    """
+    word access to memory through a data cache, as the MEM stage does it
+    """
+
+    def __init__(self, cache: Cache) -> None:
+        self.cache = cache
+
+    def load(self, address: int) -> int:
+        return int(self.cache[f'{address & WORD_MASK:032b}'], 2)
+
+    def store(self, address: int, val: int) -> None:
+        self.cache[f'{address & WORD_MASK:032b}'] = f'{val & WORD_MASK:032b}'
+
+
+def _signed(val: int) -> int:
+    val &= WORD_MASK
+    return val - 2**32 if val >> 31 else val
+
+
+class SyscallEmulator:
+    def __init__(self, stdin: Optional[TextIO] = None,
+                 stdout: Optional[TextIO] = None,
+                 stderr: Optional[TextIO] = None,
+                 heap_base: int = 0x10000, buffer_size: int = 8192,
+                 root: Optional[str] = None) -> None:
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.heap_base = heap_base
+        self.buffer_size = buffer_size
+        # directory open() may use, None: no file access
+        self.root = root
+        # fd -> pending output
+        self.pending: dict[int, list[str]] = {1: [], 2: []}
+        self.pending_size = 0
+        self.files: dict[int, Union[BinaryIO, TextIO]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+        self.next_fd = 3
+        self.heap = self.heap_base
+        self.calls = 0
+        self.exited = False
+        self.exit_code = 0
+        # characters of the last input line not consumed by read_char
+        self.line = ''
+        # (code, a0, a1, a2, result, memory writes) of every call while a
+        # co-simulation replays them to the golden model, None otherwise
+        self.log: Optional[deque[LogEntry]] = None
+
+    # ------- host i/o -------
+    def _host(self, fd: int) -> TextIO:
+        if fd == 2:
+            return self.stderr or sys.stderr
+        return self.stdout or sys.stdout
+
+    def _emit(self, fd: int, text: str) -> None:
+        self.pending[fd].append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for fd, chunks in self.pending.items():
+            if chunks:
+                host = self._host(fd)
+                host.write(''.join(chunks))
+                host.flush()
+                chunks.clear()
+        self.pending_size = 0
+
+    def _readline(self) -> str:
+        self.flush()
+        if self.line:
+            line, self.line = self.line, ''
+            return line
+        return self.stdin.readline() if self.stdin is not None else ''
+
+    def close(self) -> None:
+        self.reset()
+
+    # ------- memory -------
+    @staticmethod
+    def load_bytes(memory: WordMemory, address: int, length: int = -1) -> bytes:
+        """
+        `length` bytes from `address`, up to the first NUL if it is -1
+        """
+        data = bytearray()
+        while length < 0 or len(data) < length:
+            word = memory.load(address)
+            address += 1
+            for shift in (24, 16, 8, 0):
+                byte = word >> shift & 0xff
+                if length < 0 and byte == 0:
+                    return bytes(data)
+                data.append(byte)
+        return bytes(data[:length])
+
+    def store_bytes(self, memory: WordMemory, address: int, data: bytes,
+                    writes: list[tuple[int, int]]) -> None:
+        for i in range(0, len(data), 4):
+            chunk = data[i:i + 4].ljust(4, b'\0')
+            word = int.from_bytes(chunk, 'big')
+            memory.store(address + i // 4, word)
+            writes.append((address + i // 4, word))
+
+    # ------- services -------
+    def call(self, code: int, a0: int, a1: int, a2: int,
+             memory: WordMemory) -> Optional[int]:
+        """
+        run service `code`, returns the new value of $v0 for the services
+        that return one
+        """
+        self.calls += 1
+        writes: list[tuple[int, int]] = []
+        result = self._service(code, a0, a1, a2, memory, writes)
+        if result is not None:
+            result &= WORD_MASK
+        if self.log is not None:
+            self.log.append((code, a0, a1, a2, result, writes))
+        return result
+
+    def _service(self, code: int, a0: int, a1: int, a2: int,
+                 memory: WordMemory, writes: list[tuple[int, int]]) -> Optional[int]:
+        if code == 1:
+            self._emit(1, str(_signed(a0)))
+        elif code == 4:
+            self._emit(1, self.load_bytes(memory, a0).decode('latin-1'))
+        elif code == 5:
+            try:
+                return int(self._readline().strip() or 0)
+            except ValueError:
+                return 0
+        elif code == 8:
+            line = self._readline().encode('latin-1')[:max(_signed(a1) - 1, 0)]
+            self.store_bytes(memory, a0, line + b'\0', writes)
+        elif code == 9:
+            address = self.heap
+            self.heap += (_signed(a0) + 3) // 4
+            return address
+        elif code in EXITS:
+            self.exited = True
+            self.exit_code = _signed(a0) if code == 17 else 0
+            self.flush()
+        elif code == 11:
+            self._emit(1, chr(a0 & 0xff))
+        elif code == 12:
+            if not self.line:
+                self.line = self._readline()
+            char, self.line = self.line[:1], self.line[1:]
+            return ord(char) if char else 0
+        elif code == 13:
+            return self._open(self.load_bytes(memory, a0).decode('latin-1'), a1)
+        elif code == 14:
+            return self._read(_signed(a0), a1, _signed(a2), memory, writes)
+        elif code == 15:
+            data = self.load_bytes(memory, a1, max(_signed(a2), 0))
+            return self._write(_signed(a0), data)
+        elif code == 16:
+            file = self.files.pop(_signed(a0), None)
+            if file is not None:
+                file.close()
+        else:
+            raise ValueError(f'unknown syscall {code}')
+        return None
+
+    def _path(self, name: str) -> Optional[str]:
+        """
+        host path of the file `name`, None if it is not under root
+        """
+        if self.root is None or not name or os.path.isabs(name) or \
+                '..' in name.replace('\\', '/').split('/'):
+            return None
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, name))
+        # a symbolic link under root may still point out of it
+        return path if os.path.commonpath([root, path]) == root else None
+
+    def _open(self, name: str, flags: int) -> int:
+        mode = {0: 'rb', 1: 'wb', 9: 'ab'}.get(flags)
+        path = self._path(name)
+        if mode is None or path is None:
+            return -1
+        try:
+            file = open(path, mode)  # skipcq: PTC-W6004
+        except OSError:
+            return -1
+        fd = self.next_fd
+        self.next_fd += 1
+        self.files[fd] = file
+        return fd
+
+    def _read(self, fd: int, address: int, length: int, memory: WordMemory,
+              writes: list[tuple[int, int]]) -> int:
+        if fd == 0:
+            data = self._readline().encode('latin-1')[:length]
+        elif fd in self.files:
+            data = self.files[fd].read(max(length, 0))
+        else:
+            return -1
+        self.store_bytes(memory, address, data, writes)
+        return len(data)
+
+    def _write(self, fd: int, data: bytes) -> int:
+        if fd in (1, 2):
+            self._emit(fd, data.decode('latin-1'))
+        elif fd in self.files:
+            self.files[fd].write(data)
+        else:
+            return -1
+        return len(data)
+
+    def stats(self) -> dict[str, float]:
+        return {'syscalls': self.calls, 'exit_code': self.exit_code}
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+
+    import main
+    from Isa import assemble_program
+
+    # 'hi!' is packed in word 100, print it, print 40 + 2, then exit 3
+    program = assemble_program('\n'.join([
+        'addi $8 $0 0x6869', 'sll $8 $8 16', 'ori $8 $8 0x2100',
+        'sw $8 100 $0', 'sw $0 101 $0',
+        'addi $2 $0 4', 'addi $4 $0 100', 'syscall',
+        'addi $2 $0 1', 'addi $4 $0 40', 'addi $4 $4 2', 'syscall',
+        'addi $2 $0 17', 'addi $4 $0 3', 'syscall',
+        'addi $9 $0 1']))
+    emulator = SyscallEmulator(stdout=io.StringIO())
+    main.use_syscalls(emulator)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = main.run_program(program)
+    # 'hi!42' 3 0
+    print(repr(emulator.stdout.getvalue()), stats['exit_code'], main.reg_file[9])
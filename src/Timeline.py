@@ -0,0 +1,290 @@
+"""
+pipeline timeline export
+
+a timeline sink records, for every instruction, the cycle it entered and
+left IF, ID, EX, MEM and WB, plus stalls and flushes, and streams them to
+a file that a viewer can open:
+
+    ChromeTrace -> chrome trace-event json (chrome://tracing, Perfetto),
+                   one track per stage so bubbles show up as gaps, memory
+                   stalls on a track of their own. 1 cycle = 1 us.
+    KonataLog   -> Kanata log for the Konata pipeline viewer, one row per
+                   instruction, retired or flushed
+
+    with ChromeTrace('trace.json') as trace:
+        main.use_timeline(trace)
+        main.run_program(program)
+
+lines are collected in a list and written in chunks of `buffer_lines`,
+so recording costs a few appends per instruction and stage.
+"""
+import json
+from abc import ABC, abstractmethod
+from types import TracebackType
+from typing import Optional, TextIO
+
+STAGES = ('IF', 'ID', 'EX', 'MEM', 'WB')
+
+
+class Timeline(ABC):
+    """
+    base class, keeps the stage every instruction is in and calls the
+    _begin / _end hooks of the format when it moves. a format implements
+    stall() and _end(), the other hooks do nothing unless overridden
+    """
+
+    def __init__(self, path: str, buffer_lines: int = 4096) -> None:
+        self.path = path
+        self.buffer_lines = buffer_lines
+        self.buffer: list[str] = []
+        self.file: Optional[TextIO] = open(path, 'w', encoding='utf-8')  # skipcq: PTC-W6004
+        # seq -> [stage, cycle it entered the stage]
+        self.current: dict[int, list] = {}
+        # seq -> text shown for the instruction
+        self.labels: dict[int, str] = {}
+        self.instructions = self.flushed = 0
+        self._header()
+
+    def write(self, line: str) -> None:
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush_buffer()
+
+    def flush_buffer(self) -> None:
+        if self.file is not None and self.buffer:
+            self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+
+    # ------- what the pipeline reports -------
+    def fetch(self, seq: int, pc: int, text: str, cycle: int) -> None:
+        self.labels[seq] = f'{pc}: {text}'
+        self.current[seq] = ['IF', cycle]
+        self._fetched(seq, pc, cycle)
+
+    def stage(self, seq: int, stage: str, cycle: int) -> None:
+        entry = self.current.get(seq)
+        if entry is None or entry[0] == stage:
+            return
+        self._end(seq, entry[0], entry[1], cycle)
+        entry[0], entry[1] = stage, cycle
+        self._begin(seq, stage, cycle)
+
+    def retire(self, seq: int, cycle: int) -> None:
+        self.stage(seq, 'WB', cycle)
+        self._leave(seq, cycle + 1, flushed=False)
+
+    def flush(self, seq: int, cycle: int) -> None:
+        """
+        the instruction is squashed in the stage it is in during `cycle`
+        """
+        self._leave(seq, cycle + 1, flushed=True)
+
+    def discard(self, seq: int) -> None:
+        """
+        forget a fetch that is redone, e.g. behind a stall in ID
+        """
+        self.current.pop(seq, None)
+        self.labels.pop(seq, None)
+        self._discarded(seq)
+
+    @abstractmethod
+    def stall(self, cause: str, cycle: int, cycles: int = 1,
+              seq: Optional[int] = None) -> None:
+        """
+        `seq` waits in its stage for `cycles` cycles, None for the whole
+        pipeline (a memory stall)
+        """
+
+    def _leave(self, seq: int, cycle: int, flushed: bool) -> None:
+        entry = self.current.pop(seq, None)
+        if entry is None:
+            return
+        self.instructions += 1
+        self.flushed += flushed
+        self._end(seq, entry[0], entry[1], cycle)
+        self._left(seq, cycle, flushed)
+        self.labels.pop(seq, None)
+
+    # ------- format hooks -------
+    def _header(self) -> None:
+        pass
+
+    def _footer(self) -> None:
+        pass
+
+    def _fetched(self, seq: int, pc: int, cycle: int) -> None:
+        pass
+
+    def _discarded(self, seq: int) -> None:
+        pass
+
+    def _begin(self, seq: int, stage: str, cycle: int) -> None:
+        pass
+
+    @abstractmethod
+    def _end(self, seq: int, stage: str, start: int, end: int) -> None:
+        """
+        `seq` was in `stage` from cycle `start` until `end`
+        """
+
+    def _left(self, seq: int, cycle: int, flushed: bool) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self._footer()
+        self.flush_buffer()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self) -> 'Timeline':
+        return self
+
+    def __exit__(self, exc_type: Optional[type[BaseException]],
+                 exc: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.close()
+
+
+class ChromeTrace(Timeline):
+    def _header(self) -> None:
+        self.first = True
+        self.write('[\n')
+        names = STAGES + ('stall',)
+        for tid, name in enumerate(names):
+            self._event({'name': 'thread_name', 'ph': 'M', 'pid': 0,
+                         'tid': tid, 'args': {'name': name}})
+
+    def _event(self, event: dict) -> None:
+        self.write(('' if self.first else ',\n') + json.dumps(event))
+        self.first = False
+
+    def _end(self, seq: int, stage: str, start: int, end: int) -> None:
+        self._event({'name': self.labels.get(seq, str(seq)), 'cat': stage,
+                     'ph': 'X', 'ts': start, 'dur': end - start, 'pid': 0,
+                     'tid': STAGES.index(stage), 'args': {'seq': seq}})
+
+    def _left(self, seq: int, cycle: int, flushed: bool) -> None:
+        if flushed:
+            self._event({'name': f'flush {self.labels.get(seq, seq)}', 'ph': 'i',
+                         'ts': cycle - 1, 'pid': 0,
+                         'tid': STAGES.index('EX'), 's': 't'})
+
+    def stall(self, cause: str, cycle: int, cycles: int = 1,
+              seq: Optional[int] = None) -> None:
+        name = f'stall {cause}'
+        if seq is not None:
+            name += f' {self.labels.get(seq, seq)}'
+        self._event({'name': name, 'cat': 'stall', 'ph': 'X',
+                     'ts': cycle, 'dur': cycles, 'pid': 0,
+                     'tid': len(STAGES)})
+
+    def _footer(self) -> None:
+        self.write('\n]\n')
+
+
+class KonataLog(Timeline):
+    """
+    Kanata 0004 log. commands have to come in cycle order, so a fetch is
+    written once the cycle is over (it may still be discarded in it) and
+    the instructions leaving in a cycle are written at the start of the
+    next one
+    """
+
+    def _header(self) -> None:
+        self.write('Kanata\t0004\n')
+        self.cycle = 0
+        self.write('C=\t0\n')
+        self.ids: dict[int, int] = {}
+        self.next_id = self.next_retire_id = 0
+        # fetched in self.cycle, not written yet
+        self.new: dict[int, int] = {}
+        # (seq, flushed) of the instructions leaving after self.cycle
+        self.leaving: list[tuple[int, bool]] = []
+
+    def _at(self, cycle: int) -> None:
+        if cycle <= self.cycle:
+            return
+        self._write_new()
+        if self.leaving:
+            self.write('C\t1\n')
+            self.cycle += 1
+            self._write_leaving()
+        if cycle > self.cycle:
+            self.write(f'C\t{cycle - self.cycle}\n')
+            self.cycle = cycle
+
+    def _write_leaving(self) -> None:
+        for seq, flushed in self.leaving:
+            self.write(f'R\t{self.ids.pop(seq)}\t{self.next_retire_id}\t{int(flushed)}\n')
+            self.next_retire_id += 1
+        self.leaving.clear()
+
+    def _write_new(self) -> None:
+        for seq in self.new:
+            file_id = self.ids[seq] = self.next_id
+            self.next_id += 1
+            self.write(f'I\t{file_id}\t{seq}\t0\n')
+            self.write(f'L\t{file_id}\t0\t{self.labels[seq]}\n')
+            self.write(f'S\t{file_id}\t0\tIF\n')
+        self.new.clear()
+
+    def _id(self, seq: int) -> int:
+        if seq in self.new:
+            self._write_new()
+        return self.ids[seq]
+
+    def _fetched(self, seq: int, pc: int, cycle: int) -> None:
+        self._at(cycle)
+        self.new[seq] = pc
+
+    def _discarded(self, seq: int) -> None:
+        self.new.pop(seq, None)
+
+    def _begin(self, seq: int, stage: str, cycle: int) -> None:
+        self._at(cycle)
+        self.write(f'S\t{self._id(seq)}\t0\t{stage}\n')
+
+    def _end(self, seq: int, stage: str, start: int, end: int) -> None:
+        # stages end where the next one begins or in _left
+        pass
+
+    def _left(self, seq: int, cycle: int, flushed: bool) -> None:
+        self._id(seq)
+        self.leaving.append((seq, flushed))
+
+    def stall(self, cause: str, cycle: int, cycles: int = 1,
+              seq: Optional[int] = None) -> None:
+        self._at(cycle)
+        for waiting in self.current if seq is None else (seq,):
+            if waiting in self.ids:
+                self.write(f'L\t{self.ids[waiting]}\t1\tstall {cause} '
+                           f'{cycles} cycles @{cycle}\n')
+
+    def _footer(self) -> None:
+        self._write_new()
+        if self.leaving:
+            self.write('C\t1\n')
+            self._write_leaving()
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+    import os
+    import tempfile
+
+    import main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for sink in (ChromeTrace(os.path.join(tmp, 'timeline.json')),
+                     KonataLog(os.path.join(tmp, 'timeline.log'))):
+            with sink:
+                main.use_timeline(sink)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main.run_program(main.load_program())
+            main.use_timeline(None)
+            print(os.path.basename(sink.path), sink.instructions, 'instructions',
+                  sink.flushed, 'flushed')
@@ -0,0 +1,194 @@
+"""
+virtual memory: instruction / data TLBs and a hardware page-table walker
+
+addresses coming out of fetch (pc) and out of EX (alu_out of lw / sw) are
+virtual. they are looked up in the ITLB / DTLB, a miss starts a walk of
+the radix page table, one read per level. the page table is kept in a
+memory of its own that programs cannot store to, but its reads go
+through the data cache as if it were at `table_base` in the data memory,
+so walks hit or miss there like any load and take the cache's latency.
+only the timing comes from the cache, the entries are read from and
+written to the table memory. a page that is not mapped yet is a page fault: the handler maps
+it to the frame with the same number (identity, so a program sees the
+same data with and without translation) and costs `fault_latency` cycles.
+
+page table entry: address of the next table (or of the frame) | valid,
+both are aligned so bit 0 is free
+
+    TLB(entries=16, ways=4, replacement='lru' | 'fifo' | 'random')
+
+counters:
+    <tlb>_hits / <tlb>_misses   for itlb and dtlb
+    walks, walk_accesses        walks and page table reads they made
+    walk_cycles                 cycles spent walking (faults included)
+    page_faults
+"""
+import random
+from collections import OrderedDict
+from typing import Optional
+
+from Cache import Cache
+from Memory import Memory
+
+REPLACEMENT = ('lru', 'fifo', 'random')
+
+
+class TLB:
+    """
+    set-associative translation buffer, virtual page -> frame
+    """
+
+    def __init__(self, name: str, entries: int = 16, ways: int = 4,
+                 replacement: str = 'lru', seed: int = 0) -> None:
+        if replacement not in REPLACEMENT:
+            raise ValueError(f'replacement must be one of {REPLACEMENT}')
+        if entries % ways:
+            raise ValueError('entries must be a multiple of ways')
+        self.name = name
+        self.entries = entries
+        self.ways = ways
+        self.sets_no = entries // ways
+        self.replacement = replacement
+        self.seed = seed
+        self.reset()
+
+    def reset(self) -> None:
+        # one ordered dict per set, least recently used / oldest first
+        self.sets: list[OrderedDict[int, int]] = [OrderedDict()
+                                                  for _ in range(self.sets_no)]
+        self.rng = random.Random(self.seed)
+        self.hits = self.misses = 0
+
+    def lookup(self, page: int) -> Optional[int]:
+        entries = self.sets[page % self.sets_no]
+        frame = entries.get(page)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.replacement == 'lru':
+            entries.move_to_end(page)
+        return frame
+
+    def insert(self, page: int, frame: int) -> None:
+        entries = self.sets[page % self.sets_no]
+        if len(entries) >= self.ways:
+            if self.replacement == 'random':
+                del entries[self.rng.choice(list(entries))]
+            else:
+                entries.popitem(last=False)
+        entries[page] = frame
+
+    def stats(self) -> dict[str, float]:
+        return {f'{self.name}_hits': self.hits, f'{self.name}_misses': self.misses}
+
+
+class VirtualMemory:
+    def __init__(self, itlb: Optional[TLB] = None, dtlb: Optional[TLB] = None,
+                 page_bits: int = 10, levels: int = 2,
+                 table_base: int = 0xF0000000, fault_latency: int = 0) -> None:
+        self.itlb = itlb or TLB('itlb')
+        self.dtlb = dtlb or TLB('dtlb')
+        # words per page as a shift
+        self.page_bits = page_bits
+        self.levels = levels
+        # page number bits of each level, the root takes the rest
+        self.level_bits = -(-(32 - page_bits) // levels)
+        self.table_base = table_base
+        self.fault_latency = fault_latency
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        empty TLBs and an empty page table
+        """
+        self.tables = Memory()
+        self.itlb.reset()
+        self.dtlb.reset()
+        self.next_table = self.table_base
+        self.root = self._new_table()
+        self.walks = self.walk_accesses = self.walk_cycles = 0
+        self.page_faults = 0
+
+    def _new_table(self) -> int:
+        address = self.next_table
+        self.next_table += 1 << self.level_bits
+        return address
+
+    def translate(self, address: int, cycle: int, cache: Cache,
+                  inst: bool = False) -> tuple[int, int]:
+        """
+        physical address of a virtual one and the cycle it is known in,
+        `cycle` on a TLB hit
+        """
+        tlb = self.itlb if inst else self.dtlb
+        page = address >> self.page_bits
+        offset = address & ((1 << self.page_bits) - 1)
+        frame = tlb.lookup(page)
+        if frame is None:
+            frame, ready = self.walk(page, cycle, cache)
+            tlb.insert(page, frame)
+            cycle = ready
+        return frame << self.page_bits | offset, cycle
+
+    def walk(self, page: int, cycle: int, cache: Cache) -> tuple[int, int]:
+        """
+        read the page table from the root down, one dependent access per
+        level. returns the frame and the cycle the walk is done in
+        """
+        start = cycle
+        self.walks += 1
+        table = self.root
+        for level in range(self.levels):
+            shift = (self.levels - 1 - level) * self.level_bits
+            entry_address = table + (page >> shift & ((1 << self.level_bits) - 1))
+            bits = f'{entry_address:032b}'
+            cycle = cache.access(bits, cycle)
+            cache[bits]  # skipcq: PYL-W0104 (brings the line in)
+            self.walk_accesses += 1
+            entry = int(self.tables[entry_address], 2)
+            if not entry & 1:
+                entry = self._fault(entry_address, page, last=level == self.levels - 1)
+                cycle += self.fault_latency
+            table = entry & ~1
+        self.walk_cycles += cycle - start
+        return table >> self.page_bits, cycle
+
+    def _fault(self, entry_address: int, page: int, last: bool) -> int:
+        """
+        the handler fills a missing entry: a new table, or on the last
+        level the frame of the page
+        """
+        if last:
+            self.page_faults += 1
+        entry = (page << self.page_bits if last else self._new_table()) | 1
+        self.tables[entry_address] = f'{entry:032b}'
+        return entry
+
+    def stats(self) -> dict[str, float]:
+        return self.itlb.stats() | self.dtlb.stats() | {
+            'walks': self.walks, 'walk_accesses': self.walk_accesses,
+            'walk_cycles': self.walk_cycles, 'page_faults': self.page_faults}
+
+
+# * =========== test ===========
+if __name__ == '__main__':
+    import contextlib
+    import io
+
+    import main
+    from Isa import assemble_program
+    from NonBlockingCache import NonBlockingCache
+    from Cache import data_mem
+
+    # walking 8 pages twice, with a 4-entry DTLB the second pass misses too
+    program = assemble_program('\n'.join(
+        f'lw $8 {page * 1024} $0' for page in list(range(8)) * 2))
+    main.use_data_cache(NonBlockingCache(data_mem.fork(), 256, 32, 2, miss_latency=20))
+    for dtlb in (TLB('dtlb', 4, 4), TLB('dtlb', 16, 4)):
+        main.use_virtual_memory(VirtualMemory(dtlb=dtlb))
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = main.run_program(program)
+        print(dtlb.entries, 'entries:', stats['cycles'], 'cycles',
+              {key: val for key, val in stats.items()
+               if 'tlb' in key or key.startswith(('walk', 'page'))})
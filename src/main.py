@@ -51,390 +51,612 @@ _Features_
 
 
 """
+import os
 import sys
-from termcolor import colored
-from Register import RegFile
-from Cache import data_cache, inst_mem
+from typing import TYPE_CHECKING, Callable, Optional
+from Register import RegFile, Scoreboard
+from Cache import Cache, inst_mem, shared
 from Alu import ALU
-from BinFuncs import sign_extend, bin_to_int_signed, bin_to_int_unsigned
-from PipelineRegister import PipelineRegister
+from BinFuncs import sign_extend, bin_to_int_signed
+from PipelineRegister import PipelineRegister, Latch, IfId, IdEx, ExMem, MemWb
+from Forwarding import STALL_CAUSES, ForwardingUnit, operands
+from EventQueue import EventQueue
+from Syscall import SyscallEmulator, CacheMemory
+from Superscalar import MEMORY, IssueUnit
+from Isa import inst_name, is_rtype, is_itype, is_branch, disassemble
+
+if TYPE_CHECKING:
+    from CoSim import CoSim
+    from Metrics import MetricsSampler
+    from Multithreading import ThreadContext, ThreadScheduler
+    from Timeline import Timeline
+    from VirtualMemory import VirtualMemory
+
+
+def _plain(text: str, *_args: object, **_kwargs: object) -> str:
+    return text
+
+
+# colors are optional: without termcolor, or with NO_COLOR set, the output
+# is plain text
+if os.environ.get('NO_COLOR'):
+    colored = _plain
+else:
+    try:
+        from termcolor import colored
+    except ImportError:
+        colored = _plain
 
 
 # ************************** Pre-Defined Variables **************************
 
-if_id = PipelineRegister('if_id', {'PC': '0'*5, 'RD': '0'*5, 'RT': '0'*5,
-                         'RS': '0'*5, 'SHAMT': '0'*5, 'FUNCT': '0'*6,
-                                   'OPCODE': '0'*6, 'IR': '0'*32})
-
-id_ex = PipelineRegister('id_ex', {'PC': '0'*32, 'RD': '0'*5, 'RT': '0'*5,
-                                   'RS': '0'*5, 'SHAMT': '0'*5,
-                                   'FUNCT': '0'*6, 'OPCODE': '0'*6,
-                                   'IR': '0'*32, 'REG_DST': '0',
-                                   'ALU_SRC': '0'*2, 'MEM_TO_REG': '0',
-                                   'ZERO': '0', 'ALUT_OP': '0'*2,
-                                   'MEM_READ': '0',
-                                   'MEM_WRITE': '0', 'BRANCH': '0',
-                                   'REG_WRITE': '0'})
-
-ex_mem = PipelineRegister('ex_mem', {'PC': '0'*32, 'RD': '0'*5, 'RT': '0'*5,
-                                     'RS': '0'*5, 'SHAMT': '0'*5,
-                                     'FUNCT': '0'*6, 'OPCODE': '0'*6,
-                                     'IR': '0'*32, 'REG_DST': '0',
-                                     'ALU_SRC': '0'*2, 'MEM_TO_REG': '0',
-                                     'ALUT_OP': '0'*2, 'MEM_READ': '0',
-                                     'MEM_WRITE': '0', 'BRANCH': '0',
-                                     'REG_WRITE': '0', 'ALU_OUT': '0'*32,
-                                     'ZERO': '0',
-                                     'RDVAL': '0'*32,
-                                     'RSVAL': '0'*32, 'RTVAL': '0'*32})
-
-mem_wb = PipelineRegister('mem_wb', {'PC': '0'*32, 'RD': '0'*5, 'RT': '0'*5,
-                                     'RS': '0'*5, 'SHAMT': '0'*5,
-                                     'FUNCT': '0'*6, 'OPCODE': '0'*6,
-                                     'IR': '0'*32, 'REG_DST': '0',
-                                     'ALU_SRC': '0'*2, 'MEM_TO_REG': '0',
-                                     'ALUT_OP': '0'*2, 'MEM_READ': '0',
-                                     'MEM_WRITE': '0', 'BRANCH': '0',
-                                     'REG_WRITE': '0', 'ALU_OUT': '0'*32,
-                                     'ZERO': '0',
-                                     'RDVAL': '0'*32,
-                                     'RSVAL': '0'*32, 'RTVAL': '0'*32})
-
-
-# tuple(opcode, funct): instruction
-bin_to_inst_dict = {
-    ('000000', '100000'): 'add',
-    ('000000', '100010'): 'sub',
-    ('000000', '100100'): 'and',
-    ('000000', '100101'): 'or',
-    ('000000', '100110'): 'xor',
-    ('000000', '100111'): 'nor',
-    ('000000', '101010'): 'slt',
-    ('000000', '000000'): 'sll',
-    ('000000', '000010'): 'srl',
-    ('000000', '001000'): 'jr',
-    ('000000', '001100'): 'syscall',
-    ('000000', '001101'): 'break',
-    ('000000', '010000'): 'mfhi',
-    ('000000', '010010'): 'mflo',
-    ('000000', '011000'): 'mult',
-    ('000000', '011001'): 'multu',
-    ('000000', '011010'): 'div',
-    ('000000', '011011'): 'divu',
-    ('000000', '101000'): 'addu',
-    ('000000', '101001'): 'addiu',
-    ('000000', '001111'): 'jal',
-    ('000100', 'xxxxxx'): 'beq',
-    ('000101', 'xxxxxx'): 'bne',
-    ('100011', 'xxxxxx'): 'lw',
-    ('101011', 'xxxxxx'): 'sw',
-    ('001000', 'xxxxxx'): 'addi',
-    ('001100', 'xxxxxx'): 'andi',
-    ('001101', 'xxxxxx'): 'ori',
-    ('001110', 'xxxxxx'): 'xori',
-    ('000010', 'xxxxxx'): 'j',
-    ('000011', 'xxxxxx'): 'jal'
-}
-
-bin_to_regname = {
-    '00000': '$0',   # zero
-    '00001': '$1',   # at
-    '00010': '$2',   # v0
-    '00011': '$3',   # v1
-    '00100': '$4',   # a0
-    '00101': '$5',   # a1
-    '00110': '$6',   # a2
-    '00111': '$7',   # a3
-    '01000': '$8',   # t0
-    '01001': '$9',   # t1
-    '01010': '$10',  # t2
-    '01011': '$11',  # t3
-    '01100': '$12',  # t4
-    '01101': '$13',  # t5
-    '01110': '$14',  # t6
-    '01111': '$15',  # t7
-    '10000': '$16',  # s0
-    '10001': '$17',  # s1
-    '10010': '$18',  # s2
-    '10011': '$19',  # s3
-    '10100': '$20',  # s4
-    '10101': '$21',  # s5
-    '10110': '$22',  # s6
-    '10111': '$23',  # s7
-    '11000': '$24',  # t8
-    '11001': '$25',  # t9
-    '11010': '$26',  # k0
-    '11011': '$27',  # k1
-    '11100': '$28',  # gp
-    '11101': '$29',  # sp
-    '11110': '$30',  # fp
-    '11111': '$31'   # ra
-}
+# every pipeline register is double buffered: stages read `.cur` of the
+# register in front of them and write `.nxt` of the one behind them, and
+# commit_latches() moves everything forward at the clock edge
+if_id = PipelineRegister('if_id', IfId)
+id_ex = PipelineRegister('id_ex', IdEx)
+ex_mem = PipelineRegister('ex_mem', ExMem)
+mem_wb = PipelineRegister('mem_wb', MemWb)
+# one set of pipeline registers per issue slot, lane 0 holds the oldest
+# instruction of a packet. if_id ... mem_wb are the ones of the lane a
+# stage works on, bind_lane() switches them
+IF_ID, ID_EX, EX_MEM, MEM_WB = range(4)
+lanes: list[tuple[PipelineRegister, ...]] = [(if_id, id_ex, ex_mem, mem_wb)]
+lane = 0
+pipeline_regs = list(lanes[0])
+
+ZERO_WORD = '0' * 32
 
 
 reg_file = RegFile()
-# initialize reg_file:
-for i in range(32):
-    reg_file[f'${i}'] = 0
+scoreboard = Scoreboard()
 
 alu = ALU()
-alu_inp1 = alu_inp2 = alu_out = zero_flag = pc = stall_count = 0
+forwarding = ForwardingUnit()
+# lockstep check against the golden model, off unless use_cosim() is called
+cosim: Optional['CoSim'] = None
+# timeline sink and the sequence number of the last fetched instruction
+timeline: Optional['Timeline'] = None
+fetch_seq = 0
+# address translation of fetch and MEM, off unless use_virtual_memory()
+vm: Optional['VirtualMemory'] = None
+# services of the syscall instruction, reading stdin and writing stdout,
+# no file access
+syscalls = SyscallEmulator(stdin=sys.stdin)
+pc = next_pc = stall_count = 0
+# first address after the program (an exit syscall moves it to the
+# instruction after the syscall), instructions retired by WB, branches
+# resolved and taken branches (each flushes the two instructions fetched
+# behind it)
+program_end = retired = branches = branch_flushes = 0
+# register writes of the WB stage (register file, scoreboard, register,
+# value, writer pc), one per lane, done at the clock edge
+reg_write_back: list[tuple[RegFile, Scoreboard, int, str, int]] = []
+# (scoreboard, register, writer pc, ready cycle) of loads written back
+# before their value is there (a miss in a non-blocking cache), released
+# once it is
+late_releases: list[tuple[Scoreboard, int, int, int]] = []
+# a store waiting in EX/MEM for a load that missed holds EX/MEM and the
+# stages in front of it until this cycle, `held_seq` is the store
+held_until = held_seq = 0
+# current clock cycle, pending completions of multi-cycle units
+cycle = 0
+events = EventQueue()
+# interval metrics sink, off unless use_metrics() is called
+metrics: Optional['MetricsSampler'] = None
+# hardware threads, off unless use_threads() is called. pc, next_pc,
+# program_end, reg_file, scoreboard and syscalls belong to the thread
+# `thread_id`, bind() switches them to the thread of the instruction a
+# stage works on
+scheduler: Optional['ThreadScheduler'] = None
+threads: list['ThreadContext'] = []
+thread_id = 0
+# data cache of the MEM stage: Cache.data_cache unless use_data_cache()
+# picked another one, bound by the first reset_state() so that importing
+# main does not build the data memory
+data_cache: Cache
 
 
 # ************************** Helper Functions **************************
 
-def hazard_detection(instr: str) -> None:
+def use_data_cache(cache: Cache) -> None:
+    """
+    replace the data cache used by the MEM stage, e.g. by a NonBlockingCache
+    to model miss latency
+    """
+    global data_cache  # skipcq: PYL-W0603
+    data_cache = cache
+
+
+def use_forwarding(unit: ForwardingUnit) -> None:
+    """
+    replace the forwarding network, e.g. by one with some paths turned off
+    """
+    global forwarding  # skipcq: PYL-W0603
+    forwarding = unit
+
+
+def use_cosim(checker: Optional['CoSim']) -> None:
+    """
+    check every retired instruction against the golden model, None to stop
+    """
+    global cosim  # skipcq: PYL-W0603
+    cosim = checker
+
+
+def use_timeline(sink: Optional['Timeline']) -> None:
+    """
+    record the stages of every instruction to a ChromeTrace / KonataLog
+    """
+    global timeline  # skipcq: PYL-W0603
+    timeline = sink
+
+
+def use_metrics(sampler: Optional['MetricsSampler']) -> None:
+    """
+    stream ipc, cache, stall and branch counters every N cycles, None to
+    stop
+    """
+    global metrics  # skipcq: PYL-W0603
+    metrics = sampler
+
+
+def use_threads(thread_scheduler: Optional['ThreadScheduler']) -> None:
+    """
+    run the programs of several hardware threads on the pipeline, see
+    Multithreading.run_threads, None for a single thread
+    """
+    global scheduler  # skipcq: PYL-W0603
+    scheduler = thread_scheduler
+
+
+def bind(tid: int) -> None:
+    """
+    make thread `tid` the one pc, the register file, ... belong to, the
+    state of the thread bound before goes back to its context
+    """
+    global thread_id, pc, next_pc, program_end  # skipcq: PYL-W0603
+    global reg_file, scoreboard, syscalls  # skipcq: PYL-W0603
+    if tid == thread_id:
+        return
+    save_thread()
+    thread = threads[tid]
+    pc, next_pc, program_end = thread.pc, thread.next_pc, thread.program_end
+    reg_file, scoreboard, syscalls = thread.reg_file, thread.scoreboard, thread.syscalls
+    thread_id = tid
+
+
+def use_lanes(width: int) -> None:
+    """
+    fresh pipeline registers for `width` issue slots
+    """
+    global pipeline_regs  # skipcq: PYL-W0603
+    lanes[:] = [(PipelineRegister('if_id', IfId), PipelineRegister('id_ex', IdEx),
+                 PipelineRegister('ex_mem', ExMem), PipelineRegister('mem_wb', MemWb))
+                for _ in range(width)]
+    pipeline_regs = [pipeline_reg for regs in lanes for pipeline_reg in regs]
+    bind_lane(0)
+
+
+def bind_lane(index: int) -> None:
+    """
+    make if_id, id_ex, ex_mem and mem_wb the pipeline registers of lane
+    `index`
+    """
+    global if_id, id_ex, ex_mem, mem_wb, lane  # skipcq: PYL-W0603
+    if_id, id_ex, ex_mem, mem_wb = lanes[index]
+    lane = index
+
+
+def lane_regs(index: int) -> list[PipelineRegister]:
+    """
+    pipeline register `index` (IF_ID ... MEM_WB) of every lane, oldest first
+    """
+    return [regs[index] for regs in lanes]
+
+
+def save_thread() -> None:
+    """
+    write pc, next_pc and program_end back to the context of the bound thread
+    """
+    thread = threads[thread_id]
+    thread.pc, thread.next_pc, thread.program_end = pc, next_pc, program_end
+
+
+def redirect(tid: int, target: int) -> None:
+    """
+    thread `tid` fetches from `target` next
+    """
+    global next_pc  # skipcq: PYL-W0603
+    if tid == thread_id:
+        next_pc = target
+    else:
+        threads[tid].next_pc = target
+
+
+def fetching() -> bool:
+    """
+    True while some thread has instructions left to fetch
+    """
+    if not threads:
+        return pc < program_end
+    save_thread()
+    return any(thread.pc < thread.program_end for thread in threads)
+
+
+def counters() -> dict[str, int]:
+    """
+    cumulative counters of the run so far, what a MetricsSampler samples
+    """
+    snapshot = {'cycle': cycle, 'instructions': retired,
+                'dcache_hits': data_cache.hits, 'dcache_misses': data_cache.misses,
+                'stall_memory': events.skipped_cycles, 'branches': branches,
+                'branches_taken': branch_flushes}
+    snapshot.update({f'stall_{cause}': forwarding.stalls[cause]
+                     for cause in STALL_CAUSES})
+    return snapshot
+
+
+def use_virtual_memory(memory: Optional['VirtualMemory']) -> None:
+    """
+    translate instruction and data addresses through TLBs and a page
+    table walker, None to use the addresses as they are
+    """
+    global vm  # skipcq: PYL-W0603
+    vm = memory
+
+
+def use_syscalls(emulator: SyscallEmulator) -> None:
+    """
+    replace the syscall emulator, e.g. by one reading and writing files
+    instead of stdin / stdout
+    """
+    global syscalls  # skipcq: PYL-W0603
+    syscalls = emulator
+
+
+def wait_for_memory(ready: int, what: str = 'dcache') -> None:
+    """
+    hold every stage until the memory access completing in `ready` is done
+    """
+    events.schedule(ready, what)
+
+
+def data_address(latch: ExMem) -> tuple[str, int]:
+    """
+    physical address of a lw / sw and the cycle the access can start in
+    """
+    if vm is None:
+        return latch.alu_out, cycle
+    address, ready = vm.translate(int(latch.alu_out, 2), cycle, data_cache)
+    return f'{address:032b}', ready
+
+
+def wb_value(latch: MemWb) -> str:
+    """
+    value an instruction in MEM/WB writes to its destination register
+    """
+    return latch.mem_out if latch.mem_to_reg else latch.alu_out
+
+
+def read_reg(reg: int) -> str:
+    """
+    32-bit binary value of a register, read in ID. with the wb_id path the
+    register file is written in the first half of the cycle and read in
+    the second half, so the value WB is writing in this cycle is seen.
+    """
+    wb = writer_in(MEM_WB, reg)
+    if forwarding['wb_id'] and reg and wb is not None:
+        return wb_value(wb)
+    return reg_file.bits(reg)
+
+
+def writer_in(index: int, reg: int) -> Optional[Latch]:
+    """
+    youngest instruction of the bound thread that writes `reg` in the
+    `.cur` latches of pipeline register `index` of the lanes
+    """
+    for pipeline_reg in reversed(lane_regs(index)):
+        latch = pipeline_reg.cur
+        if latch.valid and latch.reg_write and latch.dest == reg and \
+                latch.tid == thread_id:
+            return latch
+    return None
+
+
+def youngest_writer(reg: int) -> tuple[str, Optional[Latch]]:
+    """
+    stage and latch of the youngest instruction in flight that writes `reg`
+    for the bound thread
+    """
+    for stage, index in (('ex', ID_EX), ('mem', EX_MEM), ('wb', MEM_WB)):
+        latch = writer_in(index, reg)
+        if latch is not None:
+            return stage, latch
+    return '', None
+
+
+def hazard_detection(latch: IdEx) -> str:
     """_summary_
+    ------- raw hazards, checked for the instruction in ID -------
 
     Args:
-        instr (str): 32-bit binary string of the instruction
+        latch (IdEx): the instruction being decoded
+
+    Returns:
+        str: cause of the stall (see Forwarding), '' if it can go on
+    """
+    cause = ''
+    for reg, stage in operands(latch.name, latch.rs, latch.rt):
+        # nothing in flight writes it, the register file is up to date
+        if not scoreboard.pending(reg):
+            continue
+        producer_stage, producer = youngest_writer(reg)
+        if producer is not None:
+            cause = cause or forwarding.stall_cause(producer_stage,
+                                                    producer.mem_to_reg, stage)
+        if not cause and scoreboard.ready_cycle(reg):
+            cause = late_cause(scoreboard.ready_cycle(reg), stage, cycle)
+    return cause
+
+
+def late_cause(ready: int, stage: str, decoded: int) -> str:
     """
-    global alu_inp1, alu_inp2  # skipcq: PYL-W0603
+    stall cause of an instruction in ID in cycle `decoded` that uses the
+    value of a load that missed in a non-blocking cache. the value is
+    forwarded as if the load were in WB in cycle `ready`, wherever it is
+    """
+    wait = ready - decoded
+    if wait > 2:
+        return 'load_miss'
+    if wait < 0 or not forwarding.stall_cause(('wb', 'mem', 'ex')[wait], True, stage):
+        return ''
+    return 'load_miss'
 
-    # ------- for raw hazard of r-type instructions -------
-    # ex hazard:
-    if ex_mem['REG_WRITE'] and ex_mem['RD'] != '00000' and ex_mem['RD'] == instr[6:11]:
-        alu_inp1 = ex_mem['RDVAL']
 
+def forward(reg: int, val: str) -> str:
+    """
+    ------- forwarding mux in front of EX -------
+    the youngest older writer of `reg` wins, a load in EX/MEM has no value
+    yet (the hazard unit made sure it is not needed or comes via mem_mem)
+    """
+    if not reg or not scoreboard.pending(reg):
+        return val
+    # ex hazard:
+    ex = writer_in(EX_MEM, reg)
+    if ex is not None:
+        if forwarding['ex_ex'] and not ex.mem_to_reg:
+            forwarding.use('ex_ex')
+            return ex.alu_out
+        return val
     # mem hazard:
-    elif mem_wb['REG_WRITE'] and mem_wb['RD'] != '00000' and mem_wb['RD'] == instr[6:11]:
-        alu_inp1 = mem_wb['RDVAL']
+    wb = writer_in(MEM_WB, reg)
+    if forwarding['mem_ex'] and wb is not None:
+        forwarding.use('mem_ex')
+        return wb_value(wb)
+    return val
 
-    # ex hazard:
-    if ex_mem['REG_WRITE'] and ex_mem['RD'] != '00000' and ex_mem['RD'] == instr[11:16]:
-        alu_inp2 = ex_mem['RDVAL']
 
-    # mem hazard:
-    elif mem_wb['REG_WRITE'] and mem_wb['RD'] != '00000' and mem_wb['RD'] == instr[11:16]:
-        alu_inp2 = mem_wb['RDVAL']
-    # ------- for raw hazard of load-use data hazard -------
-        # if id_ex['MEMREAD'] and id_ex['RT'] != '00000' and \
-        # (id_ex['RT'] == instr[6:11] or id_ex['RT'] == instr[11:16]):
-        #    # stall -> force control signals to 0. ex, mem, wb do no operation.
-        #      and prevent update of pc and if/id register (instruction will decode again)
-        #     id_ex['REGWRITE'] = 0
-        #     id_ex['MEMTOREG'] = 0
-        #     id_ex['MEMREAD'] = 0
-        #     id_ex['MEMWRITE'] = 0
-        #     id_ex['ALUOP'] = '00'  # no operation
-        #     id_ex['ALUSRC'] = 0
-        #     id_ex['PCWRITE'] = 0
-        #     id_ex['PCSRC'] = '00'  # no operation
-        #     id_ex['IFIDWRITE'] = 0
-        #     id_ex['PC'] = id_ex['PC'] - 4  # pc will not update
-        #     if_id['PC'] = if_id['PC'] - 4
-        #     print('---- stall ----')
-        #     return True
-
-        # # ------- branch hazard -------
-
-
-def update_if_id() -> None:
-    if_id['PC'] = sign_extend(pc, 32)
-    # get instruction from memory
-    inst = inst_mem[pc]
-    # update if_id
-    if_id['IR'] = inst
-    if_id['OPCODE'] = inst[:6]
-    if_id['RS'] = inst[6:11]
-    if_id['RT'] = inst[11:16]
-    if_id['RD'] = inst[16:21]
-    if_id['SHAMT'] = inst[21:26]
-    if_id['FUNCT'] = inst[26:32]
-
-
-def update_id_ex() -> None:
-    inst = if_id['IR']
-    # update id_ex
-    id_ex['IR'] = inst
-    id_ex['OPCODE'] = inst[:6]
-    id_ex['RS'] = inst[6:11]
-    id_ex['RT'] = inst[11:16]
-    id_ex['RD'] = inst[16:21]
-    id_ex['SHAMT'] = inst[21:26]
-    id_ex['FUNCT'] = inst[26:32]
-    id_ex['PC'] = if_id['PC']
-
-    # control signals
-    # execute instruction
-    try:
-        opcode = bin_to_inst_dict[(id_ex['OPCODE'], id_ex['FUNCT'])]
-    except KeyError:
-        opcode = bin_to_inst_dict[(id_ex['OPCODE'], 'xxxxxx')]
-    if inst == '0' * 32 or opcode == 'break':
-        id_ex['REG_DST'] = '0'
-        id_ex['ALU_SRC'] = '00'
-        id_ex['MEM_TO_REG'] = '0'
-        id_ex['ALUT_OP'] = '00'
-        id_ex['MEM_READ'] = '0'
-        id_ex['MEM_WRITE'] = '0'
-        id_ex['BRANCH'] = '0'
-        id_ex['REG_WRITE'] = '0'
-    elif is_rtype(opcode):
-        id_ex['REG_DST'] = '1'
-        id_ex['ALU_SRC'] = '00'
-        id_ex['MEM_TO_REG'] = '0'
-        id_ex['ALUT_OP'] = '10'
-        id_ex['MEM_READ'] = '0'
-        id_ex['MEM_WRITE'] = '0'
-        id_ex['BRANCH'] = '0'
-        id_ex['REG_WRITE'] = '1'
+def set_control(out: IdEx, opcode: str) -> None:
+    """
+    control signals of the main control unit
+    """
+    out.reg_dst = out.mem_to_reg = out.mem_read = out.mem_write = False
+    out.branch = out.reg_write = False
+    out.alu_src = out.alu_op = '00'
+    if out.ir == ZERO_WORD or opcode == 'break':
+        return
+    if is_rtype(opcode):
+        out.reg_dst = True
+        out.alu_op = '10'
+        # hi/lo of mult are not modelled
+        out.reg_write = opcode not in ('jr', 'mult')
+    elif is_branch(opcode):
+        out.alu_op = '01'
+        out.branch = True
     elif is_itype(opcode):
-        id_ex['REG_DST'] = '0'
-        id_ex['ALU_SRC'] = '01'
-        id_ex['MEM_TO_REG'] = '0'
-        id_ex['ALUT_OP'] = '00'
-        id_ex['MEM_READ'] = '0'
-        id_ex['MEM_WRITE'] = '0'
-        id_ex['BRANCH'] = '0'
-        id_ex['REG_WRITE'] = '1'
+        out.alu_src = '01'
+        out.reg_write = True
         if opcode == 'lw':
-            id_ex['MEM_TO_REG'] = '1'
-            id_ex['ALUT_OP'] = '00'
-            id_ex['MEM_READ'] = '1'
-            id_ex['MEM_WRITE'] = '0'
-            id_ex['REG_DST'] = '0'
+            out.mem_to_reg = True
+            out.mem_read = True
         elif opcode == 'sw':
-            id_ex['ALUT_OP'] = '00'
-            id_ex['MEM_READ'] = '0'
-            id_ex['MEM_WRITE'] = '1'
-            id_ex['REG_DST'] = '0'
-            id_ex['REG_WRITE'] = '0'
+            out.mem_write = True
+            out.reg_write = False
 
-    elif is_branch(opcode):
-        id_ex['REG_DST'] = '0'
-        id_ex['ALU_SRC'] = '00'
-        id_ex['MEM_TO_REG'] = '0'
-        id_ex['ALUT_OP'] = '01'
-        id_ex['MEM_READ'] = '0'
-        id_ex['MEM_WRITE'] = '0'
-        id_ex['BRANCH'] = '1'
-        id_ex['REG_WRITE'] = '0'
-
-
-def update_ex_mem() -> None:
-    # get instruction from id_ex
-    inst = id_ex['IR']
-    # update ex_mem
-    ex_mem['IR'] = inst
-    ex_mem['OPCODE'] = inst[:6]
-    ex_mem['RS'] = inst[6:11]
-    ex_mem['RT'] = inst[11:16]
-    ex_mem['RD'] = inst[16:21]
-    ex_mem['SHAMT'] = inst[21:26]
-    ex_mem['FUNCT'] = inst[26:32]
-    ex_mem['PC'] = id_ex['PC']
-
-    ex_mem['REG_DST'] = id_ex['REG_DST']
-    ex_mem['ALU_SRC'] = id_ex['ALU_SRC']
-    ex_mem['MEM_TO_REG'] = id_ex['MEM_TO_REG']
-    ex_mem['ALUT_OP'] = id_ex['ALUT_OP']
-    ex_mem['MEM_READ'] = id_ex['MEM_READ']
-    ex_mem['MEM_WRITE'] = id_ex['MEM_WRITE']
-    ex_mem['BRANCH'] = id_ex['BRANCH']
-    ex_mem['REG_WRITE'] = id_ex['REG_WRITE']
-    ex_mem['ALU_OUT'] = alu_out
-
-
-def update_mem_wb() -> None:
-    # get instruction from ex_mem
-    inst = ex_mem['IR']
-    # update mem_wb
-    mem_wb['IR'] = inst
-    mem_wb['OPCODE'] = inst[:6]
-    mem_wb['RS'] = inst[6:11]
-    mem_wb['RT'] = inst[11:16]
-    mem_wb['RD'] = inst[16:21]
-    mem_wb['SHAMT'] = inst[21:26]
-    mem_wb['FUNCT'] = inst[26:32]
-    mem_wb['PC'] = ex_mem['PC']
-
-    mem_wb['REG_DST'] = ex_mem['REG_DST']
-    mem_wb['ALU_SRC'] = ex_mem['ALU_SRC']
-    mem_wb['MEM_TO_REG'] = ex_mem['MEM_TO_REG']
-    mem_wb['ALUT_OP'] = ex_mem['ALUT_OP']
-    mem_wb['MEM_READ'] = ex_mem['MEM_READ']
-    mem_wb['MEM_WRITE'] = ex_mem['MEM_WRITE']
-    mem_wb['BRANCH'] = ex_mem['BRANCH']
-    mem_wb['REG_WRITE'] = ex_mem['REG_WRITE']
-    mem_wb['ALU_OUT'] = ex_mem['ALU_OUT']
-    mem_wb['RDVAL'] = ex_mem['RDVAL']
+
+def commit_latches() -> None:
+    """
+    clock edge: the register file and every pipeline register take the
+    values the stages produced in this cycle, all at once
+    """
+    global pc  # skipcq: PYL-W0603
+    for late in list(late_releases):
+        late_scoreboard, reg, writer, ready = late
+        if ready <= cycle:
+            late_scoreboard.release(reg, writer)
+            late_releases.remove(late)
+    for writer_regs, writer_scoreboard, reg, val, writer in reg_write_back:
+        writer_regs.set_bits(reg, val)
+        ready = writer_scoreboard.ready_cycle(reg, writer)
+        if ready > cycle:
+            late_releases.append((writer_scoreboard, reg, writer, ready))
+        else:
+            writer_scoreboard.release(reg, writer)
+    reg_write_back.clear()
+    for pipeline_reg in pipeline_regs:
+        pipeline_reg.commit()
+    pc = next_pc
+    for thread in threads:
+        if thread.tid != thread_id:
+            thread.pc = thread.next_pc
 
 
 # ************************** Fetch **************************
 
 def fetch() -> None:
-    # get instruction from memory
-    inst = inst_mem[pc]
+    """
+    fetch from next_pc, which is pc in the first lane of a packet and the
+    address behind the instruction fetched by the lane before in the others
+    """
+    global next_pc, fetch_seq  # skipcq: PYL-W0603
     text = colored('instruction fetched: ✅', 'yellow')
     print(text)
+    address = next_pc
+    if address >= program_end:
+        # past the last instruction, let the pipeline drain
+        print('bubble')
+        if_id.bubble()
+        return
+    if vm is not None:
+        # instructions live in their own memory, only the timing of the
+        # translation is modelled
+        wait_for_memory(vm.translate(address, cycle, data_cache, inst=True)[1], 'itlb')
+    # get instruction from memory
+    inst = inst_mem[address]
     print(inst)
-
-
-def is_rtype(name: str) -> bool:
-    return name in ['add', 'sub', 'and', 'or', 'xor', 'nor', 'slt', 'sll',
-                    'srl', 'jr', 'syscall', 'break', 'mult']
-
-
-def is_itype(name: str) -> bool:
-    return name in ['addi', 'andi', 'ori', 'xori', 'beq', 'bne', 'lw', 'sw']
-
-
-def is_branch(name: str) -> bool:
-    return name in ['beq', 'bne']
-
-
-def print_decoded_inst() -> None:
-    # get instruction from if_id
-    try:
-        opcode = bin_to_inst_dict[(if_id['OPCODE'], if_id['FUNCT'])]
-    except KeyError:
-        opcode = bin_to_inst_dict[(if_id['OPCODE'], 'xxxxxx')]
-
+    out = if_id.nxt
+    out.valid = True
+    out.pc = address
+    out.ir = inst
+    out.tid = thread_id
+    fetch_seq += 1
+    out.seq = fetch_seq
+    if timeline is not None:
+        timeline.fetch(out.seq, address, disassemble(inst), cycle)
+    next_pc = address + 1
+
+
+def print_decoded_inst(latch: IdEx) -> None:
     text = colored('instruction decoded: ✅', 'yellow')
     print(text)
-    if if_id['IR'] == '0'*32:
+    opcode = latch.name
+    if latch.ir == ZERO_WORD:
         print('nop')
     elif opcode == 'break':
         print('break')
     elif is_rtype(opcode):
-        print(opcode, bin_to_regname[if_id['RD']], bin_to_regname[if_id['RS']],
-              bin_to_regname[if_id['RT']])
-    elif is_itype(opcode):
-        print(opcode, bin_to_regname[if_id['RT']], bin_to_regname[if_id['RS']],
-              sign_extend(bin_to_int_signed(if_id['IR'][16:], 16), 16))
+        print(opcode, f'${latch.rd}', f'${latch.rs}', f'${latch.rt}')
     elif is_branch(opcode):
-        print(opcode, bin_to_regname[if_id['RS']], bin_to_regname[if_id['RT']],
-              sign_extend(bin_to_int_signed(if_id['IR'][16:], 16), 16))
+        print(opcode, f'${latch.rs}', f'${latch.rt}', sign_extend(latch.imm, 16))
+    elif is_itype(opcode):
+        print(opcode, f'${latch.rt}', f'${latch.rs}', sign_extend(latch.imm, 16))
 
 
 # ************************** Decode **************************
-def decode() -> None:
-    print_decoded_inst()
+def decode() -> str:
+    """
+    decode the instruction of the bound lane and check its hazards
 
+    Returns:
+        str: cause of the stall it needs, '' if it can go on
+    """
+    latch = if_id.cur
+    out = id_ex.nxt
+    if not latch.valid:
+        print(colored('instruction decoded: ✅', 'yellow'))
+        print('bubble')
+        id_ex.bubble()
+        return ''
+
+    bind(latch.tid)
+    if timeline is not None:
+        timeline.stage(latch.seq, 'ID', cycle)
+    # the fields are sliced out of the instruction once, here
+    inst = latch.ir
+    out.valid = True
+    out.pc = latch.pc
+    out.seq = latch.seq
+    out.tid = latch.tid
+    out.ir = inst
+    out.name = inst_name(inst)
+    out.rs = int(inst[6:11], 2)
+    out.rt = int(inst[11:16], 2)
+    out.rd = int(inst[16:21], 2)
+    out.shamt = int(inst[21:26], 2)
+    out.imm = bin_to_int_signed(inst[16:], 16)
+    set_control(out, out.name)
+    out.dest = (out.rd if out.reg_dst else out.rt) if out.reg_write else 0
+    if out.name == 'syscall':
+        # writes $v0, unchanged if the service returns nothing
+        out.dest = 2
+        # a syscall works on memory in EX, the older stores must be done.
+        # with threads an older load may still be replayed from MEM
+        older = lane_regs(ID_EX) + (lane_regs(EX_MEM) if threads else [])
+        if any(older_reg.cur.valid and older_reg.cur.tid == thread_id
+               for older_reg in older):
+            return 'syscall'
+    return hazard_detection(out)
+
+
+def read_operands() -> None:
+    """
+    the instruction decoded in the bound lane goes on: read its registers
+    and reserve its destination
+    """
+    out = id_ex.nxt
+    if not out.valid:
+        return
+    bind(out.tid)
+    # the values read in ID that come from WB
+    for reg, _ in operands(out.name, out.rs, out.rt):
+        if scoreboard.pending(reg) and youngest_writer(reg)[0] == 'wb':
+            forwarding.use('wb_id')
+    out.rs_val = read_reg(out.rs)
+    out.rt_val = read_reg(out.rt)
+    scoreboard.reserve(out.dest, out.pc)
+    print_decoded_inst(out)
+
+
+def decode_packet() -> None:
+    """
+    ID of every lane. the packet goes on or stalls as a whole, so packets
+    stay together and the limits they were formed with hold in every stage
+    """
+    causes = []
+    for index in range(len(lanes)):
+        bind_lane(index)
+        causes.append(decode())
+    cause = next((cause for cause in causes if cause), '')
+    if not cause:
+        for index in range(len(lanes)):
+            bind_lane(index)
+            read_operands()
+        return
+    stall_packet(cause, lanes[causes.index(cause)][IF_ID].cur.seq)
 
-# ************************** Execute **************************
 
-def ex_rtype(inst: str, opcode: str) -> None:
-    global alu_inp1, alu_inp2, alu_out  # skipcq: PYL-W0603
+def stall_packet(cause: str, seq: int) -> None:
+    """
+    stall -> bubbles go to EX, the packet in ID is decoded again and the
+    one fetched this cycle is fetched again. `seq` is the instruction that
+    waits
+    """
+    global stall_count  # skipcq: PYL-W0603
+    print(colored('instruction decoded: ✅', 'yellow'))
+    print('---- stall ----', cause)
+    forwarding.stall(cause)
+    stall_count += 1
+    if timeline is not None:
+        timeline.stall(cause, cycle, seq=seq)
+    # youngest lane first, the oldest instruction of a thread is fetched first
+    for if_id_reg, id_ex_reg in reversed([regs[:2] for regs in lanes]):
+        if if_id_reg.nxt.valid:
+            if timeline is not None:
+                # fetched again next cycle
+                timeline.discard(if_id_reg.nxt.seq)
+            redirect(if_id_reg.nxt.tid, if_id_reg.nxt.pc)
+        id_ex_reg.bubble()
+        if_id_reg.hold()
 
-    # binary should be passed to alu
-    if type(reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val) is int:
-        alu_inp1 = sign_extend(
-            reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val, 32)
-        alu_inp2 = sign_extend(
-            reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val, 32)
 
-    # if binary, no need to do anything
-    if type(reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val) is str:
-        alu_inp1 = reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val
-        alu_inp2 = reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val
+# ************************** Execute **************************
 
-    hazard_detection(inst)
+def ex_rtype(latch: IdEx, alu_inp1: str, alu_inp2: str) -> str:
+    alu_out = ZERO_WORD
 
-    rd = bin_to_regname[inst[16:21]]
-    rs = bin_to_regname[inst[6:11]]
-    rt = bin_to_regname[inst[11:16]]
+    opcode = latch.name
+    rd, rs, rt = f'${latch.rd}', f'${latch.rs}', f'${latch.rt}'
     if opcode == 'add':
         alu_out = alu.add(alu_inp1, alu_inp2)
         print('add', rd, rs, rt, '=', alu_out)
@@ -458,167 +680,407 @@ def ex_rtype(inst: str, opcode: str) -> None:
     elif opcode == 'nor':
         alu_out = alu.nor(alu_inp1, alu_inp2)
         print('nor', rd, rs, rt)
+    elif opcode == 'slt':
+        alu_out = alu.slt(alu_inp1, alu_inp2)
+        print('slt', rd, rs, rt, '=', alu_out)
     elif opcode == 'mult':
         alu_out = alu.mult(alu_inp1, alu_inp2)
         print('mult', rs, rt)
 
     elif opcode == 'sll':
-        alu_out = alu.sll(alu_inp1, bin_to_int_unsigned(inst[21:26]))
-        print('sll', rd, bin_to_regname[inst[11:16]],
-              bin_to_int_unsigned(inst[21:26]))
+        alu_out = alu.sll(alu_inp2, latch.shamt)
+        print('sll', rd, rt, latch.shamt)
 
     elif opcode == 'srl':
-        alu_out = alu.srl(alu_inp1, bin_to_int_unsigned(inst[21:26]))
-        print('srl', rd, bin_to_regname[inst[11:16]],
-              bin_to_int_unsigned(inst[21:26]))
-    ex_mem['RDVAL'] = alu_out
-
+        alu_out = alu.srl(alu_inp2, latch.shamt)
+        print('srl', rd, rt, latch.shamt)
+    return alu_out
 
-def ex_itype(inst: str, opcode: str) -> None:
-    global alu_inp1, alu_inp2, alu_out  # skipcq: PYL-W0603
-    if type(reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val) is int:
-        alu_inp1 = sign_extend(
-            reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val, 32)
-    if type(reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val) is str:
-        alu_inp1 = reg_file[f'${bin_to_int_unsigned(inst[6:11])}'].val
 
-    alu_inp2 = sign_extend(
-        bin_to_int_signed(inst[16:], 16), 32)
+def ex_itype(latch: IdEx, alu_inp1: str) -> str:
+    opcode = latch.name
+    alu_inp2 = sign_extend(latch.imm, 32)
+    if opcode in ('andi', 'ori', 'xori'):
+        # logical immediates are zero extended
+        alu_inp2 = '0' * 16 + alu_inp2[16:]
+    alu_out = ZERO_WORD
 
+    rt, rs, imm = f'${latch.rt}', f'${latch.rs}', latch.imm
     if opcode == 'addi':
         alu_out = alu.add(alu_inp1, alu_inp2)
-        print('addi', bin_to_regname[inst[11:16]], bin_to_regname[inst[6:11]],
-              bin_to_int_signed(inst[16:], 16), '=', alu_out)
+        print('addi', rt, rs, imm, '=', alu_out)
     elif opcode == 'andi':
         alu_out = alu.and_(alu_inp1, alu_inp2)
-        print('andi', bin_to_regname[inst[11:16]], bin_to_regname[inst[6:11]],
-              bin_to_int_signed(inst[16:], 16), '=', alu_out)
+        print('andi', rt, rs, imm, '=', alu_out)
     elif opcode == 'ori':
         alu_out = alu.or_(alu_inp1, alu_inp2)
-        print('ori', bin_to_regname[inst[11:16]], bin_to_regname[inst[6:11]],
-              bin_to_int_signed(inst[16:], 16), '=', alu_out)
+        print('ori', rt, rs, imm, '=', alu_out)
     elif opcode == 'xori':
         alu_out = alu.xor(alu_inp1, alu_inp2)
-        print('xori', bin_to_regname[inst[11:16]], bin_to_regname[inst[6:11]],
-              bin_to_int_signed(inst[16:], 16), '=', alu_out)
+        print('xori', rt, rs, imm, '=', alu_out)
 
     elif opcode == 'lw':
         alu_out = alu.add(alu_inp1, alu_inp2)
-        print('lw', bin_to_regname[inst[11:16]], bin_to_int_signed(inst[16:], 16),
-              '(', bin_to_regname[inst[6:11]], ')', 'address =>', alu_out)
+        print('lw', rt, imm, '(', rs, ')', 'address =>', alu_out)
     elif opcode == 'sw':
         alu_out = alu.add(alu_inp1, alu_inp2)
-        print('sw', bin_to_regname[inst[11:16]], bin_to_int_signed(inst[16:], 16),
-              '(', bin_to_regname[inst[6:11]], ')', 'address =>', alu_out)
-    elif opcode == 'beq':
-        if alu_inp1 == alu_inp2:
-            id_ex['BRANCH'] = '1'
-            print('beq', bin_to_regname[inst[6:11]], bin_to_regname[inst[11:16]],
-                  bin_to_int_signed(inst[16:], 16), '=> branch taken')
-        else:
-            id_ex['BRANCH'] = '0'
-            print('beq', bin_to_regname[inst[6:11]], bin_to_regname[inst[11:16]],
-                  bin_to_int_signed(inst[16:], 16), '=> branch not taken')
-    ex_mem['RDVAL'] = alu_out
+        print('sw', rt, imm, '(', rs, ')', 'address =>', alu_out)
+    return alu_out
 
 
-def execute() -> None:
-    inst = id_ex['IR']
+def flush_younger(target: int) -> None:
+    """
+    squash the instructions of the bound thread in IF and ID and fetch
+    from `target` next, the ones decoded give their destination back
+    """
+    global next_pc  # skipcq: PYL-W0603
+    for if_id_reg, id_ex_reg in (regs[:2] for regs in lanes):
+        if timeline is not None:
+            for squashed in {if_id_reg.cur, if_id_reg.nxt}:
+                if squashed.valid and squashed.tid == thread_id:
+                    timeline.flush(squashed.seq, cycle)
+        if if_id_reg.nxt.tid == thread_id:
+            if_id_reg.bubble()
+        if id_ex_reg.nxt.tid == thread_id:
+            if id_ex_reg.nxt.valid:
+                scoreboard.cancel(id_ex_reg.nxt.dest, id_ex_reg.nxt.pc)
+            id_ex_reg.bubble()
+    next_pc = target
+
+
+def stop_program(latch: IdEx) -> None:
+    """
+    exit syscall or break in EX, nothing after it runs and the pipeline drains
+    """
+    global program_end  # skipcq: PYL-W0603
+    flush_younger(latch.pc + 1)
+    program_end = latch.pc + 1
 
-    try:
-        opcode = bin_to_inst_dict[(id_ex['OPCODE'], id_ex['FUNCT'])]
-    except KeyError:
-        opcode = bin_to_inst_dict[(id_ex['OPCODE'], 'xxxxxx')]
+
+def ex_syscall(latch: IdEx) -> str:
+    """
+    run the service selected by $v0 on the host. the decode stage holds a
+    syscall until EX is empty, so every older store is done by now and its
+    arguments are in the register file or on the MEM/WB forwarding path
+    """
+    v0 = forward(2, reg_file.bits(2))
+    a0, a1, a2 = (int(forward(reg, reg_file.bits(reg)), 2) for reg in (4, 5, 6))
+    result = syscalls.call(int(v0, 2), a0, a1, a2, CacheMemory(data_cache))
+    print('syscall', int(v0, 2), '=>', result)
+    if syscalls.exited:
+        stop_program(latch)
+    return v0 if result is None else f'{result:032b}'
+
+
+def ex_branch(latch: IdEx, alu_inp1: str, alu_inp2: str) -> str:
+    """
+    branches are resolved in EX, a taken branch flushes the instructions
+    in IF and ID and redirects fetch to pc + 1 + offset
+    """
+    global branches, branch_flushes  # skipcq: PYL-W0603
+    branches += 1
+    taken = alu_inp1 == alu_inp2
+    if latch.name == 'bne':
+        taken = not taken
+    print(latch.name, f'${latch.rs}', f'${latch.rt}', latch.imm,
+          '=> branch taken' if taken else '=> branch not taken')
+    if taken:
+        flush_younger(latch.pc + 1 + latch.imm)
+        branch_flushes += 1
+    return ZERO_WORD
+
+
+def execute() -> None:
+    latch = id_ex.cur
+    out = ex_mem.nxt
 
     text = colored('execution', 'yellow')
     print(text)
-    if inst == '0' * 32:
+    if not latch.valid:
+        print('bubble')
+        ex_mem.bubble()
+        return
+
+    bind(latch.tid)
+    if timeline is not None:
+        timeline.stage(latch.seq, 'EX', cycle)
+    opcode = latch.name
+    srcs = [reg for reg, _ in operands(opcode, latch.rs, latch.rt)]
+    alu_inp1 = forward(latch.rs, latch.rs_val) if latch.rs in srcs else latch.rs_val
+    alu_inp2 = forward(latch.rt, latch.rt_val) if latch.rt in srcs else latch.rt_val
+    alu_out = ZERO_WORD
+    if latch.ir == ZERO_WORD:
         print('nop')
 
     elif opcode == 'break':
         print('break')
+        stop_program(latch)
 
+    elif opcode == 'syscall':
+        alu_out = ex_syscall(latch)
     elif is_rtype(opcode):
-        ex_rtype(inst, opcode)
-    elif is_itype(opcode):
-        ex_itype(inst, opcode)
+        alu_out = ex_rtype(latch, alu_inp1, alu_inp2)
     elif is_branch(opcode):
-        # branch(opcode)
-        pass
+        alu_out = ex_branch(latch, alu_inp1, alu_inp2)
+    elif is_itype(opcode):
+        alu_out = ex_itype(latch, alu_inp1)
+
+    out.valid = True
+    out.pc = latch.pc
+    out.seq = latch.seq
+    out.tid = latch.tid
+    out.ir = latch.ir
+    out.name = opcode
+    out.rs, out.rt, out.rd, out.imm = latch.rs, latch.rt, latch.rd, latch.imm
+    out.dest = latch.dest
+    out.mem_to_reg = latch.mem_to_reg
+    out.mem_read = latch.mem_read
+    out.mem_write = latch.mem_write
+    out.reg_write = latch.reg_write
+    out.alu_out = alu_out
+    out.store_val = alu_inp2
 
 
 # ************************** Memory **************************
 
 def working_with_cache() -> None:
-    inst = ex_mem['IR']
-    try:
-        opcode = bin_to_inst_dict[(ex_mem['OPCODE'], ex_mem['FUNCT'])]
-    except KeyError:
-        opcode = bin_to_inst_dict[(ex_mem['OPCODE'], 'xxxxxx')]
+    latch = ex_mem.cur
+    out = mem_wb.nxt
 
     text = colored('working with cache/mem:', 'yellow')
     print(text)
+    if not latch.valid:
+        print('bubble')
+        mem_wb.bubble()
+        return
+
+    bind(latch.tid)
+    if timeline is not None:
+        timeline.stage(latch.seq, 'MEM', cycle)
+    opcode = latch.name
+    rt, rs, imm = f'${latch.rt}', f'${latch.rs}', latch.imm
+    out.mem_out = ZERO_WORD
     if opcode == 'lw':
-        ex_mem['ALU_OUT'] = data_cache[alu_out]
-        print('lw', bin_to_regname[inst[11:16]], bin_to_int_signed(inst[16:], 16),
-              '(', bin_to_regname[inst[6:11]], ')', 'value: ', ex_mem['ALU_OUT'])
+        address, start = data_address(latch)
+        ready = data_cache.access(address, start, pc=latch.pc)
+        out.mem_out = data_cache[address]
+        if threads:
+            if ready > cycle and threads[thread_id].replayed != latch.pc:
+                replay(latch, ready)
+                return
+            threads[thread_id].replayed = None
+        wait_for_memory(load_done(latch, ready))
+        print('lw', rt, imm, '(', rs, ')', 'value: ', out.mem_out)
 
     elif opcode == 'sw':
-        data_cache[alu_out] = sign_extend(
-            reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val, 32)
-        ex_mem['ALU_OUT'] = sign_extend(
-            reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val, 32)
-        print('sw:', '\nin location:', bin_to_int_signed(inst[16:], 16), ', value:',
-              reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val, 'must be saved')
+        store_val = latch.store_val
+        wb = writer_in(MEM_WB, latch.rt)
+        # mem_mem: the value of a load (or of an ALU result EX could not
+        # take) right in front of the store
+        if forwarding['mem_mem'] and latch.rt and wb is not None and \
+                (wb.mem_to_reg or not forwarding['ex_ex']):
+            forwarding.use('mem_mem')
+            store_val = wb_value(wb)
+        address, start = data_address(latch)
+        wait_for_memory(data_cache.access(address, start, is_write=True,
+                                          pc=latch.pc))
+        data_cache[address] = store_val
+        out.mem_out = store_val
+        print('sw:', '\nin location:', imm, ', value:', store_val,
+              'must be saved')
 
     else:
         print('no cache needed for this instruction 🙄')
 
+    out.valid = True
+    out.pc = latch.pc
+    out.seq = latch.seq
+    out.tid = latch.tid
+    out.ir = latch.ir
+    out.name = opcode
+    out.rs, out.rt, out.rd, out.imm = latch.rs, latch.rt, latch.rd, latch.imm
+    out.dest = latch.dest
+    out.mem_to_reg = latch.mem_to_reg
+    out.mem_read = latch.mem_read
+    out.mem_write = latch.mem_write
+    out.reg_write = latch.reg_write
+    out.alu_out = latch.alu_out
+
+
+def load_done(latch: ExMem, ready: int) -> int:
+    """
+    cycle the pipeline has to wait for after the load in MEM: the one its
+    cache took it in. a miss of a non-blocking cache only makes the
+    instructions using the value wait, the ones in ID stall until it is
+    there. a packet decoded in this cycle stalls in ID after all, a store
+    of the value in EX (mem_mem) waits in EX/MEM (hold_packets)
+    """
+    global held_until, held_seq  # skipcq: PYL-W0603
+    resume = data_cache.accepted
+    if ready <= max(cycle + 1, resume):
+        return resume
+    print('miss, value ready in cycle', ready)
+    scoreboard.delay(latch.dest, latch.pc, ready)
+    # nothing was squashed in ID this cycle, so it can be done again
+    redecode = all(regs[IF_ID].cur.valid == regs[ID_EX].nxt.valid for regs in lanes)
+    # oldest first, until one of them writes the register itself
+    younger_insts = [(pipeline_reg.nxt, cycle - 1) for pipeline_reg in lane_regs(EX_MEM)] + \
+        [(pipeline_reg.nxt, cycle) for pipeline_reg in lane_regs(ID_EX)]
+    for younger, decoded in younger_insts:
+        if not younger.valid or younger.tid != thread_id:
+            continue
+        for reg, stage in operands(younger.name, younger.rs, younger.rt):
+            if reg != latch.dest:
+                continue
+            could_pass = decoded
+            while late_cause(ready, stage, could_pass):
+                could_pass += 1
+            needed = could_pass + 1 + cycle - decoded
+            if needed > resume and decoded < cycle:
+                # the store does MEM in cycle `needed`
+                if needed > held_until:
+                    held_until, held_seq = needed, younger.seq
+                continue
+            if needed > resume and redecode:
+                undecode()
+                stall_packet('load_miss', younger.seq)
+                return resume
+            resume = max(resume, needed)
+        if younger.reg_write and younger.dest == latch.dest:
+            break
+    return resume
+
+
+def hold_packets() -> None:
+    """
+    a cycle of a store waiting in EX/MEM for the value of a load that
+    missed: MEM sends a bubble, WB goes on and the instructions in EX/MEM,
+    ID/EX and IF/ID stay. those take the values WB writes meanwhile, they
+    would have had them forwarded in the cycle after they got there
+    """
+    global stall_count  # skipcq: PYL-W0603
+    print('---- stall ----', 'load_miss')
+    forwarding.stall('load_miss')
+    stall_count += 1
+    if timeline is not None:
+        timeline.stall('load_miss', cycle, seq=held_seq)
+    for index in range(len(lanes)):
+        bind_lane(index)
+        write_back()
+    for writer in (pipeline_reg.cur for pipeline_reg in lane_regs(MEM_WB)):
+        if not (writer.valid and writer.reg_write and writer.dest):
+            continue
+        for waiting in (pipeline_reg.cur for pipeline_reg in lane_regs(ID_EX)):
+            if waiting.valid and waiting.tid == writer.tid:
+                if waiting.rs == writer.dest:
+                    waiting.rs_val = wb_value(writer)
+                if waiting.rt == writer.dest:
+                    waiting.rt_val = wb_value(writer)
+        for waiting in (pipeline_reg.cur for pipeline_reg in lane_regs(EX_MEM)):
+            if waiting.valid and waiting.tid == writer.tid and \
+                    waiting.mem_write and waiting.rt == writer.dest:
+                forwarding.use('mem_mem')
+                waiting.store_val = wb_value(writer)
+    for if_id_reg, id_ex_reg, ex_mem_reg, mem_wb_reg in lanes:
+        if_id_reg.hold()
+        id_ex_reg.hold()
+        ex_mem_reg.hold()
+        mem_wb_reg.bubble()
+
+
+def undecode() -> None:
+    """
+    the packet decoded this cycle gives its destination registers back, it
+    is decoded again
+    """
+    for pipeline_reg in reversed(lane_regs(ID_EX)):
+        decoded = pipeline_reg.nxt
+        if decoded.valid:
+            (threads[decoded.tid].scoreboard if threads else scoreboard).cancel(
+                decoded.dest, decoded.pc)
+
+
+def replay(latch: ExMem, ready: int) -> None:
+    """
+    with threads a load that misses leaves the pipeline together with the
+    younger instructions of its thread, the thread fetches it again once
+    the line is there in `ready` and the others go on meanwhile. their
+    scoreboard reservations are cancelled, they reserve again in ID
+    """
+    print('miss, thread', thread_id, 'parked until', ready)
+    mem_wb.bubble()
+    # the younger lanes of its packet have not been in MEM yet, the
+    # instructions in IF have not reserved anything
+    decoded = [regs[EX_MEM].cur for regs in lanes[lane + 1:]]
+    for index in (EX_MEM, ID_EX):
+        decoded += [pipeline_reg.nxt for pipeline_reg in lane_regs(index)]
+    fetched = [pipeline_reg.nxt for pipeline_reg in lane_regs(IF_ID)]
+    # youngest first, a pc in flight twice cancels its younger reservation
+    for younger in reversed(decoded + fetched):
+        if younger.valid and younger.tid == thread_id:
+            if timeline is not None:
+                timeline.flush(younger.seq, cycle)
+            if younger in decoded:
+                scoreboard.cancel(younger.dest, younger.pc)
+            younger.valid = False
+            younger.ir = ZERO_WORD
+    scoreboard.cancel(latch.dest, latch.pc)
+    if timeline is not None:
+        timeline.flush(latch.seq, cycle)
+    redirect(thread_id, latch.pc)
+    assert scheduler is not None
+    scheduler.park(thread_id, latch.pc, ready)
+
 
 # ************************** Write Back **************************
 
 def write_back() -> None:
-    inst = mem_wb['IR']
-
-    try:
-        opcode = bin_to_inst_dict[(mem_wb['OPCODE'], mem_wb['FUNCT'])]
-    except KeyError:
-        opcode = bin_to_inst_dict[(mem_wb['OPCODE'], 'xxxxxx')]
+    global retired  # skipcq: PYL-W0603
+    latch = mem_wb.cur
     text = colored('write_back_opcode:', 'yellow')
 
-    if inst == '0' * 32:
+    if not latch.valid:
+        print(text, 'bubble')
+        return
+    retired += 1
+    if threads:
+        bind(latch.tid)
+        threads[thread_id].retired += 1
+        threads[thread_id].last_retire = cycle
+    if timeline is not None:
+        timeline.retire(latch.seq, cycle)
+    if cosim is not None:
+        cosim.retire((latch.pc,
+                      (latch.dest, int(wb_value(latch), 2))
+                      if latch.reg_write and latch.dest else None,
+                      (int(latch.alu_out, 2), int(latch.mem_out, 2))
+                      if latch.mem_write else None), cycle)
+    opcode = latch.name
+    rt, rs, imm = f'${latch.rt}', f'${latch.rs}', latch.imm
+    if latch.ir == ZERO_WORD:
         print(text, 'nop')
     elif opcode == 'break':
         print(text, 'break')
 
     else:
         print(text, opcode)
-        if mem_wb['MEM_TO_REG'] == '1':
-            reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val = mem_wb['ALU_OUT']
-            print('lw', bin_to_regname[inst[11:16]], bin_to_int_signed(inst[16:], 16),
-                  '(', bin_to_regname[inst[6:11]], ')', '=', mem_wb['ALU_OUT'])
-        elif mem_wb['REG_WRITE'] == '1':
-            if is_itype(opcode):
-                reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val = mem_wb['ALU_OUT']
-                print('reg file updated ✅:',
-                      bin_to_regname[inst[11:16]], '=', mem_wb['ALU_OUT'])
-            if is_rtype(opcode):
-                reg_file[f'${bin_to_int_unsigned(inst[16:21])}'].val = mem_wb['ALU_OUT']
-                print('reg file updated ✅:',
-                      bin_to_regname[inst[16:21]], '=', mem_wb['ALU_OUT'])
-
-        elif mem_wb['MEM_READ'] == '1':
-            print('lw', bin_to_regname[inst[11:16]], bin_to_int_signed(inst[16:], 16),
-                  '(', bin_to_regname[inst[6:11]], ')', '=', mem_wb['ALU_OUT'])
-        elif mem_wb['MEM_WRITE'] == '1':
-            print('sw:', '\nin location:', bin_to_int_signed(inst[16:], 16), ', value:',
-                  reg_file[f'${bin_to_int_unsigned(inst[11:16])}'].val, ' saved')
+        if latch.reg_write and latch.dest:
+            reg_write_back.append((reg_file, scoreboard, latch.dest,
+                                   wb_value(latch), latch.pc))
+            if latch.mem_to_reg:
+                print('lw', rt, imm, '(', rs, ')', '=', latch.mem_out)
+            else:
+                print('reg file updated ✅:', f'${latch.dest}', '=', latch.alu_out)
+
+        elif latch.mem_write:
+            print('sw:', '\nin location:', imm, ', value:',
+                  latch.mem_out, ' saved')
         elif opcode == 'jr':
-            print('jr', bin_to_regname[inst[6:11]])
+            print('jr', rs)
         elif opcode == 'jal':
-            print('jal', bin_to_regname[inst[6:11]])
+            print('jal', rs)
         elif opcode == 'j':
-            print('j', bin_to_regname[inst[6:11]])
+            print('j', rs)
 
 
 # *********************** main ***********************
@@ -648,57 +1110,229 @@ def _license() -> None:
     input('Enter any key to back to menu: ')
 
 
-def _simulate() -> None:
-    global pc  # skipcq: PYL-W0603
-    try:
-        with open('instructions.txt', 'r', encoding='utf-8') as f:
-            inst_i = 0
-            for line in f:
-                inst_mem[inst_i] = line.strip()
-                inst_i += 1
-    except FileNotFoundError:
-        print('file not found')
-        return
-    except Exception as _:
-        print('something went wrong')
+def load_program(path: str = 'instructions.txt') -> list[str]:
+    """
+    read a program, one 32-bit binary instruction per line
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
 
-    pc_write = if_id_write = True
 
-    inst_count = inst_i + 1
-    pipeline_stage_no = 5
-    total_pipeline_clocks = inst_count + pipeline_stage_no - 1
+def reset_state() -> None:
+    """
+    put pc, registers, pipeline registers and the data cache back to their
+    power-on state so several programs can run in one process
+    """
+    global pc, next_pc, stall_count  # skipcq: PYL-W0603
+    global cycle, program_end, retired, branches, branch_flushes  # skipcq: PYL-W0603
+    global fetch_seq, held_until, held_seq  # skipcq: PYL-W0603
+    if 'data_cache' not in globals():
+        use_data_cache(shared('data_cache'))
+    if threads:
+        # the state of thread 0 is the one of a single-thread run
+        bind(0)
+        threads.clear()
+    pc = next_pc = stall_count = 0
+    program_end = retired = branches = branch_flushes = fetch_seq = 0
+    held_until = held_seq = 0
+    reg_write_back.clear()
+    late_releases.clear()
+    cycle = 0
+    events.reset()
+    reg_file.reset()
+    scoreboard.reset()
+    forwarding.reset()
+    syscalls.reset()
+    for pipeline_reg in pipeline_regs:
+        pipeline_reg.reset()
+    data_cache.reset()
+    if vm is not None:
+        vm.reset()
+    inst_mem.clear()
+
+
+def run_program(program: list[str], dump_cache: bool = False,
+                issue_width: int = 1, max_cycles: int = 0,
+                progress: Optional[Callable[[int, int], None]] = None,
+                progress_cycles: int = 10000, max_instructions: int = 0,
+                start_pc: int = 0,
+                registers: Optional[list[int]] = None) -> dict[str, float]:
+    """
+    run a program through the pipeline from a clean state
+
+    Args:
+        program (list[str]): 32-bit binary instructions
+        dump_cache (bool): append the data cache to data_cache.txt every cycle
+        issue_width (int): instructions fetched per cycle (1, 2 or 4)
+        max_cycles (int): stop after this many cycles, 0 for no limit
+        progress (Callable[[int, int], None]): called with the cycle and the
+            retired instruction count every `progress_cycles` cycles
+        max_instructions (int): stop once this many instructions retired,
+            0 for no limit
+        start_pc (int), registers (list[int]): architectural state to start
+            from, e.g. a checkpoint taken by the golden model. the memory
+            is the one of the data cache
+
+    with use_threads() the program holds the programs of all hardware
+    threads one after the other, start_pc and registers are the ones of
+    thread 0
+
+    Returns:
+        dict[str, float]: cycle and retired instruction counts, stalls, the
+            throughput, the forwarding and syscall counters and the data
+            cache statistics
+    """
+    global stall_count, cycle, program_end, pc, next_pc  # skipcq: PYL-W0603
+    reset_state()
+    use_lanes(issue_width)
+    for inst_i, inst in enumerate(program):
+        inst_mem[inst_i] = inst
+    pc = next_pc = start_pc
+    for reg, val in enumerate(registers or []):
+        reg_file[reg] = val
+
+    program_end = len(program)
+    if scheduler is not None:
+        if cosim is not None:
+            raise ValueError('co-simulation checks a single thread')
+        threads.extend(scheduler.start(reg_file, scoreboard, syscalls))
+        threads[0].pc = threads[0].next_pc = start_pc
+        program_end = threads[0].program_end
+    if cosim is not None:
+        cosim.start(program, data_cache.mem, syscalls)
+    if metrics is not None:
+        metrics.start(counters())
     cycle_seperator = colored('==================', 'magenta')
     stage_seperator = colored('------------------', 'green')
-    k = 0
-    while k < total_pipeline_clocks + stall_count:
-        if pc_write and if_id_write:
-            fetch()
+    issue_unit = IssueUnit(issue_width) if issue_width > 1 else None
+    mem_ports = max(issue_unit.mem_ports if issue_unit is not None else 1,
+                    scheduler.mem_ports if scheduler is not None else 1)
+    truncated = False
+    next_progress = progress_cycles
+    # seq of the first instruction of a packet the issue unit formed ->
+    # the instructions it was formed from, counted once it leaves ID
+    formed: dict[int, list[str]] = {}
+    # until the pc ran off the program and the pipeline is drained
+    while fetching() or any(reg.cur.valid for reg in pipeline_regs):
+        if (max_cycles and cycle >= max_cycles) or \
+                (max_instructions and retired >= max_instructions):
+            truncated = True
+            break
+        if progress is not None and cycle >= next_progress:
+            progress(cycle, retired)
+            next_progress = cycle + progress_cycles
+        if metrics is not None and cycle >= metrics.next_cycle:
+            metrics.sample(counters())
+        # waiting for the data cache, no stage can advance until the
+        # access completes: jump there and count the cycles as stalls
+        resume = events.skip(cycle)
+        if timeline is not None and resume > cycle:
+            timeline.stall('memory', cycle, resume - cycle)
+        stall_count += resume - cycle
+        cycle = resume
+        if cycle < held_until:
+            hold_packets()
+        else:
+            # the packet fetched this cycle, the thread of every lane
+            fetchers: list[Optional[int]] = [thread_id]
+            if threads:
+                assert scheduler is not None
+                fetchers = scheduler.select(cycle, issue_width, inst_mem)
+                if fetchers[0] is not None:
+                    bind(fetchers[0])
+            window: list[str] = []
+            if issue_unit is not None and pc < program_end and len(fetchers) == 1 and \
+                    fetchers[0] is not None:
+                window = [inst_mem[pc + i] for i in range(min(issue_width, program_end - pc))]
+                fetchers *= issue_unit.packet(window)
+            fetchers += [None] * (len(lanes) - len(fetchers))
+            for index, fetcher in enumerate(fetchers):
+                bind_lane(index)
+                if fetcher is None:
+                    # an empty slot, or every thread is parked or done
+                    print('bubble')
+                    if_id.bubble()
+                else:
+                    bind(fetcher)
+                    fetch()
+            if window and lanes[0][IF_ID].nxt.valid:
+                formed[lanes[0][IF_ID].nxt.seq] = window
             print(stage_seperator)
 
-            decode()
+            decode_packet()
             print(stage_seperator)
 
-            execute()
+            for index in range(len(lanes)):
+                bind_lane(index)
+                execute()
             print(stage_seperator)
 
-            working_with_cache()
+            # packets stay together, so the memory port limit they were formed
+            # with holds here
+            assert sum(pipeline_reg.cur.valid and pipeline_reg.cur.name in MEMORY
+                       for pipeline_reg in lane_regs(EX_MEM)) <= mem_ports
+            for index in range(len(lanes)):
+                bind_lane(index)
+                working_with_cache()
             print(stage_seperator)
 
-            write_back()
+            for index in range(len(lanes)):
+                bind_lane(index)
+                write_back()
+
+            if issue_unit is not None:
+                issued = lanes[0][ID_EX].nxt
+                if issued.valid and issued.seq in formed:
+                    issue_unit.issue(formed[issued.seq])
+                # only the packet waiting in IF/ID can still leave ID
+                waiting = lanes[0][IF_ID].nxt.seq
+                formed = {seq: window for seq, window in formed.items()
+                          if seq == waiting}
+        if dump_cache:
             # write data cache to file:
             with open('data_cache.txt', 'a', encoding='utf-8') as f:
                 f.write(str(data_cache))
                 f.write('\n')
 
+        # clock edge, every latch and the pc move forward together
+        commit_latches()
         print('\n\t', cycle_seperator, '\n')
-        update_mem_wb()
-        update_ex_mem()  # get from id_ex
-        update_id_ex()  # get from if_id
-        update_if_id()  # get from pc
-        k += 1
-        pc += 1
-    print('throughput:', inst_count /
-          ((total_pipeline_clocks+stall_count)*200e-12))
+        cycle += 1
+    bind(0)
+    for thread in threads[1:]:
+        thread.syscalls.flush()
+    syscalls.flush()
+    if metrics is not None:
+        metrics.sample(counters())
+    if cosim is not None and not truncated:
+        cosim.finish(cycle)
+    stats = {'cycles': cycle, 'instructions': retired,
+             'stall_count': stall_count, 'ipc': retired / max(cycle, 1),
+             'throughput': retired / (max(cycle, 1) * 200e-12),
+             'branches': branches, 'branch_flushes': branch_flushes,
+             'truncated': truncated}
+    stats.update(forwarding.stats())
+    stats.update(events.stats())
+    stats.update(syscalls.stats())
+    if vm is not None:
+        stats.update(vm.stats())
+    if issue_unit is not None:
+        stats.update(issue_unit.stats())
+    if scheduler is not None:
+        stats.update(scheduler.stats(cycle))
+    stats.update({f'dcache_{key}': val for key, val in data_cache.stats().items()})
+    return stats
+
+
+def _simulate() -> None:
+    try:
+        program = load_program()
+    except FileNotFoundError:
+        print('file not found')
+        return
+
+    stats = run_program(program, dump_cache=True)
+    print('throughput:', stats['throughput'])
     print(reg_file)
 
     input('Press any key to continue: ')